@@ -0,0 +1,202 @@
+# backends.py
+# Backends of the state (status, dataset) and of the transport (frames,
+# status changes) of the sessions, used by `utils`:
+#   + RedisBackend: the state is shared by the web server and the embedding
+#     worker processes, possibly on several hosts.
+#   + InMemoryBackend: the state is in the memory of the web server,
+#     the embedding runs in a thread of it (single-node without redis).
+#     The ndarrays are shared without copy, the frames are published as
+#     snapshots (not encoded, see `utils.publish_data`) and each subscriber
+#     keeps the last frames of a channel in a bounded ring.
+# The backend is chosen by the `TSNEX_BACKEND` environment variable
+# ('redis' by default or 'memory'), see `utils.get_backend`.
+#
+# A subscription is read as a redis pubsub: `get_message()` returns the next
+# message or None without blocking, `listen()` yields the messages until
+# the subscription is closed, and a message is a dict
+# {'type': 'message', 'channel': ..., 'data': ...}.
+
+import fnmatch
+import threading
+from collections import deque
+import numpy as np
+
+
+class RedisBackend(object):
+    """ State and transport in redis
+    """
+
+    # the embedding can run in a worker process
+    multiprocess = True
+
+    def __init__(self, host='localhost', port=6379, db=0,
+                 unix_socket_path=None):
+        super(RedisBackend, self).__init__()
+        import redis
+        if unix_socket_path:
+            self.redis_db = redis.StrictRedis(
+                unix_socket_path=unix_socket_path, db=db)
+        else:
+            self.redis_db = redis.StrictRedis(host=host, port=port, db=db)
+
+    def set(self, key, value):
+        self.redis_db.set(key, value)
+
+    def get(self, key):
+        return self.redis_db.get(key)
+
+    def delete_matching(self, pattern):
+        """ Delete all keys matching a glob-style pattern
+        """
+        keys = list(self.redis_db.scan_iter(match=pattern))
+        if keys:
+            self.redis_db.delete(*keys)
+
+    def set_array(self, key, arr):
+        self.redis_db.set(key, np.ascontiguousarray(arr).tobytes())
+
+    def get_array(self, key, shape, dtype):
+        return np.frombuffer(self.redis_db.get(key), dtype=np.dtype(dtype)) \
+            .reshape(shape)
+
+    def publish(self, channel, message):
+        self.redis_db.publish(channel, message)
+
+    def publish_frame(self, channel, message):
+        """ Publish a frame, which can be dropped by a slow subscriber
+        """
+        self.redis_db.publish(channel, message)
+
+    def subscribe(self, *channels):
+        pubsub = self.redis_db.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(*channels)
+        return pubsub
+
+
+class Subscription(object):
+    """ Messages of the channels subscribed in the in-memory backend.
+        Only the last `ring_size` frames of each channel are kept,
+        the other messages are never dropped.
+    """
+
+    def __init__(self, backend, channels, ring_size=4):
+        super(Subscription, self).__init__()
+        self.backend = backend
+        self.channels = set(channels)
+        self.ring_size = ring_size
+        self.messages = deque()
+        self.frames = {}
+        self.condition = threading.Condition()
+        self.closed = False
+
+    def put(self, channel, data, is_frame=False):
+        with self.condition:
+            if is_frame:
+                # the frames are in the order of the messages,
+                # drop the oldest frame of the channel if the ring is full
+                ring = self.frames.setdefault(channel, deque())
+                if len(ring) >= self.ring_size:
+                    self.messages.remove(ring.popleft())
+            msg = {'type': 'message', 'channel': channel, 'data': data}
+            if is_frame:
+                ring.append(msg)
+            self.messages.append(msg)
+            self.condition.notify()
+
+    def _pop(self):
+        msg = self.messages.popleft()
+        ring = self.frames.get(msg['channel'])
+        if ring and ring[0] is msg:
+            ring.popleft()
+        return msg
+
+    def get_message(self):
+        with self.condition:
+            return self._pop() if self.messages else None
+
+    def listen(self):
+        """ Yield the messages until the subscription is closed
+        """
+        while True:
+            with self.condition:
+                while not self.messages and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                msg = self._pop()
+            yield msg
+
+    def close(self):
+        """ Unsubscribe, a reader waiting in `listen` stops
+        """
+        self.backend.unsubscribe(self)
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class InMemoryBackend(object):
+    """ State and transport in the memory of this process
+    """
+
+    # the embedding must run in a thread of this process
+    multiprocess = False
+
+    def __init__(self, ring_size=4):
+        super(InMemoryBackend, self).__init__()
+        self.ring_size = ring_size
+        self.data = {}
+        self.subscriptions = []
+        self.lock = threading.Lock()
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = value
+
+    def get(self, key):
+        with self.lock:
+            return self.data.get(key)
+
+    def delete_matching(self, pattern):
+        """ Delete all keys matching a glob-style pattern
+        """
+        with self.lock:
+            for key in fnmatch.filter(list(self.data), pattern):
+                del self.data[key]
+
+    def set_array(self, key, arr):
+        """ Store a read-only copy of `arr`, which is then shared
+        """
+        arr = np.array(arr)
+        arr.flags.writeable = False
+        self.set(key, arr)
+
+    def get_array(self, key, shape, dtype):
+        return self.get(key).reshape(shape)
+
+    def _publish(self, channel, message, is_frame):
+        with self.lock:
+            subscriptions = [s for s in self.subscriptions
+                             if channel in s.channels]
+        for subscription in subscriptions:
+            subscription.put(channel, message, is_frame)
+
+    def publish(self, channel, message):
+        self._publish(channel, message, False)
+
+    def publish_frame(self, channel, message):
+        """ Publish a frame, which is dropped from the ring of a subscriber
+            when it has not read `ring_size` newer frames
+        """
+        self._publish(channel, message, True)
+
+    def subscribe(self, *channels):
+        subscription = Subscription(self, channels, self.ring_size)
+        with self.lock:
+            self.subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            if subscription in self.subscriptions:
+                self.subscriptions.remove(subscription)
@@ -0,0 +1,98 @@
+# test the in-memory backend of the sessions
+
+import threading
+import numpy as np
+
+import backends
+import utils
+
+
+def messages_of(subscription):
+    messages = []
+    msg = subscription.get_message()
+    while msg is not None:
+        messages.append((msg['channel'], msg['data']))
+        msg = subscription.get_message()
+    return messages
+
+
+def test_ring_keeps_the_newest_frames():
+    backend = backends.InMemoryBackend(ring_size=3)
+    subscription = backend.subscribe('frames', 'status')
+    backend.publish('status', 'first')
+    for i in range(5):
+        backend.publish_frame('frames', i)
+    backend.publish('status', 'last')
+
+    # the oldest frames are dropped, the other messages are kept in order
+    assert messages_of(subscription) == [
+        ('status', 'first'), ('frames', 2), ('frames', 3), ('frames', 4),
+        ('status', 'last')]
+
+    # the ring is emptied by the reader
+    for i in range(5, 7):
+        backend.publish_frame('frames', i)
+    assert messages_of(subscription) == [('frames', 5), ('frames', 6)]
+
+
+def test_close_stops_a_waiting_reader():
+    backend = backends.InMemoryBackend()
+    subscription = backend.subscribe('frames')
+    received = []
+    reader = threading.Thread(
+        target=lambda: received.extend(subscription.listen()))
+    reader.start()
+    backend.publish_frame('frames', 1)
+    threading.Timer(0.2, subscription.close).start()
+    reader.join(timeout=5.0)
+    assert not reader.is_alive()
+    assert [msg['data'] for msg in received] == [1]
+
+    # a closed subscription does not receive the messages
+    backend.publish_frame('frames', 2)
+    assert subscription.get_message() is None
+    assert backend.subscriptions == []
+
+
+def test_sessions_are_isolated(monkeypatch):
+    monkeypatch.setattr(utils, 'backend', backends.InMemoryBackend())
+    monkeypatch.setattr(utils, 'status_caches', {})
+    for session_id in ['s1', 's2']:
+        utils.set_server_status(session_id)
+        utils.set_ndarray('X_original', np.full(3, len(session_id)),
+                          session_id)
+    subscriptions = {session_id: utils.subscribe_data(session_id)
+                     for session_id in ['s1', 's2']}
+
+    utils.publish_data({'embedding': np.zeros((3, 2)), 'n_iter': 1}, 's1')
+    utils.update_server_status({'stop': True}, 's2')
+    data, status_changes = utils.get_subscribed_data(subscriptions['s1'])
+    assert data['n_iter'] == 1 and status_changes is None
+    data, status_changes = utils.get_subscribed_data(subscriptions['s2'])
+    assert data is None and status_changes == {'stop': True}
+    assert subscriptions['s1'].get_message() is None
+    assert subscriptions['s2'].get_message() is None
+
+    # cleaning a session keeps the data of the other one
+    utils.clean_data('s1')
+    assert utils.get_from_db('status', session_id='s1') is None
+    assert utils.get_server_status(['stop'], 's2')['stop'] is True
+    np.testing.assert_array_equal(
+        utils.get_ndarray('X_original', (3,), np.int64, 's2'), [2, 2, 2])
+
+
+def test_published_frame_is_a_snapshot(monkeypatch):
+    monkeypatch.setattr(utils, 'backend', backends.InMemoryBackend())
+    subscription = utils.subscribe_data('s1')
+    embedding, errors = np.zeros((3, 2)), [1.0]
+    utils.publish_data({'embedding': embedding,
+                        'seriesData': [{'name': 'errors',
+                                        'series': [errors]}]}, 's1')
+    # the embedding loop goes on changing its state
+    embedding += 1.0
+    errors.append(0.5)
+
+    data, _ = utils.get_subscribed_data(subscription)
+    np.testing.assert_array_equal(data['embedding'], np.zeros((3, 2)))
+    assert not data['embedding'].flags.writeable
+    assert data['seriesData'][0]['series'] == [[1.0]]
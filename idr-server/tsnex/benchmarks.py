@@ -0,0 +1,118 @@
+# benchmarks.py
+# Benchmarks of the optimizers and of the kernels, run with:
+#   python benchmarks.py methods [n_samples] [time_budget]
+#   python benchmarks.py parallel_exact [n_samples] [n_iter]
+# The dataset is the digits dataset resampled with noise to n_samples points.
+
+import sys
+import multiprocessing
+from time import time
+import numpy as np
+from sklearn.datasets import load_digits
+from sklearn.neighbors import NearestNeighbors
+
+import kl_kernels
+import joint_probabilities
+from engine import InteractiveTSNE
+from parallel_kl import ParallelExactKL
+
+
+def noisy_digits(n_samples, noise=2.0, random_state=0):
+    """ The digits resampled to `n_samples` points with gaussian noise
+    Returns:
+        X (ndarray), y (ndarray)
+    """
+    digits = load_digits()
+    random_state = np.random.RandomState(random_state)
+    ids = random_state.randint(digits.data.shape[0], size=n_samples)
+    X = digits.data[ids] + noise * random_state.randn(n_samples, 64)
+    return X, digits.target[ids]
+
+
+def neighbors_of(X, k=10):
+    """ k nearest neighbors of each point, without itself
+    """
+    _, neighbors = NearestNeighbors(n_neighbors=k + 1).fit(X).kneighbors(X)
+    return neighbors[:, 1:]
+
+
+def embedding_quality(Y, P, knn_X, y):
+    """ Quality of an embedding Y of shape (n_samples, 2)
+    Returns:
+        kl (float): the KL divergence (Barnes-Hut) with the sparse P
+        recall (float): ratio of the 10 nearest neighbors in high dim
+            which are in the 10 nearest neighbors in the embedding
+        accuracy (float): ratio of the 10 nearest neighbors in the embedding
+            of the same label
+    """
+    knn_Y = neighbors_of(Y, knn_X.shape[1])
+    recall = np.mean([np.intersect1d(a, b).shape[0]
+                      for a, b in zip(knn_X, knn_Y)]) / knn_X.shape[1]
+    accuracy = np.mean(y[knn_Y] == y[:, None])
+    kl = kl_kernels.kl_divergence_bh(
+        np.ravel(Y).astype(np.float64), P, 1.0, Y.shape[0], 2)[0]
+    return kl, recall, accuracy
+
+
+def benchmark_methods(methods, n_samples=20000, time_budget=60.0):
+    """ Quality of the embedding of each method after a quarter,
+        half and all of the time budget (in seconds)
+    """
+    X, y = noisy_digits(n_samples)
+    knn_X = neighbors_of(X)
+    P = joint_probabilities.joint_probabilities_nn(X)
+    for method in methods:
+        engine = InteractiveTSNE(X, method=method)
+        start, durations = time(), []
+        for budget in [time_budget / 4, time_budget / 2, time_budget]:
+            while time() - start < budget:
+                tic = time()
+                engine.step()
+                durations.append(time() - tic)
+            print("{:>12} {:6.1f}s {:5d} iterations ({:.3f}s each) "
+                  "KL {:.3f} recall@10 {:.3f} accuracy@10 {:.3f}".format(
+                      method, time() - start, engine.n_iter,
+                      np.median(durations),
+                      *embedding_quality(engine.p.reshape(-1, 2), P,
+                                         knn_X, y)))
+        engine.close()
+
+
+def benchmark_parallel_exact(n_samples=5000, n_iter=10,
+                             n_jobs_list=(1, 2, 4)):
+    """ Time of an iteration of the exact kernel in the main process
+        and split over pools of spawned workers, with their speedup
+    """
+    X, _ = noisy_digits(n_samples)
+    P = joint_probabilities.joint_probabilities(X, 30.0)
+    params = np.random.RandomState(0).randn(n_samples * 2)
+    args = (None, 1.0, n_samples, 2)
+    context = multiprocessing.get_context('spawn')
+    print("{} cpus".format(multiprocessing.cpu_count()))
+
+    def time_of(kernel):
+        kernel(params, *args)
+        tic = time()
+        for _ in range(n_iter):
+            kernel(params, *args)
+        return (time() - tic) / n_iter
+
+    reference = time_of(kl_kernels.ExactKL(P))
+    print("{:>12} {:.3f}s".format('ExactKL', reference))
+    for n_jobs in n_jobs_list:
+        kernel = ParallelExactKL(P, n_jobs, context=context)
+        try:
+            duration = time_of(kernel)
+        finally:
+            kernel.close()
+        print("{:>9} x{:d} {:.3f}s speedup {:.2f}".format(
+            'workers', n_jobs, duration, reference / duration))
+
+
+if __name__ == '__main__':
+    if sys.argv[1] == 'parallel_exact':
+        benchmark_parallel_exact(*[int(arg) for arg in sys.argv[2:4]])
+    else:
+        benchmark_methods(sys.argv[1].split(','),
+                          *[int(arg) for arg in sys.argv[2:3]],
+                          *[float(arg) for arg in sys.argv[3:4]])
@@ -0,0 +1,125 @@
+# constraints.py
+# Penalty of the constraints of the client on the embedding:
+#   + the neighbors of a fixed (moved) point should stay close to it,
+#   + must-link pairs should be close, cannot-link pairs should be far apart
+#     (e.g. the constraints generated in `validate_contraints`).
+#     The repulsion of the cannot-links is bounded (it vanishes for coincident
+#     points and far apart points), so that a cannot-link between two close
+#     points does not throw them out of the embedding.
+# Each set of pairs is a sparse incidence matrix B of shape (n_pairs, n_samples)
+# with B[k, j] = 1 and B[k, i] = -1 for the pair k = (i, j), so that
+# B.dot(Y) gives y_j - y_i of all pairs and B.T.dot(F) sums the forces F
+# of the pairs on each point: the value and the gradient of the penalty
+# are a few vectorized operations for any number of constraints.
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+def incidence_matrix(pairs, n_samples):
+    """ Sparse incidence matrix of the pairs (i, j) of shape (n_pairs, 2)
+    """
+    pairs = np.asarray(pairs, dtype=int).reshape(-1, 2)
+    n_pairs = pairs.shape[0]
+    data = np.tile([-1.0, 1.0], n_pairs)
+    return csr_matrix((data, pairs.ravel(), np.arange(0, 2 * n_pairs + 1, 2)),
+                      shape=(n_pairs, n_samples))
+
+
+class ConstraintPenalty(object):
+    """ Penalty of the fixed points and pairwise links, called by the kernels
+        of `kl_kernels` to add its gradient into the gradient of KL:
+        penalty = constraints(X_embedded, grad)
+
+        Attracted pairs (neighbors of fixed points, must-links) use the
+        neg. log likelihood of student-t distribution:
+            log(1 + ||y_i - y_j||^2 / sigma^2)
+        Cannot-links use the student-t similarity of the pair:
+            sigma_cl^2 / (||y_i - y_j||^2 + sigma_cl^2)
+        of which the force is at most ~0.65 * weight / sigma_cl.
+    """
+
+    def __init__(self, n_samples, sigma_square=1e5,
+                 cannot_link_sigma_square=100.0, cannot_link_weight=1.0):
+        """ Empty set of constraints
+        Args:
+            n_samples (int): number of points of the embedding
+            sigma_square (float): scale of the attraction
+            cannot_link_sigma_square (float): squared distance under which
+                the cannot-link pairs are repulsed
+            cannot_link_weight (float): weight of the cannot-link penalty
+        """
+        super(ConstraintPenalty, self).__init__()
+        self.n_samples = n_samples
+        self.sigma_square = sigma_square
+        self.cannot_link_sigma_square = cannot_link_sigma_square
+        self.cannot_link_weight = cannot_link_weight
+
+        self.fixed_ids = []
+        self.fixed_pairs = np.empty((0, 2), dtype=int)
+        self.mustlinks = np.empty((0, 2), dtype=int)
+        self.cannotlinks = np.empty((0, 2), dtype=int)
+        self.attract = None
+        self.repulse = None
+
+    def set_fixed_points(self, fixed_ids, neighbor_ids):
+        """ The neighbors `neighbor_ids[k]` of each fixed point `fixed_ids[k]`
+            are attracted to it, the gradient of the fixed points is zero.
+        """
+        self.fixed_ids = list(fixed_ids)
+        if self.fixed_ids:
+            neighbor_ids = np.asarray(neighbor_ids, dtype=int) \
+                .reshape(len(self.fixed_ids), -1)
+            self.fixed_pairs = np.column_stack([
+                np.repeat(self.fixed_ids, neighbor_ids.shape[1]),
+                neighbor_ids.ravel()])
+        else:
+            self.fixed_pairs = np.empty((0, 2), dtype=int)
+        self._build()
+
+    def set_links(self, mustlinks=None, cannotlinks=None):
+        """ Set the must-link and cannot-link pairs of shape (n_links, 2)
+        """
+        if mustlinks is not None:
+            self.mustlinks = np.asarray(mustlinks, dtype=int).reshape(-1, 2)
+        if cannotlinks is not None:
+            self.cannotlinks = np.asarray(cannotlinks, dtype=int).reshape(-1, 2)
+        self._build()
+
+    def _build(self):
+        attracted = np.vstack([self.fixed_pairs, self.mustlinks])
+        self.attract = incidence_matrix(attracted, self.n_samples) \
+            if attracted.shape[0] else None
+        self.repulse = incidence_matrix(self.cannotlinks, self.n_samples) \
+            if self.cannotlinks.shape[0] else None
+
+    def __call__(self, X_embedded, grad):
+        """ Add the gradient of the penalty into `grad` (of shape (n, 2)),
+            set the gradient of the fixed points to zero
+        Returns:
+            neg_log_likelihood (float): value of the penalty
+        """
+        neg_log_likelihood = 0.0
+
+        if self.attract is not None:
+            diff = self.attract.dot(X_embedded)
+            diff_norm = np.einsum('ij,ij->i', diff, diff)
+            diff_norm /= self.sigma_square
+            diff_norm += 1.0
+            neg_log_likelihood += np.sum(np.log(diff_norm))
+            forces = diff * ((2.0 / self.sigma_square) / diff_norm)[:, None]
+            grad += self.attract.T.dot(forces)
+
+        if self.repulse is not None:
+            diff = self.repulse.dot(X_embedded)
+            sigma_square = self.cannot_link_sigma_square
+            q = sigma_square / (np.einsum('ij,ij->i', diff, diff) +
+                                sigma_square)
+            neg_log_likelihood += self.cannot_link_weight * np.sum(q)
+            forces = diff * (-2.0 * self.cannot_link_weight / sigma_square *
+                             q * q)[:, None]
+            grad += self.repulse.T.dot(forces)
+
+        if self.fixed_ids:
+            grad[self.fixed_ids] = 0.0
+        return neg_log_likelihood
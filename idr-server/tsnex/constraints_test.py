@@ -0,0 +1,63 @@
+# test the penalty of the constraints of the client
+
+import numpy as np
+from sklearn.datasets import make_blobs
+
+import p_cache
+from constraints import ConstraintPenalty
+from engine import InteractiveTSNE
+
+
+def numerical_gradient(constraints, Y, eps=1e-6):
+    grad = np.zeros_like(Y)
+    for idx in np.ndindex(*Y.shape):
+        Y_plus, Y_minus = Y.copy(), Y.copy()
+        Y_plus[idx] += eps
+        Y_minus[idx] -= eps
+        grad[idx] = (constraints(Y_plus, np.zeros_like(Y)) -
+                     constraints(Y_minus, np.zeros_like(Y))) / (2 * eps)
+    return grad
+
+
+def test_gradient_of_links():
+    random_state = np.random.RandomState(0)
+    Y = random_state.randn(20, 2) * 5
+    constraints = ConstraintPenalty(20, sigma_square=10.0,
+                                    cannot_link_sigma_square=4.0)
+    constraints.set_links(mustlinks=[[0, 1], [2, 3]],
+                          cannotlinks=[[4, 5], [6, 7], [4, 8]])
+    grad = np.zeros_like(Y)
+    constraints(Y, grad)
+    np.testing.assert_allclose(grad, numerical_gradient(constraints, Y),
+                               atol=1e-7)
+
+
+def test_cannot_link_force_is_bounded():
+    constraints = ConstraintPenalty(2, cannot_link_sigma_square=100.0)
+    constraints.set_links(cannotlinks=[[0, 1]])
+    for dist in [0.0, 1e-12, 1e-6, 1e-3, 1.0, 10.0, 1e3]:
+        grad = np.zeros((2, 2))
+        penalty = constraints(np.array([[0.0, 0.0], [dist, 0.0]]), grad)
+        assert np.isfinite(penalty) and penalty <= 1.0
+        assert np.abs(grad).max() <= 0.65 / 10.0
+
+
+def test_cannot_link_on_close_points_keeps_embedding_bounded(tmpdir,
+                                                              monkeypatch):
+    monkeypatch.setattr(p_cache, 'CACHE_DIR', str(tmpdir))
+    X, _ = make_blobs(n_samples=150, centers=3, random_state=0)
+    for method in ['exact', 'barnes_hut']:
+        engine = InteractiveTSNE(X, method=method, n_iter_exaggeration=50)
+        engine.step(150)
+        Y = engine.p.reshape(-1, 2)
+        extent = np.ptp(Y, axis=0).max()
+
+        # the two closest points must be far apart
+        _, neighbors = engine.index.knn(k=1)
+        i = int(np.argmin(np.linalg.norm(Y - Y[neighbors[:, 0]], axis=1)))
+        engine.set_links(cannotlinks=[[i, int(neighbors[i, 0])]])
+        # the pair overshoots with the momentum, then the embedding settles
+        for _ in range(150):
+            engine.step()
+            assert np.ptp(Y, axis=0).max() < 2.5 * extent
+        assert np.ptp(Y, axis=0).max() < 1.6 * extent
@@ -0,0 +1,47 @@
+# convergence.py
+# Detect the plateau of the optimization, so that the interactive loop
+# can stop computing until the client interacts again.
+
+
+class ConvergenceMonitor(object):
+    """ The optimization has converged when the error (KL + penalty) is not
+        improved by a relative `min_improvement` during
+        `n_iter_without_progress` iterations, or when the gradient norm
+        is smaller than `min_grad_norm`.
+    """
+
+    def __init__(self, n_iter_without_progress=300, min_improvement=1e-4,
+                 min_grad_norm=1e-7):
+        super(ConvergenceMonitor, self).__init__()
+        self.n_iter_without_progress = n_iter_without_progress
+        self.min_improvement = min_improvement
+        self.min_grad_norm = min_grad_norm
+        self.reset()
+
+    def reset(self):
+        """ Restart monitoring, e.g. when the client has interacted
+        """
+        self.best_error = float('inf')
+        self.n_iter_since_best = 0
+        self.converged = False
+        self.reason = None
+
+    def update(self, error, grad_norm):
+        """ Monitor the error and gradient norm of one iteration
+        Returns:
+            converged (bool): whether the plateau has been reached
+        """
+        if error < self.best_error * (1.0 - self.min_improvement):
+            self.best_error = error
+            self.n_iter_since_best = 0
+        else:
+            self.n_iter_since_best += 1
+
+        if self.n_iter_since_best > self.n_iter_without_progress:
+            self.converged = True
+            self.reason = "did not make any progress during the last {} " \
+                "iterations".format(self.n_iter_without_progress)
+        elif grad_norm <= self.min_grad_norm:
+            self.converged = True
+            self.reason = "gradient norm {}".format(grad_norm)
+        return self.converged
@@ -0,0 +1,41 @@
+# test the detection of the plateau of the optimization
+
+from convergence import ConvergenceMonitor
+
+
+def test_converged_after_n_iter_without_progress():
+    monitor = ConvergenceMonitor(n_iter_without_progress=10)
+    for i in range(20):
+        assert not monitor.update(2.0 - 0.01 * i, grad_norm=1.0)
+
+    # an improvement smaller than `min_improvement` is not a progress
+    for i in range(10):
+        assert not monitor.update(1.81 - 1e-6 * i, grad_norm=1.0)
+    assert monitor.update(1.81, grad_norm=1.0)
+    assert monitor.converged
+    assert "10 iterations" in monitor.reason
+
+
+def test_converged_on_small_gradient():
+    monitor = ConvergenceMonitor(min_grad_norm=1e-7)
+    assert not monitor.update(1.0, grad_norm=1e-6)
+    assert monitor.update(0.5, grad_norm=1e-8)
+    assert "gradient norm" in monitor.reason
+
+
+def test_reset_when_the_client_interacts():
+    monitor = ConvergenceMonitor(n_iter_without_progress=5)
+    for _ in range(7):
+        monitor.update(1.0, grad_norm=1.0)
+    assert monitor.converged
+
+    # the error of the moved points is higher than the best one before,
+    # it is the new reference after the reset
+    monitor.reset()
+    assert not monitor.converged and monitor.reason is None
+    for i in range(6):
+        assert not monitor.update(3.0 - 0.1 * i, grad_norm=1.0)
+    assert monitor.best_error == 2.5
+    for _ in range(5):
+        assert not monitor.update(2.5, grad_norm=1.0)
+    assert monitor.update(2.5, grad_norm=1.0)
@@ -0,0 +1,330 @@
+# engine.py
+# Interactive t-SNE engine which owns P, the embedding and the state of
+# the optimizer (gains and momentum), and is driven step by step.
+# Several independent embeddings can run in the same process.
+
+import os
+from functools import partial
+import numpy as np
+import kl_kernels
+import neg_sampling
+import parallel_kl
+import joint_probabilities
+import p_cache
+from constraints import ConstraintPenalty
+from spatial_index import SpatialIndex
+
+# with the 'auto' method, the exact kernel is used up to this number of
+# points (~0.02s per iteration at 2k points), the fft kernel beyond it
+AUTO_EXACT_MAX_SAMPLES = 2000
+
+
+def method_for(method, n_samples):
+    """ Kernel of the gradient for a dataset of `n_samples` points
+    Args:
+        method (str): 'auto' or the name of a kernel
+        n_samples (int): number of points
+    Returns:
+        the name of the kernel
+    """
+    if method != 'auto':
+        return method
+    return 'exact' if n_samples <= AUTO_EXACT_MAX_SAMPLES else 'fft'
+
+
+class InteractiveTSNE(object):
+    """ Gradient descent of t-SNE with the fixed points of the client.
+        The optimization starts with an early exaggeration stage of
+        `n_iter_exaggeration` iterations and runs as long as it is stepped:
+        engine = InteractiveTSNE(X)
+        engine.step(10)
+        engine.apply_fixed_points(fixed_ids, fixed_pos)
+        embedding = engine.snapshot()['embedding']
+    """
+
+    def __init__(self, X, method='auto', perplexity=30.0,
+                 early_exaggeration=12.0, n_iter_exaggeration=150,
+                 learning_rate=100.0, momentum=0.8,
+                 exaggeration_momentum=0.5, min_gain=0.01,
+                 angle=0.5, n_jobs=1, precision='float64', random_state=0,
+                 context=None):
+        """ Calculate P and initialize the embedding randomly
+        Args:
+            X (ndarray): the original data of shape (n_samples, n_features)
+            method (str): kernel of the gradient: 'auto', 'exact',
+                'barnes_hut', 'fft' or 'neg_sampling',
+                see `utils.initial_server_status`
+            perplexity (float): perplexity of the gaussian kernel in high dim
+            early_exaggeration (float): factor of P in the first stage
+            n_iter_exaggeration (int): number of iterations of the first stage
+            learning_rate (float): learning rate of the gradient descent
+            momentum (float): momentum after the first stage
+            exaggeration_momentum (float): momentum in the first stage
+            min_gain (float): min gain of each parameter
+            angle (float): trade-off between speed and accuracy of barnes_hut
+            n_jobs (int): number of worker processes of the exact kernel
+            precision (str): 'float64' or 'float32'
+            random_state (int): seed of the initial embedding
+            context: multiprocessing context to start the worker processes
+        """
+        super(InteractiveTSNE, self).__init__()
+
+        self.dtype = np.dtype(precision)
+        self.X = X.astype(self.dtype, copy=False)
+        self.n_samples = X.shape[0]
+        self.n_components = 2
+        self.degrees_of_freedom = max(self.n_components - 1, 1)
+
+        self.method = method = method_for(method, self.n_samples)
+        self.early_exaggeration = early_exaggeration
+        self.n_iter_exaggeration = n_iter_exaggeration
+        self.learning_rate = learning_rate
+        self.momentum = momentum
+        self.exaggeration_momentum = exaggeration_momentum
+        self.min_gain = min_gain
+        self.angle = angle
+        self.n_jobs = n_jobs
+        self.context = context
+
+        # the exact kernel needs P over all pairs, the other kernels work with
+        # a sparse P over the 3 * perplexity nearest neighbors of each point.
+        # P is only calculated once for each dataset and perplexity
+        if method == 'exact':
+            self.P = p_cache.get_P(
+                self.X, perplexity, None,
+                partial(joint_probabilities.joint_probabilities,
+                        self.X, perplexity))
+        else:
+            self.P = p_cache.get_P(
+                self.X, perplexity,
+                joint_probabilities.n_neighbors_of(self.n_samples, perplexity),
+                partial(joint_probabilities.joint_probabilities_nn,
+                        self.X, perplexity))
+        self.P = self.P.astype(self.dtype, copy=False)
+
+        random_state = np.random.RandomState(random_state)
+        self.p = 1e-4 * random_state.randn(self.n_samples * self.n_components)
+        self.p = self.p.astype(self.dtype)
+        self.update = np.zeros_like(self.p)
+        self.gains = np.ones_like(self.p)
+        self.inc = np.empty(self.p.shape, dtype=bool)
+        self.dec = np.empty(self.p.shape, dtype=bool)
+        # neighbor searches in the embedding, rebuilt when the points moved
+        self.index = SpatialIndex(self.p.reshape(-1, 2))
+
+        self.n_iter = 0
+        self.error = np.finfo(np.double).max
+        self.penalty = 0.0
+        self.grad_norm = 0.0
+        self.z_info = np.zeros(self.n_samples, dtype=self.dtype)
+
+        # the fixed points and the links given by the client
+        self.fixed_ids = []
+        self.fixed_pos = []
+        self.constraints = ConstraintPenalty(self.n_samples)
+
+        # the kernel of the current stage, see `_get_objective`
+        self.sampler = None
+        self.objective = None
+        self.objective_args = []
+        self.objective_exaggerated = None
+
+    @property
+    def in_early_exaggeration(self):
+        return self.n_iter < self.n_iter_exaggeration
+
+    def _get_objective(self):
+        """ Create the kernel of the current stage,
+            the exaggerated P is only used in the first stage.
+        """
+        exaggerated = self.in_early_exaggeration
+        if self.objective is not None \
+                and self.objective_exaggerated == exaggerated:
+            return self.objective, self.objective_args
+        self.close()
+
+        P = self.P
+        if exaggerated and self.method != 'neg_sampling':
+            P = P * self.early_exaggeration
+        args = [P, self.degrees_of_freedom, self.n_samples, self.n_components]
+
+        if self.method == 'exact' and self.n_jobs > 1:
+            objective = parallel_kl.ParallelExactKL(P, self.n_jobs,
+                                                    context=self.context)
+        elif self.method == 'exact':
+            objective = kl_kernels.ExactKL(P)
+        elif self.method == 'neg_sampling':
+            # the sampler keeps its learning rate schedule between the stages
+            if self.sampler is None:
+                self.sampler = neg_sampling.NegativeSampling(
+                    P, penalty_learning_rate=self.learning_rate)
+            objective = self.sampler.epoch
+            args = []
+        elif self.method == 'fft':
+            objective = kl_kernels.kl_divergence_fft
+        else:
+            objective = partial(kl_kernels.kl_divergence_bh, angle=self.angle)
+
+        self.objective = objective
+        self.objective_args = args
+        self.objective_exaggerated = exaggerated
+        return objective, args
+
+    def step(self, n_steps=1):
+        """ Run `n_steps` iterations of the gradient descent
+        Returns:
+            error (float): the KL divergence (with the penalty)
+                of the last iteration
+        """
+        for _ in range(n_steps):
+            momentum = self.exaggeration_momentum \
+                if self.in_early_exaggeration else self.momentum
+            objective, args = self._get_objective()
+
+            # calculate gradient and KL divergence,
+            # in neg_sampling mode, one epoch which moves the points in place
+            error, penalty, grad, divergences = objective(
+                self.p, *args, constraints=self.constraints)
+            self.z_info += divergences
+
+            # calculate the magnitude of gradient of each point
+            grad_per_point = np.linalg.norm(grad.reshape(-1, 2), axis=1)
+            self.grad_norm = float(np.sum(grad_per_point))
+
+            if self.method != 'neg_sampling':
+                # tsne update gradient by momentum
+                np.less(self.update * grad, 0.0, out=self.inc)
+                np.invert(self.inc, out=self.dec)
+                self.gains[self.inc] += 0.2
+                self.gains[self.dec] *= 0.8
+                np.clip(self.gains, self.min_gain, np.inf, out=self.gains)
+                grad *= self.gains
+                grad *= self.learning_rate
+                self.update *= momentum
+                self.update -= grad
+                self.p += self.update
+
+            # manual fix the pos of moved point
+            if self.fixed_ids and self.fixed_pos:
+                self.p.reshape(-1, 2)[self.fixed_ids] = self.fixed_pos
+
+            self.error, self.penalty = float(error), float(penalty)
+            self.n_iter += 1
+            self.index.invalidate()
+        return self.error
+
+    def apply_fixed_points(self, fixed_ids=None, fixed_pos=None,
+                           n_neighbors=None):
+        """ Move the fixed points to their positions and find their neighbors
+            in the current embedding, which are attracted by the penalty.
+        Args:
+            fixed_ids (list): ids of the fixed points, None to keep the
+                current ones and only update their neighbors
+            fixed_pos (list): their positions, [[x, y], ...]
+            n_neighbors (int): number of neighbors of each fixed point,
+                5% of the points by default
+        """
+        if fixed_ids is not None:
+            self.fixed_ids = fixed_ids
+            self.fixed_pos = fixed_pos
+        if not (self.fixed_ids and self.fixed_pos):
+            self.constraints.set_fixed_points([], [])
+            return
+
+        # the neighbors are found in the old embedding
+        if n_neighbors is None:
+            n_neighbors = int(0.05 * self.n_samples)
+        _, knn = self.index.knn(self.fixed_ids, n_neighbors)
+        self.constraints.set_fixed_points(self.fixed_ids, knn)
+
+        # update position of the newly moved points
+        self.p.reshape(-1, 2)[self.fixed_ids] = self.fixed_pos
+        self.index.invalidate()
+
+    def set_links(self, mustlinks=None, cannotlinks=None):
+        """ Pairs of points which must be close (must-links)
+            or far apart (cannot-links), of shape (n_links, 2)
+        """
+        self.constraints.set_links(mustlinks, cannotlinks)
+
+    def snapshot(self):
+        """ Copy of the current state to be measured or sent to the client
+        Returns:
+            dict of the embedding of shape (n_samples, 2), z_info,
+            the number of iterations, the error, penalty and gradient norm
+        """
+        return {
+            'embedding': self.p.reshape(-1, 2).copy(),
+            'z_info': self.z_info.copy(),
+            'n_iter': self.n_iter,
+            'error': float(self.error),
+            'penalty': float(self.penalty),
+            'grad_norm': self.grad_norm
+        }
+
+    def save_checkpoint(self, file_name, **extra):
+        """ Save the full state of the optimizer into a binary file (.npz).
+            The file is written next to the old one and then renamed,
+            so a crash while saving keeps the previous checkpoint.
+        Args:
+            file_name (str): path of the checkpoint
+            extra (ndarray or list): other arrays to save with the state
+        """
+        state = {
+            'p': self.p,
+            'update': self.update,
+            'gains': self.gains,
+            'z_info': self.z_info,
+            'n_iter': self.n_iter,
+            'error': self.error,
+            'fixed_ids': np.array(self.fixed_ids, dtype=int),
+            'fixed_pos': np.array(self.fixed_pos, dtype=self.dtype),
+            'mustlinks': self.constraints.mustlinks,
+            'cannotlinks': self.constraints.cannotlinks,
+            'sampler_epoch': 0 if self.sampler is None \
+                else self.sampler.epoch_count
+        }
+        state.update(('extra_' + name, arr) for name, arr in extra.items())
+
+        tmp_file_name = file_name + '.tmp'
+        with open(tmp_file_name, 'wb') as out_file:
+            np.savez(out_file, **state)
+        os.replace(tmp_file_name, file_name)
+
+    def load_checkpoint(self, file_name):
+        """ Restore the state of the optimizer from a checkpoint
+            of the same dataset
+        Returns:
+            extra (dict): the other arrays saved with the state
+        """
+        with np.load(file_name) as state:
+            if state['p'].shape != self.p.shape:
+                raise ValueError("The checkpoint {} is not of this dataset"
+                                 .format(file_name))
+            self.close()
+            self.p[:] = state['p']
+            self.update[:] = state['update']
+            self.gains[:] = state['gains']
+            self.z_info[:] = state['z_info']
+            self.n_iter = int(state['n_iter'])
+            self.error = float(state['error'])
+            self.fixed_ids = state['fixed_ids'].tolist()
+            self.fixed_pos = state['fixed_pos'].tolist()
+            self.set_links(state['mustlinks'], state['cannotlinks'])
+            self.index.invalidate()
+            self.apply_fixed_points()
+
+            if self.method == 'neg_sampling':
+                self._get_objective()
+                self.sampler.epoch_count = int(state['sampler_epoch'])
+
+            return {name[len('extra_'):]: state[name] for name in state.files
+                    if name.startswith('extra_')}
+
+    def close(self):
+        """ Release the kernel of the current stage
+            (stop the worker processes of the parallel kernel)
+        """
+        if hasattr(self.objective, 'close'):
+            self.objective.close()
+        self.objective = None
@@ -0,0 +1,188 @@
+# fft_repulsion.py
+# Approximate the repulsive forces in t-SNE by interpolating the kernel
+# on a regular 2D grid and convolving it with FFT, see:
+# [1] Fast interpolation-based t-SNE for improved visualization of single-cell
+#   RNA-seq data (Linderman et al., 2019)
+# The embedding space is split into square boxes, each box holds
+# a few equispaced interpolation nodes. The charges of the points are spread
+# onto the nodes with Lagrange polynomials, the interactions between the nodes
+# are a convolution since the grid is regular, and the potentials are
+# interpolated back to the points with the same polynomials.
+
+import numpy as np
+
+# the spectra of the kernels of the last grid, see `kernel_spectra`
+_spectra_cache = {}
+
+# the box width is rounded to a power of 2 ** (1 / BOX_WIDTH_STEPS),
+# so the grid (and the spectra of the kernels) only changes
+# every few iterations while the embedding grows
+BOX_WIDTH_STEPS = 16
+
+
+def lagrange_weights(t, n_interpolation_points):
+    """ Weights of the Lagrange polynomials at relative positions `t`
+        in [0, 1] of a box, with equispaced nodes at (k + 0.5) / n in the box.
+    Returns:
+        weights (ndarray): of shape (len(t), n_interpolation_points)
+    """
+    nodes = (np.arange(n_interpolation_points) + 0.5) / n_interpolation_points
+    weights = np.ones((t.shape[0], n_interpolation_points), dtype=t.dtype)
+    for k in range(n_interpolation_points):
+        for m in range(n_interpolation_points):
+            if m != k:
+                weights[:, k] *= (t - nodes[m]) / (nodes[k] - nodes[m])
+    return weights
+
+
+def kernel_spectra(n_grid, node_spacing, degrees_of_freedom, dtype):
+    """ 2D FFT of the kernels of Z and of the forces between the nodes,
+        in the layout of a circular convolution of size 2 * n_grid
+        (zero-padded charges). They only depend on the grid,
+        the spectra of the last grid are kept.
+    Returns:
+        spectrum_Z, spectrum_F (ndarray): of shape (2 * n_grid, n_grid + 1)
+    """
+    key = (n_grid, node_spacing, degrees_of_freedom, np.dtype(dtype).str)
+    if key not in _spectra_cache:
+        _spectra_cache.clear()
+        offsets = np.arange(2 * n_grid)
+        offsets[n_grid:] -= 2 * n_grid
+        offsets = (offsets * node_spacing).astype(dtype)
+        dist2 = offsets[:, None] ** 2 + offsets[None, :] ** 2
+        kernel_Z = degrees_of_freedom / (degrees_of_freedom + dist2)
+        if degrees_of_freedom != 1:
+            kernel_Z **= (degrees_of_freedom + 1.0) / 2.0
+        _spectra_cache[key] = (np.fft.rfft2(kernel_Z),
+                               np.fft.rfft2(kernel_Z * kernel_Z))
+    return _spectra_cache[key]
+
+
+def fast_sizes(max_size):
+    """ Sizes up to `max_size` of which the factors are 2, 3 and 5,
+        the FFT of a grid of such a number of boxes is the fastest
+    """
+    sizes = [1]
+    for factor in (2, 3, 5):
+        sizes = [size * factor ** k for size in sizes
+                 for k in range(int(np.log(max_size) / np.log(factor)) + 1)
+                 if size * factor ** k <= max_size]
+    return np.array(sorted(sizes))
+
+
+def grid_of(extent, min_num_intervals, intervals_per_integer,
+            max_num_intervals):
+    """ Number and width of the boxes covering `extent`. The width is rounded
+        down to a power of 2 ** (1 / BOX_WIDTH_STEPS) and the number of boxes
+        is rounded up to one of `fast_sizes`, or down with a wider box
+        when there would be more than `max_num_intervals` boxes.
+    Returns:
+        n_boxes (int), box_width (float)
+    """
+    extent = extent * (1.0 + 1e-6)
+    n_boxes = min(max_num_intervals, max(
+        min_num_intervals, int(np.ceil(extent / intervals_per_integer))))
+    exponent = np.log2(extent / n_boxes) * BOX_WIDTH_STEPS
+    box_width = 2.0 ** (np.floor(exponent) / BOX_WIDTH_STEPS)
+    sizes = fast_sizes(2 * max(max_num_intervals, min_num_intervals))
+    n_boxes = sizes[np.searchsorted(sizes, np.ceil(extent / box_width))]
+    if n_boxes > max_num_intervals:
+        n_boxes = sizes[np.searchsorted(sizes, max_num_intervals,
+                                        side='right') - 1]
+        exponent = np.log2(extent / n_boxes) * BOX_WIDTH_STEPS
+        box_width = 2.0 ** (np.ceil(exponent) / BOX_WIDTH_STEPS)
+    return int(n_boxes), box_width
+
+
+def repulsive_forces(Y, degrees_of_freedom=1.0, n_interpolation_points=3,
+                     min_num_intervals=50, intervals_per_integer=1.0,
+                     max_num_intervals=500, skip_num_points=0):
+    """ Approximate the (unnormalized) repulsive forces and
+        the normalization term Z = \sum_{i != j} q_{ij}Z
+
+        F_i = \sum_{j != i} (q_{ij}Z)^2 (y_i - y_j)
+
+    Args:
+        Y (ndarray): embedding of shape (n_samples, 2)
+        degrees_of_freedom (float): degree of freedom of student-t kernel
+        n_interpolation_points (int): number of nodes per box in each axis
+        min_num_intervals (int): min number of boxes in each axis
+        intervals_per_integer (float): max width of a box
+        max_num_intervals (int): max number of boxes in each axis, so the
+            grid of a spread embedding fits in memory (~700MB for 500 boxes).
+            Beyond it the boxes get wider than `intervals_per_integer`,
+            which is less accurate as the kernel varies within a box
+        skip_num_points (int): do not calculate forces for these points
+    Returns:
+        neg_f (ndarray): repulsive forces of shape (n_samples, 2)
+        sum_Q (float): the normalization term Z
+    """
+    n_samples = Y.shape[0]
+    n_interp = n_interpolation_points
+
+    # square boxes covering the embedding
+    min_pos = Y.min(axis=0)
+    extent = max(float(np.max(Y.max(axis=0) - min_pos)), 1e-12)
+    n_boxes, box_width = grid_of(extent, min_num_intervals,
+                                 intervals_per_integer, max_num_intervals)
+    n_grid = n_boxes * n_interp
+
+    # the box of each point and its interpolation weights in each axis
+    rel_pos = (Y - min_pos) / box_width
+    boxes = np.minimum(rel_pos.astype(np.int64), n_boxes - 1)
+    wx = lagrange_weights(rel_pos[:, 0] - boxes[:, 0], n_interp)
+    wy = lagrange_weights(rel_pos[:, 1] - boxes[:, 1], n_interp)
+
+    # flat index of the n_interp x n_interp nodes around each point
+    gx = boxes[:, 0:1] * n_interp + np.arange(n_interp)
+    gy = boxes[:, 1:2] * n_interp + np.arange(n_interp)
+    node_ids = (gx[:, :, None] * n_grid + gy[:, None, :]).reshape(n_samples, -1)
+    node_weights = (wx[:, :, None] * wy[:, None, :]).reshape(n_samples, -1)
+
+    spectrum_Z, spectrum_F = kernel_spectra(
+        n_grid, box_width / n_interp, degrees_of_freedom, Y.dtype)
+
+    def potentials(kernel_spectrum, charges):
+        """ \sum_j kernel(y_i - y_j) * charges_j for each column of charges
+        """
+        n_charges = charges.shape[1]
+        grids = np.empty((n_charges, n_grid, n_grid), dtype=Y.dtype)
+        for col in range(n_charges):
+            grids[col] = np.bincount(
+                node_ids.ravel(), minlength=n_grid * n_grid,
+                weights=(node_weights * charges[:, col:col + 1]).ravel()
+            ).reshape(n_grid, n_grid)
+
+        # zero-padded 2D FFT: the padded rows are zero so transform the
+        # rows first, and only the first n_grid x n_grid values
+        # of the convolution are transformed back
+        spectrum = np.fft.rfft(grids, n=2 * n_grid, axis=2)
+        spectrum = np.fft.fft(spectrum, n=2 * n_grid, axis=1)
+        spectrum *= kernel_spectrum
+        spectrum = np.fft.ifft(spectrum, axis=1)[:, :n_grid]
+        pot = np.fft.irfft(spectrum, n=2 * n_grid, axis=2)[:, :, :n_grid]
+
+        pot = pot.reshape(n_charges, -1)
+        return np.stack([np.sum(node_weights * pot[col][node_ids], axis=1)
+                         for col in range(n_charges)], axis=1)
+
+    ones = np.ones((n_samples, 1), dtype=Y.dtype)
+    phi_F = potentials(spectrum_F, np.hstack([ones, Y]))
+    phi_Z = potentials(spectrum_Z, ones)[:, 0]
+
+    # remove the interpolated interaction of each point with itself
+    # (q_{ii}Z = 1 only when the boxes are narrow), the offsets between
+    # the nodes around a point are the same in all boxes
+    local = np.arange(n_interp) * (box_width / n_interp)
+    local_x = np.repeat(local, n_interp)
+    local_y = np.tile(local, n_interp)
+    local_Z = degrees_of_freedom / (degrees_of_freedom +
+                                    (local_x[:, None] - local_x) ** 2 +
+                                    (local_y[:, None] - local_y) ** 2)
+    if degrees_of_freedom != 1:
+        local_Z **= (degrees_of_freedom + 1.0) / 2.0
+    self_Z = np.einsum('ij,jk,ik->i', node_weights, local_Z, node_weights)
+    sum_Q = float(np.sum(phi_Z - self_Z))
+    neg_f = phi_F[:, 0:1] * Y - phi_F[:, 1:3]
+    neg_f[:skip_num_points] = 0.0
+    return neg_f, sum_Q
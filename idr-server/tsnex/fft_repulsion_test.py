@@ -0,0 +1,72 @@
+# test the repulsive forces interpolated on a grid
+
+import numpy as np
+from sklearn.metrics.pairwise import pairwise_distances
+
+import fft_repulsion
+from fft_repulsion import repulsive_forces
+
+
+def exact_repulsive_forces(Y):
+    qZ = 1.0 / (1.0 + pairwise_distances(Y, squared=True))
+    np.fill_diagonal(qZ, 0.0)
+    qZ2 = qZ * qZ
+    return qZ2.sum(axis=1)[:, None] * Y - qZ2.dot(Y), np.sum(qZ)
+
+
+def test_forces_close_to_exact():
+    Y = np.random.RandomState(0).randn(500, 2) * 10
+    neg_f, sum_Q = repulsive_forces(Y)
+    exact_neg_f, exact_sum_Q = exact_repulsive_forces(Y)
+    np.testing.assert_allclose(sum_Q, exact_sum_Q, rtol=1e-3)
+    assert np.linalg.norm(neg_f - exact_neg_f) < \
+        0.05 * np.linalg.norm(exact_neg_f)
+
+
+def test_wide_boxes_keep_the_normalization():
+    # 100 boxes of width ~3.8 instead of ~380 boxes of width 1
+    Y = np.random.RandomState(0).randn(500, 2) * 50
+    _, sum_Q = repulsive_forces(Y, max_num_intervals=100)
+    _, exact_sum_Q = exact_repulsive_forces(Y)
+    np.testing.assert_allclose(sum_Q, exact_sum_Q, rtol=0.05)
+
+
+def test_number_of_boxes_is_capped():
+    # without the cap, the grid of this embedding would not fit in memory
+    Y = np.random.RandomState(0).randn(500, 2) * 1e5
+    neg_f, sum_Q = repulsive_forces(Y, max_num_intervals=100)
+    assert np.all(np.isfinite(neg_f)) and np.isfinite(sum_Q)
+
+
+def test_spectra_of_the_kernels_are_reused(monkeypatch):
+    n_transforms = []
+    rfft2 = np.fft.rfft2
+    monkeypatch.setattr(np.fft, 'rfft2',
+                        lambda a: n_transforms.append(1) or rfft2(a))
+    monkeypatch.setattr(fft_repulsion, '_spectra_cache', {})
+
+    # the kernels of Z and of the forces are transformed once for both
+    # passes, and again only when the grid changes
+    Y = np.random.RandomState(0).randn(500, 2) * 10
+    expected = repulsive_forces(Y)
+    assert len(n_transforms) == 2
+    for scale in [1.0, 1.001, 0.999]:
+        repulsive_forces(Y * scale)
+    assert len(n_transforms) == 2
+    np.testing.assert_array_equal(repulsive_forces(Y)[0], expected[0])
+    repulsive_forces(Y * 2.0)
+    assert len(n_transforms) == 4
+
+
+def test_grid_covers_the_extent():
+    for extent in [1e-3, 1.0, 37.3, 120.0, 499.5, 1e5]:
+        n_boxes, box_width = fft_repulsion.grid_of(extent, 50, 1.0, 500)
+        assert n_boxes * box_width >= extent
+        assert n_boxes <= 500
+        # a fast size of FFT
+        for factor in (2, 3, 5):
+            while n_boxes % factor == 0:
+                n_boxes //= factor
+        assert n_boxes == 1
+        if 50 <= extent <= 500:
+            assert box_width <= 1.0
@@ -0,0 +1,391 @@
+# frame_protocol.py
+# Encoding of the dataframes sent to the client in `/tsnex/do_embedding`.
+# The client chooses the version of the protocol with the `protocol` query
+# param of the socket URI (ws://127.0.0.1:5000/tsnex/do_embedding?protocol=2)
+#   version 1 (default): one json object per frame with a dict for each point
+#   version 2: the static data of the points (ids, labels, texts) are sent
+#       once in a json `metadata` message, then each frame is a binary message:
+#           header: magic b'TSNX', version (uint8), n_points (uint32),
+#                   frame id (uint32), length of the json trailer (uint32)
+#           x, y of the points: float32 of shape (n_points, 2)
+#           z of the points: float32 of shape (n_points,)
+#           fixed points: bitmask of ceil(n_points / 8) bytes,
+#                   bit (7 - i % 8) of byte (i // 8) is set if i is fixed
+#           json trailer: the other fields of the frame (e.g. `seriesData`)
+#       all numbers are little-endian and the points are in the order of ids.
+#   version 3: as version 2, with the points encoded by `DeltaFrameEncoder`
+#       and only the changes of the json trailer. After the header,
+#       a delta header
+#           kind (uint8): 0 for a keyframe, 1 for a delta frame
+#           flags (uint8): bit 0 is set if the fixed points bitmask is sent,
+#                   bit 1 if the full json trailer is sent
+#           step_x, step_y, step_z (float64): quantization step of x, y, z
+#       then a keyframe has the x, y (float32 of shape (n_points, 2)),
+#       the z (float32 of shape (n_points,)), the bitmask and the full trailer.
+#       A delta frame has the moves of the x, y and of the z as int16
+#       of shape (n_points, 2) and (n_points,):
+#           x = x_previous + delta_x * step_x (the same for y and z)
+#       where x_previous is the x decoded in the previous frame,
+#       then the bitmask if the fixed points have changed and the trailer
+#       with the fields which have changed. In the trailer of a delta frame,
+#       each item of `seriesData` has the index `start` from which
+#       the values of each of its series are sent (the previous values are
+#       kept), and the items without new values are omitted.
+# A frame of any version may contain a subset of the points, with their ids
+# in its `ids` field (in the json trailer of the binary versions),
+# see `level_of_detail`.
+
+import json
+import struct
+import numpy as np
+
+PROTOCOL_JSON = 1
+PROTOCOL_BINARY = 2
+PROTOCOL_DELTA = 3
+PROTOCOLS = (PROTOCOL_JSON, PROTOCOL_BINARY, PROTOCOL_DELTA)
+
+MAGIC = b'TSNX'
+HEADER = struct.Struct('<4sBIII')
+DELTA_HEADER = struct.Struct('<BBddd')
+KEYFRAME = 0
+DELTA_FRAME = 1
+HAS_MASK = 1
+FULL_TRAILER = 2
+INT16_MAX = np.iinfo(np.int16).max
+
+
+def get_protocol(version):
+    """ Version of the protocol asked by the client, version 1 if unknown
+    """
+    try:
+        version = int(version)
+    except (TypeError, ValueError):
+        return PROTOCOL_JSON
+    return version if version in PROTOCOLS else PROTOCOL_JSON
+
+
+def point_ids(data):
+    """ Ids of the points of a frame
+    """
+    ids = data.get('ids')
+    return np.arange(len(data['z_info'])) if ids is None else np.asarray(ids)
+
+
+def encode_frame_json(data, y, labels, fixed_ids):
+    """ Frame of protocol version 1: a json object of which the `embedding`
+        is the list of points sorted by z in decreasing order
+    """
+    X_embedded = data['embedding']
+    zInfo = data['z_info']
+    ids = point_ids(data)
+    idx = np.argsort(zInfo)[::-1]
+    fixed_ids = set(fixed_ids)
+    raw_points = [{
+        'id': str(ids[k]),
+        'x': float(X_embedded[k][0]),
+        'y': float(X_embedded[k][1]),
+        'z': float(zInfo[k]),
+        'text': labels[ids[k]],
+        'label': str(y[ids[k]]),
+        'fixed': int(ids[k]) in fixed_ids
+    } for k in idx]
+    return json.dumps(dict(data, embedding=raw_points,
+                           z_info=np.asarray(zInfo).tolist()))
+
+
+def encode_metadata(y, labels, protocol=PROTOCOL_BINARY):
+    """ Static data of the points sent once before the binary frames
+    """
+    return json.dumps({
+        'type': 'metadata',
+        'protocol': protocol,
+        'ids': [str(i) for i in range(len(y))],
+        'labels': [str(label) for label in y],
+        'texts': labels
+    })
+
+
+def _other_fields(data):
+    """ Fields of a frame sent in its json trailer
+    """
+    return {key: value for key, value in data.items()
+            if key not in ('embedding', 'z_info')}
+
+
+def _fixed_mask(data, fixed_ids):
+    """ Whether each point of a frame is fixed
+    """
+    return np.isin(point_ids(data), np.asarray(list(fixed_ids), dtype=int))
+
+
+def _unpack_mask(body, n_points, offset):
+    """ Decode the bitmask of the fixed points at `offset` of `body`
+    """
+    return np.unpackbits(np.frombuffer(body, dtype=np.uint8,
+                                       count=(n_points + 7) // 8,
+                                       offset=offset))[:n_points].astype(bool)
+
+
+def _pack_frame(version, n_points, frame_id, parts, trailer):
+    """ Binary frame of the encoded `parts` (bytes) of the points
+        and of the json `trailer` (dict)
+    """
+    trailer = json.dumps(trailer).encode('utf-8')
+    header = HEADER.pack(MAGIC, version, n_points, frame_id, len(trailer))
+    return b''.join([header] + parts + [trailer])
+
+
+def _unpack_frame(message, version):
+    """ Decode the header and the trailer of a binary frame
+    Returns:
+        n_points, frame_id,
+        body (memoryview): the encoded points, between header and trailer
+        trailer (dict)
+    """
+    magic, frame_version, n_points, frame_id, trailer_size = \
+        HEADER.unpack_from(message)
+    if magic != MAGIC or frame_version != version:
+        raise ValueError("Not a frame of the protocol version {}"
+                         .format(version))
+    trailer_offset = len(message) - trailer_size
+    trailer = json.loads(message[trailer_offset:].decode('utf-8'))
+    return n_points, frame_id, \
+        memoryview(message)[HEADER.size:trailer_offset], trailer
+
+
+def encode_frame(data, fixed_ids, frame_id=0):
+    """ Frame of protocol version 2 (binary)
+    Args:
+        data (dict): the published intermediate result with the `embedding`
+            ndarray and the `z_info` list
+        fixed_ids (list): ids of the fixed points
+        frame_id (int): number of the frame in the session
+    Returns:
+        bytes
+    """
+    n_points = len(data['z_info'])
+    embedding = np.asarray(data['embedding'], dtype='<f4') \
+        .reshape(n_points, 2)
+    z_info = np.asarray(data['z_info'], dtype='<f4').reshape(n_points)
+    fixed = _fixed_mask(data, fixed_ids)
+    return _pack_frame(PROTOCOL_BINARY, n_points, frame_id,
+                       [embedding.tobytes(), z_info.tobytes(),
+                        np.packbits(fixed).tobytes()],
+                       _other_fields(data))
+
+
+def decode_frame(message):
+    """ Decode a frame of version 2, e.g. in a python client
+    Returns:
+        dict with the `embedding`, `z_info` and `fixed` ndarrays,
+        the `frame_id` and the other fields of the frame
+    """
+    n_points, frame_id, body, data = _unpack_frame(message, PROTOCOL_BINARY)
+    data.update(
+        embedding=np.frombuffer(body, dtype='<f4', count=2 * n_points)
+        .reshape(n_points, 2),
+        z_info=np.frombuffer(body, dtype='<f4', count=n_points,
+                             offset=8 * n_points),
+        fixed=_unpack_mask(body, n_points, 12 * n_points),
+        frame_id=frame_id)
+    return data
+
+
+def _quantize(values, decoded):
+    """ Moves from the `decoded` values to `values` as int16 on a grid
+        of 2^16 steps over the range of the values (of each column)
+    Returns:
+        moves (ndarray): None if a value moves too far
+        step (ndarray or float): step of the grid
+    """
+    step = np.maximum(np.ptp(values, axis=0), np.finfo(np.float32).eps) / \
+        (2.0 * INT16_MAX + 1.0)
+    moves = np.rint((values - decoded) / step)
+    if np.abs(moves).max() > INT16_MAX:
+        return None, step
+    return moves.astype('<i2'), step
+
+
+def _same_layout(old, new):
+    """ Whether two trailers have the same fields and series
+    """
+    def names(fields):
+        return [item['name'] for item in fields.get('seriesData', [])]
+    return set(old) == set(new) and names(old) == names(new)
+
+
+def _series_changes(old, new):
+    """ Items of `seriesData` with the values added since `old`
+    """
+    old_series = {item['name']: item['series'] for item in old}
+    changes = []
+    for item in new:
+        previous = old_series[item['name']]
+        if item['series'] == previous:
+            continue
+        starts = []
+        for i, values in enumerate(item['series']):
+            known = previous[i] if i < len(previous) else []
+            starts.append(len(known) if values[:len(known)] == known else 0)
+        changes.append({
+            'name': item['name'],
+            'start': starts,
+            'series': [values[start:] for start, values
+                       in zip(starts, item['series'])]
+        })
+    return changes
+
+
+def _apply_series_changes(items, changes):
+    """ Inverse of `_series_changes`
+    """
+    changes = {change['name']: change for change in changes}
+    result = []
+    for item in items:
+        change = changes.get(item['name'])
+        if change is not None:
+            previous = item['series']
+            item = dict(item, series=[
+                (previous[i][:start] if i < len(previous) else []) + values
+                for i, (start, values)
+                in enumerate(zip(change['start'], change['series']))])
+        result.append(item)
+    return result
+
+
+class DeltaFrameEncoder(object):
+    """ Encoder of the frames of version 3 for one client.
+        The moves of the points (x, y and z) between two frames are quantized
+        as int16 on a grid of 2^16 steps over the range of the values.
+        The moves are taken from the values decoded by the client,
+        so the quantization errors do not add up, and a keyframe of float32
+        values is sent every `keyframe_every` frames, when a point
+        moves too far or when the set of sent points has changed.
+        Only the changes of the fixed points and of the other fields
+        are sent in the delta frames, the fields of an encoded frame
+        must not be modified.
+    """
+
+    def __init__(self, keyframe_every=20):
+        super(DeltaFrameEncoder, self).__init__()
+        self.keyframe_every = keyframe_every
+        self.decoded = None
+        self.decoded_z = None
+        self.fixed = None
+        self.fields = None
+        self.ids = None
+        self.n_since_keyframe = 0
+
+    def encode(self, data, fixed_ids, frame_id=0):
+        """ Encode a frame as `encode_frame`
+        Returns:
+            bytes
+        """
+        embedding = np.asarray(data['embedding'], dtype=np.float64) \
+            .reshape(-1, 2)
+        n_points = embedding.shape[0]
+        z_info = np.asarray(data['z_info'], dtype=np.float64) \
+            .reshape(n_points)
+        ids = data.get('ids')
+        must_keyframe = self.decoded is None \
+            or self.decoded.shape != embedding.shape \
+            or self.ids != ids \
+            or n_points == 0 \
+            or self.n_since_keyframe + 1 >= self.keyframe_every
+        self.ids = ids
+
+        if not must_keyframe:
+            coords, step = _quantize(embedding, self.decoded)
+            z_moves, step_z = _quantize(z_info, self.decoded_z)
+            must_keyframe = coords is None or z_moves is None
+
+        if must_keyframe:
+            coords = embedding.astype('<f4')
+            z_moves = z_info.astype('<f4')
+            self.decoded = coords.astype(np.float64)
+            self.decoded_z = z_moves.astype(np.float64)
+            self.n_since_keyframe = 0
+            kind, steps = KEYFRAME, (0.0, 0.0, 0.0)
+        else:
+            self.decoded += coords * step
+            self.decoded_z += z_moves * step_z
+            self.n_since_keyframe += 1
+            kind, steps = DELTA_FRAME, (step[0], step[1], step_z)
+
+        flags = 0
+        parts = [coords.tobytes(), z_moves.tobytes()]
+        fixed = _fixed_mask(data, fixed_ids)
+        if must_keyframe or not np.array_equal(fixed, self.fixed):
+            flags |= HAS_MASK
+            parts.append(np.packbits(fixed).tobytes())
+        self.fixed = fixed
+
+        trailer = _other_fields(data)
+        if must_keyframe or not _same_layout(self.fields, trailer):
+            flags |= FULL_TRAILER
+            self.fields = trailer
+        else:
+            self.fields, trailer = trailer, {
+                key: _series_changes(self.fields[key], value)
+                if key == 'seriesData' else value
+                for key, value in trailer.items()
+                if value != self.fields[key]}
+
+        delta_header = DELTA_HEADER.pack(kind, flags, *steps)
+        return _pack_frame(PROTOCOL_DELTA, n_points, frame_id,
+                           [delta_header] + parts, trailer)
+
+
+class DeltaFrameDecoder(object):
+    """ Decoder of the frames of version 3 of one connection,
+        e.g. in a python client
+    """
+
+    def __init__(self):
+        super(DeltaFrameDecoder, self).__init__()
+        self.decoded = None
+        self.decoded_z = None
+        self.fixed = None
+        self.fields = None
+
+    def decode(self, message):
+        """ Decode a frame as `decode_frame`
+        """
+        n_points, frame_id, body, trailer = \
+            _unpack_frame(message, PROTOCOL_DELTA)
+        kind, flags, step_x, step_y, step_z = DELTA_HEADER.unpack_from(body)
+        offset = DELTA_HEADER.size
+        if kind == KEYFRAME:
+            self.decoded = np.frombuffer(
+                body, dtype='<f4', count=2 * n_points, offset=offset) \
+                .reshape(n_points, 2).astype(np.float64)
+            self.decoded_z = np.frombuffer(
+                body, dtype='<f4', count=n_points, offset=offset + 8 * n_points
+            ).astype(np.float64)
+            offset += 12 * n_points
+        elif self.decoded is None:
+            raise ValueError("Delta frame before the first keyframe")
+        else:
+            moves = np.frombuffer(body, dtype='<i2', count=2 * n_points,
+                                  offset=offset).reshape(n_points, 2)
+            z_moves = np.frombuffer(body, dtype='<i2', count=n_points,
+                                    offset=offset + 4 * n_points)
+            self.decoded = self.decoded + moves * [step_x, step_y]
+            self.decoded_z = self.decoded_z + z_moves * step_z
+            offset += 6 * n_points
+
+        if flags & HAS_MASK:
+            self.fixed = _unpack_mask(body, n_points, offset)
+        if flags & FULL_TRAILER:
+            self.fields = trailer
+        else:
+            self.fields = dict(self.fields)
+            for key, value in trailer.items():
+                if key == 'seriesData':
+                    value = _apply_series_changes(self.fields[key], value)
+                self.fields[key] = value
+
+        data = dict(self.fields)
+        data.update(embedding=self.decoded, z_info=self.decoded_z,
+                    fixed=self.fixed, frame_id=frame_id)
+        return data
@@ -0,0 +1,164 @@
+# test the encoding of the frames sent to the client
+
+import json
+import numpy as np
+import pytest
+
+import frame_protocol
+from frame_protocol import DeltaFrameEncoder, DeltaFrameDecoder
+
+
+def make_frame(embedding, ids=None):
+    n_points = embedding.shape[0]
+    data = {
+        'embedding': embedding,
+        'z_info': np.linspace(0.0, 1.0, n_points),
+        'seriesData': [{'name': 'errors', 'series': [[1.5, 1.2]]}]
+    }
+    if ids is not None:
+        data['ids'] = ids
+    return data
+
+
+def test_get_protocol():
+    assert frame_protocol.get_protocol(None) == frame_protocol.PROTOCOL_JSON
+    assert frame_protocol.get_protocol('x') == frame_protocol.PROTOCOL_JSON
+    assert frame_protocol.get_protocol('9') == frame_protocol.PROTOCOL_JSON
+    assert frame_protocol.get_protocol('2') == frame_protocol.PROTOCOL_BINARY
+    assert frame_protocol.get_protocol('3') == frame_protocol.PROTOCOL_DELTA
+
+
+def test_json_frame():
+    embedding = np.array([[0.0, 1.0], [2.0, 3.0], [4.0, 5.0]])
+    data = make_frame(embedding)
+    message = json.loads(frame_protocol.encode_frame_json(
+        data, y=[0, 1, 1], labels=['a', 'b', 'c'], fixed_ids=[1]))
+
+    # the points are sorted by z in decreasing order
+    points = message['embedding']
+    assert [p['id'] for p in points] == ['2', '1', '0']
+    assert points[1] == {'id': '1', 'x': 2.0, 'y': 3.0, 'z': 0.5,
+                         'text': 'b', 'label': '1', 'fixed': True}
+    assert message['seriesData'] == data['seriesData']
+
+
+@pytest.mark.parametrize('ids', [None, [1, 4, 7]])
+def test_binary_frame_round_trip(ids):
+    embedding = np.random.RandomState(0).randn(3 if ids else 9, 2)
+    data = make_frame(embedding, ids)
+    message = frame_protocol.encode_frame(data, fixed_ids=[4, 7, 8],
+                                          frame_id=12)
+    decoded = frame_protocol.decode_frame(message)
+
+    np.testing.assert_array_equal(decoded['embedding'],
+                                  embedding.astype(np.float32))
+    np.testing.assert_array_equal(decoded['z_info'],
+                                  data['z_info'].astype(np.float32))
+    expected_fixed = [False, True, True] if ids else \
+        [False] * 4 + [True] + [False] * 2 + [True, True]
+    np.testing.assert_array_equal(decoded['fixed'], expected_fixed)
+    assert decoded['frame_id'] == 12
+    assert decoded['seriesData'] == data['seriesData']
+    assert decoded.get('ids') == ids
+
+
+def test_binary_frame_of_another_version():
+    data = make_frame(np.zeros((4, 2)))
+    message = frame_protocol.encode_frame(data, fixed_ids=[])
+    with pytest.raises(ValueError):
+        DeltaFrameDecoder().decode(message)
+
+
+def moving_frames(n_frames=30, n_points=50):
+    """ Frames of points moving a little between two frames
+    """
+    random_state = np.random.RandomState(0)
+    embedding = random_state.randn(n_points, 2) * 10
+    for i in range(n_frames):
+        embedding = embedding + random_state.randn(n_points, 2) * 0.1
+        data = make_frame(embedding)
+        data['z_info'] = data['z_info'] + 0.01 * i
+        yield data
+
+
+def test_delta_frames_round_trip():
+    encoder, decoder = DeltaFrameEncoder(keyframe_every=10), \
+        DeltaFrameDecoder()
+    for frame_id, data in enumerate(moving_frames()):
+        message = encoder.encode(data, fixed_ids=[3], frame_id=frame_id)
+        decoded = decoder.decode(message)
+
+        # the quantization errors do not add up
+        extent = np.ptp(data['embedding'], axis=0)
+        assert np.all(np.abs(decoded['embedding'] - data['embedding'])
+                      <= extent / 65535.0 + 1e-6 * np.abs(data['embedding']))
+        np.testing.assert_allclose(decoded['z_info'], data['z_info'],
+                                   atol=1e-4)
+        assert np.flatnonzero(decoded['fixed']).tolist() == [3]
+        assert decoded['frame_id'] == frame_id
+        assert decoded['seriesData'] == data['seriesData']
+
+
+def test_keyframes():
+    encoder, decoder = DeltaFrameEncoder(keyframe_every=10), \
+        DeltaFrameDecoder()
+    frames = list(moving_frames(n_frames=12))
+    messages = [encoder.encode(data, fixed_ids=[]) for data in frames]
+    sizes = [len(message) for message in messages]
+    # a keyframe every 10 frames, which is larger than the delta frames
+    assert sizes[0] == sizes[10] > max(sizes[1:10] + sizes[11:])
+
+    # a point moving too far or another set of points gives a keyframe
+    frames[1]['embedding'][0] += 1e3
+    assert len(encoder.encode(frames[1], fixed_ids=[])) == sizes[0]
+    subset = dict(frames[2], ids=list(range(10)),
+                  embedding=frames[2]['embedding'][:10],
+                  z_info=frames[2]['z_info'][:10])
+    message = encoder.encode(subset, fixed_ids=[])
+    assert decoder.decode(messages[0])['embedding'].shape == (50, 2)
+    assert decoder.decode(message)['ids'] == list(range(10))
+
+
+def test_delta_frame_before_keyframe():
+    encoder = DeltaFrameEncoder()
+    frames = list(moving_frames(n_frames=2))
+    encoder.encode(frames[0], fixed_ids=[])
+    with pytest.raises(ValueError):
+        DeltaFrameDecoder().decode(encoder.encode(frames[1], fixed_ids=[]))
+
+
+def test_delta_frames_send_the_changes():
+    encoder, decoder = DeltaFrameEncoder(keyframe_every=100), \
+        DeltaFrameDecoder()
+    errors, scores = [], [[], []]
+    for frame_id, data in enumerate(moving_frames(n_frames=60)):
+        # the errors grow, the scores are cleared at frame 40
+        # and the fixed points change at frame 30
+        errors.append(1.0 / (frame_id + 1))
+        if frame_id == 40:
+            scores = [[], []]
+        elif frame_id % 5 == 0:
+            scores[0].append(0.5)
+            scores[1].append(0.25)
+        data['seriesData'] = [
+            {'name': 'errors', 'series': [list(errors)]},
+            {'name': 'scores', 'series': [list(s) for s in scores]}]
+        data['n_iter'] = 10 * frame_id
+        fixed_ids = [3] if frame_id < 30 else [3, 7]
+
+        message = encoder.encode(data, fixed_ids, frame_id)
+        decoded = decoder.decode(message)
+        assert decoded['seriesData'] == data['seriesData']
+        assert decoded['n_iter'] == data['n_iter']
+        assert np.flatnonzero(decoded['fixed']).tolist() == fixed_ids
+        np.testing.assert_allclose(decoded['z_info'], data['z_info'],
+                                   atol=1e-4)
+
+        # the size of the delta frames does not grow with the series,
+        # which are resent in full in the frames of version 2
+        if frame_id == 1:
+            first_delta_size = len(message)
+        elif frame_id > 1:
+            assert len(message) < first_delta_size + 128
+            size = len(frame_protocol.encode_frame(data, fixed_ids))
+            assert len(message) < size / (2.0 if frame_id >= 20 else 1.5)
@@ -0,0 +1,114 @@
+# joint_probabilities.py
+# Joint probabilities P of t-SNE in the high dimensional space, see:
+# [1] Visualizing Data using t-SNE (van der Maaten and Hinton, 2008)
+# [2] Accelerating t-SNE using Tree-Based Algorithms (van der Maaten, 2014)
+# The conditional probabilities p_{j|i} use a gaussian kernel of which
+# the bandwidth of each point is found by a binary search on its perplexity,
+# this is done for all points at once.
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.spatial.distance import squareform
+from sklearn.metrics.pairwise import pairwise_distances
+from sklearn.neighbors import NearestNeighbors
+
+MACHINE_EPSILON = np.finfo(np.double).eps
+EPSILON_DBL = 1e-8
+
+
+def binary_search_perplexity(distances, perplexity, n_steps=100, tol=1e-5):
+    """ Find the conditional probabilities p_{j|i} of which the perplexity
+        of each row is `perplexity`
+    Args:
+        distances (ndarray): squared distances of shape (n_samples, k)
+            from each point to its neighbors (without the point itself)
+        perplexity (float): the desired perplexity
+        n_steps (int): max number of steps of the binary search
+        tol (float): tolerance of the entropy
+    Returns:
+        P (ndarray): conditional probabilities of shape (n_samples, k)
+    """
+    distances = distances.astype(np.float64)
+    n_samples = distances.shape[0]
+    desired_entropy = np.log(perplexity)
+
+    P = np.empty_like(distances)
+    beta = np.ones(n_samples)
+    beta_min = np.full(n_samples, -np.inf)
+    beta_max = np.full(n_samples, np.inf)
+    active = np.arange(n_samples)
+    for _ in range(n_steps):
+        dist = distances[active]
+        P_active = np.exp(-dist * beta[active, None])
+        sum_P = np.maximum(P_active.sum(axis=1), EPSILON_DBL)
+        P_active /= sum_P[:, None]
+        P[active] = P_active
+
+        entropy = np.log(sum_P) + \
+            beta[active] * np.einsum('ij,ij->i', dist, P_active)
+        entropy_diff = entropy - desired_entropy
+        not_done = np.abs(entropy_diff) > tol
+        active, entropy_diff = active[not_done], entropy_diff[not_done]
+        if active.shape[0] == 0:
+            break
+
+        # the entropy is too high: increase beta, else decrease it
+        up = active[entropy_diff > 0]
+        down = active[entropy_diff <= 0]
+        beta_min[up] = beta[up]
+        beta[up] = np.where(beta_max[up] == np.inf, beta[up] * 2.0,
+                            (beta[up] + beta_max[up]) / 2.0)
+        beta_max[down] = beta[down]
+        beta[down] = np.where(beta_min[down] == -np.inf, beta[down] / 2.0,
+                              (beta[down] + beta_min[down]) / 2.0)
+    return P
+
+
+def joint_probabilities(X, perplexity=30.0, dtype=np.float64):
+    """ Joint probabilities over all pairs of points
+    Returns:
+        P (ndarray): the condensed P, as `squareform(P)` of the square one
+            of which the sum is 1
+    """
+    n_samples = X.shape[0]
+    distances = pairwise_distances(X, squared=True)
+
+    # the distances from each point to the others
+    off_diagonal = ~np.eye(n_samples, dtype=bool)
+    conditional_P = binary_search_perplexity(
+        distances[off_diagonal].reshape(n_samples, n_samples - 1), perplexity)
+    P = np.zeros((n_samples, n_samples))
+    P[off_diagonal] = conditional_P.ravel()
+    P += P.T
+
+    # normalize the square P, each pair is counted twice in its sum
+    P /= max(np.sum(P), MACHINE_EPSILON)
+    P = squareform(P, checks=False)
+    np.maximum(P, MACHINE_EPSILON, out=P)
+    return P.astype(dtype, copy=False)
+
+
+def n_neighbors_of(n_samples, perplexity):
+    """ Number of neighbors of each point in the sparse P: 3 * perplexity
+    """
+    return min(n_samples - 1, int(3.0 * perplexity + 1))
+
+
+def joint_probabilities_nn(X, perplexity=30.0, dtype=np.float64):
+    """ Joint probabilities over the 3 * perplexity nearest neighbors
+        of each point, linear in memory
+    Returns:
+        P (csr_matrix): symmetric sparse P of shape (n_samples, n_samples)
+    """
+    n_samples = X.shape[0]
+    k = n_neighbors_of(n_samples, perplexity)
+    knn = NearestNeighbors(n_neighbors=k).fit(X)
+    distances, neighbors = knn.kneighbors()
+
+    conditional_P = binary_search_perplexity(distances ** 2, perplexity)
+    P = csr_matrix((conditional_P.ravel(), neighbors.ravel(),
+                    np.arange(0, n_samples * k + 1, k)),
+                   shape=(n_samples, n_samples))
+    P = P + P.T
+    P /= max(P.sum(), MACHINE_EPSILON)
+    return P.astype(dtype)
@@ -0,0 +1,38 @@
+# test the joint probabilities against those of sklearn
+
+import numpy as np
+from scipy.spatial.distance import squareform
+from sklearn.manifold import _t_sne
+from sklearn.metrics.pairwise import pairwise_distances
+from sklearn.neighbors import NearestNeighbors
+
+import joint_probabilities
+
+
+def make_data(n_samples=120):
+    return np.random.RandomState(0).randn(n_samples, 5)
+
+
+def test_joint_probabilities():
+    X = make_data()
+    P = joint_probabilities.joint_probabilities(X, 10.0)
+    expected = _t_sne._joint_probabilities(
+        pairwise_distances(X, squared=True).astype(np.float32), 10.0, 0)
+
+    np.testing.assert_allclose(P, expected, rtol=1e-5, atol=1e-12)
+    # the square P sums to 1
+    np.testing.assert_allclose(squareform(P).sum(), 1.0)
+
+
+def test_joint_probabilities_nn():
+    X = make_data()
+    P = joint_probabilities.joint_probabilities_nn(X, 10.0)
+    k = joint_probabilities.n_neighbors_of(X.shape[0], 10.0)
+    distances = NearestNeighbors(n_neighbors=k).fit(X) \
+        .kneighbors_graph(mode='distance')
+    distances.data **= 2
+    expected = _t_sne._joint_probabilities_nn(distances, 10.0, 0)
+
+    np.testing.assert_allclose(P.toarray(), expected.toarray(),
+                               rtol=1e-5, atol=1e-12)
+    np.testing.assert_allclose(P.sum(), 1.0)
@@ -0,0 +1,117 @@
+# test the kernels of the KL divergence and its gradient
+
+import multiprocessing
+import numpy as np
+import pytest
+from scipy.sparse import csr_matrix
+
+import joint_probabilities
+from kl_kernels import ExactKL, attractive_forces, kl_divergence_bh, \
+    kl_divergence_fft
+from parallel_kl import ParallelExactKL
+
+
+def sparse_problem(n_samples=300):
+    """ Sparse P of a random dataset, a random embedding and
+        the exact KL divergence, gradient and divergences of the embedding
+    """
+    random_state = np.random.RandomState(0)
+    X = random_state.randn(n_samples, 10)
+    P = joint_probabilities.joint_probabilities_nn(X, 10.0)
+    params = random_state.randn(n_samples * 2) * 3
+    exact = ExactKL(P)(params, None, 1.0, n_samples, 2)
+    return P, params, exact
+
+
+def relative_error(approx, exact):
+    return np.linalg.norm(approx - exact) / np.linalg.norm(exact)
+
+
+def random_P(n_samples, random_state):
+    P = random_state.rand(n_samples, n_samples)
+    P += P.T
+    np.fill_diagonal(P, 0.0)
+    return P / P.sum()
+
+
+@pytest.mark.parametrize('kernel', [ExactKL, ParallelExactKL])
+def test_float32_precision_of_offset_embedding(kernel):
+    random_state = np.random.RandomState(0)
+    n_samples = 200
+    P = random_P(n_samples, random_state)
+    Y = random_state.randn(n_samples, 2) * 5 + 200
+
+    def objective(dtype):
+        kl = kernel(P.astype(dtype)) if kernel is ExactKL \
+            else kernel(P.astype(dtype), n_jobs=2)
+        try:
+            return kl(Y.astype(dtype).ravel(), None, 1.0, n_samples, 2)
+        finally:
+            if kernel is ParallelExactKL:
+                kl.close()
+
+    kl64, _, grad64, _ = objective(np.float64)
+    kl32, _, grad32, _ = objective(np.float32)
+    np.testing.assert_allclose(kl32, kl64, rtol=1e-5)
+    assert np.linalg.norm(grad32 - grad64) < 1e-4 * np.linalg.norm(grad64)
+
+
+def test_attractive_forces_with_empty_rows():
+    random_state = np.random.RandomState(0)
+    Y = random_state.randn(6, 2)
+    # the first and the last points have no neighbors
+    P = np.zeros((6, 6))
+    P[1, 2] = P[2, 1] = 0.2
+    P[1, 4] = P[4, 1] = 0.1
+    P[3, 4] = P[4, 3] = 0.2
+    pos_f, qijZ = attractive_forces(Y, csr_matrix(P), 1.0)
+
+    diff = Y[:, None, :] - Y[None, :, :]
+    W = 1.0 / (1.0 + np.sum(diff ** 2, axis=2))
+    np.testing.assert_allclose(pos_f, np.einsum('ij,ijk->ik', P * W, diff))
+    np.testing.assert_allclose(qijZ, W[P > 0])
+
+
+def test_barnes_hut_close_to_exact():
+    P, params, (kl, _, grad, divergences) = sparse_problem()
+    errors = []
+    for angle in [0.5, 0.2]:
+        bh_kl, _, bh_grad, bh_divergences = kl_divergence_bh(
+            params, P, 1.0, P.shape[0], 2, angle=angle)
+        np.testing.assert_allclose(bh_kl, kl, rtol=1e-2)
+        np.testing.assert_allclose(bh_divergences, divergences, atol=1e-3)
+        errors.append(relative_error(bh_grad, grad))
+    # the approximation gets better with a smaller angle
+    assert errors[0] < 0.1 and errors[1] < 0.01
+    assert errors[1] < errors[0]
+
+
+def test_fft_close_to_exact():
+    P, params, (kl, _, grad, divergences) = sparse_problem()
+    fft_kl, _, fft_grad, fft_divergences = kl_divergence_fft(
+        params, P, 1.0, P.shape[0], 2)
+    np.testing.assert_allclose(fft_kl, kl, rtol=1e-4)
+    np.testing.assert_allclose(fft_divergences, divergences, atol=1e-6)
+    assert relative_error(fft_grad, grad) < 1e-2
+
+
+@pytest.mark.parametrize('degrees_of_freedom', [1.0, 0.5])
+def test_parallel_equal_to_exact(degrees_of_freedom):
+    random_state = np.random.RandomState(0)
+    n_samples = 101
+    P = random_P(n_samples, random_state)
+    params = random_state.randn(n_samples * 2) * 3
+    args = (None, degrees_of_freedom, n_samples, 2)
+    kl, _, grad, divergences = ExactKL(P)(params, *args, skip_num_points=3)
+
+    # the workers are spawned as in the server
+    parallel_kl = ParallelExactKL(
+        P, n_jobs=3, context=multiprocessing.get_context('spawn'))
+    try:
+        par_kl, _, par_grad, par_divergences = parallel_kl(
+            params, *args, skip_num_points=3)
+    finally:
+        parallel_kl.close()
+    np.testing.assert_allclose(par_kl, kl)
+    np.testing.assert_allclose(par_divergences, divergences)
+    np.testing.assert_allclose(par_grad, grad, atol=1e-12)
@@ -0,0 +1,99 @@
+# level_of_detail.py
+# Level of detail of the frames of large embeddings: instead of all points,
+# a frame contains
+#   + a density raster of the whole embedding (2D histogram, smoothed),
+#   + a representative subsample: the points of highest `z_info`,
+#   + all the points in the viewport of the client (when it has zoomed in),
+#   + the fixed points.
+# The ids of the sent points are in the `ids` field of the frame.
+
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+
+def density_raster(embedding, bins=64, smooth=1.0):
+    """ Density of the points on a grid over their bounding box
+    Args:
+        embedding (ndarray): positions of shape (n_samples, 2)
+        bins (int): number of cells in each axis
+        smooth (float): std of the gaussian smoothing in cells, 0 to disable
+    Returns:
+        density (ndarray): float32 of shape (bins, bins), density[i, j]
+            is the cell of the i-th x interval and j-th y interval
+        extent (list): [x_min, x_max, y_min, y_max] of the grid
+    """
+    x_min, y_min = embedding.min(axis=0)
+    x_max, y_max = embedding.max(axis=0)
+    extent = [float(x_min), float(x_max), float(y_min), float(y_max)]
+    density, _, _ = np.histogram2d(embedding[:, 0], embedding[:, 1],
+                                   bins=bins, range=[extent[:2], extent[2:]])
+    if smooth > 0:
+        density = gaussian_filter(density, sigma=smooth, mode='constant')
+    return density.astype(np.float32), extent
+
+
+def in_viewport(embedding, viewport):
+    """ Ids of the points in the viewport [x_min, x_max, y_min, y_max]
+    """
+    x_min, x_max, y_min, y_max = viewport
+    inside = (embedding[:, 0] >= x_min) & (embedding[:, 0] <= x_max) & \
+        (embedding[:, 1] >= y_min) & (embedding[:, 1] <= y_max)
+    return np.flatnonzero(inside)
+
+
+def select_points(embedding, z_info, n_representatives=2000, viewport=None,
+                  max_viewport_points=20000, fixed_ids=[]):
+    """ Ids of the points sent in a frame at this level of detail
+    Args:
+        embedding (ndarray): positions of shape (n_samples, 2)
+        z_info (ndarray): importance of each point
+        n_representatives (int): number of points of highest `z_info`
+        viewport (list): [x_min, x_max, y_min, y_max] of the client view
+            in which all the points are sent, None for the zoomed-out view
+        max_viewport_points (int): max number of points in the viewport,
+            the ones of highest `z_info` are sent
+        fixed_ids (list): ids of the fixed points, which are always sent
+    Returns:
+        sorted ids
+    """
+    n_samples = embedding.shape[0]
+    z_info = np.asarray(z_info)
+    selected = [np.asarray(fixed_ids, dtype=int)]
+
+    if n_representatives < n_samples:
+        selected.append(np.argpartition(-z_info, n_representatives)
+                        [:n_representatives])
+    else:
+        selected.append(np.arange(n_samples))
+
+    if viewport is not None:
+        visible = in_viewport(embedding, viewport)
+        if visible.shape[0] > max_viewport_points:
+            visible = visible[np.argpartition(
+                -z_info[visible], max_viewport_points)[:max_viewport_points]]
+        selected.append(visible)
+    return np.unique(np.concatenate(selected))
+
+
+def reduce_frame(data, fixed_ids=[], n_representatives=2000, viewport=None,
+                 bins=64, smooth=1.0):
+    """ Frame of the published intermediate result `data` at this level of
+        detail, the frame is not reduced if it has few points
+    Returns:
+        dict of the frame with the selected points in `embedding`, `z_info`
+        and `ids`, and the `density` raster with its `density_extent`
+    """
+    embedding = np.asarray(data['embedding']).reshape(-1, 2)
+    if embedding.shape[0] <= n_representatives:
+        return data
+
+    z_info = np.asarray(data['z_info'])
+    ids = select_points(embedding, z_info, n_representatives, viewport,
+                        fixed_ids=fixed_ids)
+    density, extent = density_raster(embedding, bins, smooth)
+    return dict(data,
+                embedding=embedding[ids],
+                z_info=z_info[ids].tolist(),
+                ids=ids.tolist(),
+                density=density.tolist(),
+                density_extent=extent)
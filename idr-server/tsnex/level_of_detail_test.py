@@ -0,0 +1,85 @@
+# test the frames of large embeddings at a level of detail
+
+import numpy as np
+
+import level_of_detail
+
+
+def make_frame(n_samples=5000):
+    random_state = np.random.RandomState(0)
+    return {
+        'embedding': random_state.randn(n_samples, 2) * 10,
+        'z_info': random_state.rand(n_samples),
+        'seriesData': []
+    }
+
+
+def test_small_frames_are_not_reduced():
+    data = make_frame(100)
+    assert level_of_detail.reduce_frame(data, n_representatives=100) is data
+
+
+def test_representatives_and_fixed_points():
+    data = make_frame()
+    fixed_ids = [3, 17, 4999]
+    frame = level_of_detail.reduce_frame(data, fixed_ids,
+                                         n_representatives=200)
+    ids = np.array(frame['ids'])
+
+    # the points of highest z_info and the fixed points, sorted by id
+    assert 200 <= ids.shape[0] <= 200 + len(fixed_ids)
+    assert np.all(np.diff(ids) > 0)
+    assert set(fixed_ids) <= set(ids.tolist())
+    top = np.argsort(-data['z_info'])[:200]
+    assert set(top.tolist()) <= set(ids.tolist())
+    np.testing.assert_array_equal(frame['embedding'], data['embedding'][ids])
+    np.testing.assert_array_equal(frame['z_info'], data['z_info'][ids])
+    assert frame['seriesData'] == []
+
+
+def test_viewport_points():
+    data = make_frame()
+    viewport = [0.0, 10.0, -10.0, 0.0]
+    embedding = data['embedding']
+    x, y = embedding[:, 0], embedding[:, 1]
+    visible = np.flatnonzero((x >= 0) & (x <= 10) & (y >= -10) & (y <= 0))
+    assert visible.shape[0] > 500
+
+    frame = level_of_detail.reduce_frame(data, [42], n_representatives=100,
+                                         viewport=viewport)
+    ids = set(frame['ids'])
+    assert set(visible.tolist()) <= ids and 42 in ids
+    assert len(ids) <= 100 + visible.shape[0] + 1
+
+    # only the points of highest z_info when too many are visible
+    selected = level_of_detail.select_points(
+        embedding, data['z_info'], n_representatives=100, viewport=viewport,
+        max_viewport_points=50)
+    assert selected.shape[0] <= 150
+    top_visible = visible[np.argsort(-data['z_info'][visible])[:50]]
+    assert set(top_visible.tolist()) <= set(selected.tolist())
+
+
+def test_density_raster():
+    data = make_frame()
+    frame = level_of_detail.reduce_frame(data, n_representatives=100,
+                                         bins=32, smooth=0)
+    density = np.array(frame['density'])
+    assert density.shape == (32, 32)
+    # all the points are counted, in the cells of their positions
+    assert density.sum() == 5000
+    x_min, x_max, y_min, y_max = frame['density_extent']
+    embedding = data['embedding']
+    assert [x_min, x_max] == [embedding[:, 0].min(), embedding[:, 0].max()]
+    assert [y_min, y_max] == [embedding[:, 1].min(), embedding[:, 1].max()]
+    i = np.minimum(((embedding[0, 0] - x_min) / (x_max - x_min) * 32)
+                   .astype(int), 31)
+    j = np.minimum(((embedding[0, 1] - y_min) / (y_max - y_min) * 32)
+                   .astype(int), 31)
+    assert density[i, j] >= 1
+
+    # the smoothing keeps the number of points inside the grid
+    smoothed, _ = level_of_detail.density_raster(embedding, bins=32,
+                                                 smooth=1.0)
+    assert smoothed.dtype == np.float32
+    assert 0.95 * 5000 < smoothed.sum() <= 5000
@@ -0,0 +1,140 @@
+# metrics_worker.py
+# Quality measures of the embedding (trustworthiness, PIVE stability and
+# convergence, clustering scores) computed in a pool of worker processes,
+# so that the optimization does not wait for them.
+# The embedding loop submits snapshots of the embedding and collects the
+# finished measures when it sends a frame. When the workers are busy,
+# only the latest snapshot waits for a free worker, the older ones are skipped.
+
+import numpy as np
+try:
+    from sklearn.manifold import trustworthiness
+    PRECOMPUTED = {'metric': 'precomputed'}
+except ImportError:  # sklearn < 0.20
+    from sklearn.manifold.t_sne import trustworthiness
+    PRECOMPUTED = {'precomputed': True}
+from sklearn.metrics.pairwise import pairwise_distances
+import score
+
+# data of the dataset in each worker process
+_worker_data = {}
+
+
+def _init_worker(X, labels):
+    """ Keep the dataset in the worker process, the pairwise distances
+        and the neighbors in high dim are calculated on the first measure
+    """
+    _worker_data.update(X=X, labels=labels, dist_X=None, knn_X=None)
+
+
+def _measure(snapshot):
+    """ Measure a snapshot (n_iter, old_p, new_p) of the embedding
+    Returns:
+        n_iter, (trustworthiness, stability, convergence),
+        (vmeasure, silhoutte)
+    """
+    n_iter, old_p, new_p = snapshot
+    if _worker_data['dist_X'] is None:
+        _worker_data['dist_X'] = pairwise_distances(_worker_data['X'],
+                                                    squared=True)
+        _worker_data['knn_X'] = score.knn_table(_worker_data['dist_X'])
+    dist_X = _worker_data['dist_X']
+
+    new_Y = new_p.reshape(-1, 2)
+    trustwth = trustworthiness(dist_X, new_Y, n_neighbors=10, **PRECOMPUTED)
+    knn_X = _worker_data['knn_X']
+    stability, convergence = score.PIVE_measure(
+        old_p, new_p, k=knn_X.shape[1], knn_X=knn_X)
+    clustering = score.clutering(new_Y, labels=_worker_data['labels'])
+    return n_iter, (trustwth, stability, convergence), clustering
+
+
+class MetricsWorker(object):
+    """ Pool of processes measuring the snapshots of an embedding:
+        metrics = MetricsWorker(X, y, context=mp_context)
+        metrics.submit(n_iter, old_p, p)
+        for n_iter, embedding_score, clustering_score in metrics.collect():
+            ...
+        metrics.close()
+        When a measure fails, the error is printed once and
+        the measures are disabled for the rest of the session.
+    """
+
+    def __init__(self, X, labels, n_workers=1, context=None):
+        """ The processes are started on the first snapshot
+        Args:
+            X (ndarray): the original data
+            labels (ndarray): the labels of the points for the clustering
+            n_workers (int): number of worker processes
+            context: multiprocessing context to start the processes
+        """
+        super(MetricsWorker, self).__init__()
+        self.X = X
+        self.labels = labels
+        self.n_workers = n_workers
+        self.context = context
+        self.pool = None
+        self.running = []
+        self.waiting = None
+        self.n_skipped = 0
+        self.disabled = False
+
+    def _start(self, snapshot):
+        if self.pool is None:
+            if self.context is None:
+                import multiprocessing as context
+            else:
+                context = self.context
+            self.pool = context.Pool(self.n_workers, initializer=_init_worker,
+                                     initargs=(self.X, self.labels))
+        self.running.append(self.pool.apply_async(_measure, (snapshot,)))
+
+    def submit(self, n_iter, old_p, new_p):
+        """ Measure a snapshot of the embedding (the arrays are copied)
+            as soon as a worker is free
+        """
+        if self.disabled:
+            return
+        snapshot = (n_iter, np.array(old_p), np.array(new_p))
+        n_in_progress = sum(not result.ready() for result in self.running)
+        if n_in_progress < self.n_workers:
+            self._start(snapshot)
+        else:
+            if self.waiting is not None:
+                self.n_skipped += 1
+            self.waiting = snapshot
+
+    def collect(self):
+        """ Get the finished measures and start the waiting snapshot
+        Returns:
+            list of (n_iter, embedding_score, clustering_score)
+            sorted by n_iter
+        """
+        results = []
+        for result in [r for r in self.running if r.ready()]:
+            self.running.remove(result)
+            try:
+                results.append(result.get())
+            except Exception as e:
+                # the traceback of the worker is in the cause
+                print("[METRICS] Measure failed, the measures are disabled: "
+                      "{!r}{}".format(e, e.__cause__ or ''))
+                self.close()
+                self.disabled = True
+                return []
+
+        if self.waiting is not None and \
+                len(self.running) < self.n_workers:
+            self._start(self.waiting)
+            self.waiting = None
+        return sorted(results, key=lambda result: result[0])
+
+    def close(self):
+        """ Stop the worker processes, the running measures are dropped
+        """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        self.running = []
+        self.waiting = None
@@ -0,0 +1,53 @@
+# test the quality measures computed in worker processes
+
+import time
+import numpy as np
+from sklearn.datasets import make_blobs
+
+from metrics_worker import MetricsWorker
+
+
+def collect_all(metrics, timeout=30.0):
+    """ Collect the measures until no snapshot is in progress
+    """
+    results = []
+    deadline = time.time() + timeout
+    while (metrics.running or metrics.waiting) and time.time() < deadline:
+        time.sleep(0.05)
+        results += metrics.collect()
+    return results
+
+
+def test_measures_of_snapshots():
+    X, y = make_blobs(n_samples=100, centers=3, random_state=0)
+    Y = np.random.RandomState(0).randn(100, 2)
+    metrics = MetricsWorker(X, y)
+    try:
+        metrics.submit(10, Y, Y)
+        metrics.submit(20, Y, Y + 0.1)
+        results = collect_all(metrics)
+    finally:
+        metrics.close()
+
+    assert [n_iter for n_iter, _, _ in results] == [10, 20]
+    trustwth, stability, convergence = results[0][1]
+    assert 0.0 <= trustwth <= 1.0
+    assert np.isfinite(stability) and np.isfinite(convergence)
+    assert len(results[0][2]) == 2
+
+
+def test_failed_measure_disables_the_measures(capsys):
+    X, y = make_blobs(n_samples=100, centers=3, random_state=0)
+    metrics = MetricsWorker(X, y)
+    try:
+        # the embedding is not of this dataset
+        Y = np.zeros((10, 2))
+        metrics.submit(10, Y, Y)
+        assert collect_all(metrics) == []
+        assert metrics.disabled
+        assert capsys.readouterr().out.count("Measure failed") == 1
+
+        metrics.submit(20, Y, Y)
+        assert metrics.running == [] and metrics.waiting is None
+    finally:
+        metrics.close()
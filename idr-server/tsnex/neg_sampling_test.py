@@ -0,0 +1,64 @@
+# test the optimizer with negative sampling
+
+import numpy as np
+import pytest
+from sklearn.datasets import load_digits
+from sklearn.neighbors import NearestNeighbors
+
+import p_cache
+import kl_kernels
+from engine import InteractiveTSNE
+
+
+@pytest.fixture
+def engine(tmpdir, monkeypatch):
+    monkeypatch.setattr(p_cache, 'CACHE_DIR', str(tmpdir))
+    X = load_digits().data[:600]
+    return InteractiveTSNE(X, method='neg_sampling')
+
+
+def kl_divergence(engine):
+    return kl_kernels.kl_divergence_bh(
+        engine.p.astype(np.float64), engine.P.astype(np.float64), 1.0,
+        engine.n_samples, 2)[0]
+
+
+def neighbors_of(X, k=10):
+    _, neighbors = NearestNeighbors(n_neighbors=k + 1).fit(X).kneighbors(X)
+    return neighbors[:, 1:]
+
+
+def test_kl_decreases_and_neighbors_are_kept(engine):
+    kl = [kl_divergence(engine)]
+    for _ in range(4):
+        engine.step(300)
+        kl.append(kl_divergence(engine))
+    assert kl[-1] < 0.5 * kl[0]
+    assert kl[-1] < kl[1]
+
+    # the neighbors in the embedding are the neighbors in high dim,
+    # about 1% of them would be by chance
+    knn_X = neighbors_of(engine.X)
+    knn_Y = neighbors_of(engine.p.reshape(-1, 2))
+    recall = np.mean([np.intersect1d(a, b).shape[0]
+                      for a, b in zip(knn_X, knn_Y)]) / 10.0
+    assert recall > 0.4
+
+
+def test_schedule_is_restored_from_checkpoint(engine, tmpdir):
+    engine.step(250)
+    sampler = engine.sampler
+    file_name = str(tmpdir.join('checkpoint.npz'))
+    engine.save_checkpoint(file_name)
+
+    restored = InteractiveTSNE(engine.X, method='neg_sampling')
+    restored.load_checkpoint(file_name)
+    assert restored.sampler.epoch_count == sampler.epoch_count == 250
+    assert restored.sampler.current_learning_rate() == \
+        sampler.current_learning_rate() < sampler.learning_rate
+    np.testing.assert_array_equal(restored.p, engine.p)
+
+    # the learning rate goes on decaying from the restored epoch
+    restored.step(1000)
+    assert restored.sampler.current_learning_rate() == \
+        sampler.learning_rate * sampler.min_learning_rate
@@ -0,0 +1,116 @@
+# p_cache.py
+# Persistent cache of the joint probabilities P on disk.
+# The cache is shared by the server and the scripts in `validate_contraints`
+# (which import this module and `joint_probabilities`).
+# Each P is stored in a folder named by the hash of the dataset, the perplexity,
+# the number of neighbors, the function which calculated P and CACHE_VERSION,
+# as .npy files which are memory-mapped on load:
+#   sparse P (kNN graph): data.npy, indices.npy, indptr.npy, shape.npy
+#   dense P (exact method, condensed form): condensed.npy
+
+import os
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+
+# folder of the cache, can be changed by an environment variable
+CACHE_DIR = os.environ.get(
+    'TSNEX_P_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'tsnex_P'))
+
+# version of the cached P, changed when the calculation of P is fixed
+# so that the P calculated before are not used
+# (2: the dense P is normalized in square form)
+CACHE_VERSION = 2
+
+
+def dataset_hash(X):
+    """ Hash of the content of a dataset (with its shape and dtype)
+    """
+    X = np.ascontiguousarray(X)
+    sha = hashlib.sha1()
+    sha.update('{}{}'.format(X.dtype.str, X.shape).encode('utf-8'))
+    sha.update(X.view(np.uint8).ravel())
+    return sha.hexdigest()
+
+
+def producer_name(compute_P):
+    """ Name of the function calculating P (of a `functools.partial` too),
+        two functions may not give the same P
+    """
+    func = getattr(compute_P, 'func', compute_P)
+    return '{}.{}'.format(func.__module__, func.__name__)
+
+
+def cache_key(X, perplexity, n_neighbors=None, producer=''):
+    """ Name of the cached P, `n_neighbors` is None for P over all pairs
+    """
+    return '{}_perp{}_k{}_{}_v{}'.format(
+        dataset_hash(X), float(perplexity),
+        'all' if n_neighbors is None else n_neighbors, producer,
+        CACHE_VERSION)
+
+
+def load_P(key):
+    """ Load a cached P as memory-mapped (read-only) arrays
+    Returns:
+        csr_matrix or condensed ndarray, None if P is not in the cache
+    """
+    folder = os.path.join(CACHE_DIR, key)
+    if not os.path.isdir(folder):
+        return None
+
+    def load(name):
+        return np.load(os.path.join(folder, name + '.npy'), mmap_mode='r')
+
+    if os.path.exists(os.path.join(folder, 'condensed.npy')):
+        return load('condensed')
+    return csr_matrix((load('data'), load('indices'), load('indptr')),
+                      shape=tuple(load('shape')), copy=False)
+
+
+def save_P(key, P):
+    """ Store P (csr_matrix or condensed ndarray) in the cache.
+        The files are written in a temporary folder which is then renamed,
+        so a partially written P is never loaded.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_folder = tempfile.mkdtemp(dir=CACHE_DIR)
+
+    def save(name, arr):
+        np.save(os.path.join(tmp_folder, name + '.npy'), arr)
+
+    if issparse(P):
+        P = P.tocsr()
+        save('data', P.data)
+        save('indices', P.indices)
+        save('indptr', P.indptr)
+        save('shape', np.array(P.shape))
+    else:
+        save('condensed', P)
+
+    try:
+        os.rename(tmp_folder, os.path.join(CACHE_DIR, key))
+    except OSError:  # the same P has been stored by another process
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+
+
+def get_P(X, perplexity, n_neighbors, compute_P):
+    """ Get P from the cache, or calculate it with `compute_P()`
+        and store it in the cache
+    Args:
+        X (ndarray): the original data
+        perplexity (float): the perplexity used to calculate P
+        n_neighbors (int): number of neighbors of the sparse P,
+            None for P over all pairs
+        compute_P (callable): function without argument which calculates P,
+            the P of another function are not used
+    """
+    key = cache_key(X, perplexity, n_neighbors, producer_name(compute_P))
+    P = load_P(key)
+    if P is None:
+        P = compute_P()
+        save_P(key, P)
+    return P
@@ -0,0 +1,55 @@
+# test the cache of P on disk
+
+from functools import partial
+import numpy as np
+import pytest
+
+import p_cache
+import joint_probabilities
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmpdir, monkeypatch):
+    monkeypatch.setattr(p_cache, 'CACHE_DIR', str(tmpdir))
+
+
+def compute_once(P):
+    """ Function calculating P which fails when it is called twice
+    """
+    calls = []
+
+    def compute_P():
+        assert not calls
+        calls.append(1)
+        return P
+    return compute_P
+
+
+def test_sparse_and_condensed_round_trip():
+    X = np.random.RandomState(0).randn(100, 5)
+    P_nn = joint_probabilities.joint_probabilities_nn(X, 10.0)
+    P = joint_probabilities.joint_probabilities(X, 10.0)
+
+    compute_nn, compute = compute_once(P_nn), compute_once(P)
+    for _ in range(2):
+        cached_nn = p_cache.get_P(X, 10.0, 31, compute_nn)
+        cached = p_cache.get_P(X, 10.0, None, compute)
+        np.testing.assert_array_equal(cached_nn.toarray(), P_nn.toarray())
+        np.testing.assert_array_equal(cached, P)
+
+
+def test_functions_do_not_share_their_P():
+    X = np.random.RandomState(0).randn(100, 5)
+    P = p_cache.get_P(X, 10.0, 31, partial(
+        joint_probabilities.joint_probabilities_nn, X, 10.0))
+    other_P = p_cache.get_P(X, 10.0, 31, lambda: P * 2.0)
+    np.testing.assert_allclose(other_P.toarray(), 2.0 * P.toarray())
+
+
+def test_P_of_another_version_is_not_used(monkeypatch):
+    X = np.random.RandomState(0).randn(100, 5)
+    P = p_cache.get_P(X, 10.0, None, compute_once(np.ones(3)))
+    monkeypatch.setattr(p_cache, 'CACHE_VERSION', p_cache.CACHE_VERSION + 1)
+    new_P = p_cache.get_P(X, 10.0, None, compute_once(np.zeros(3)))
+    np.testing.assert_array_equal(P, np.ones(3))
+    np.testing.assert_array_equal(new_P, np.zeros(3))
@@ -0,0 +1,112 @@
+# pacing.py
+# Pacing of the frames sent to the client: the number of iterations between
+# two frames (`n_jump`) is chosen from the measured cost of an iteration and
+# the time the server waits for the client to acknowledge a frame,
+# so that the frames are sent at a target rate (frames per second).
+# The server only sleeps when it computes faster than the target rate.
+
+from time import time
+
+
+class FramePacer(object):
+    """ Frame pacing of the embedding loop:
+        pacer.iteration_done(duration)   # after each iteration
+        pacer.waited(duration)           # when paused by the client
+        if pacer.frame_due():
+            publish(...)
+            sleep(pacer.frame_sent(status))
+    """
+
+    def __init__(self, target_fps=10.0, n_jump=10, tick_frequence=0.2,
+                 min_jump=1, max_jump=200, smoothing=0.2,
+                 max_ack_latency=2.0):
+        """ Pacer with a fixed `n_jump` and `tick_frequence` until
+            the cost of the iterations is measured
+        Args:
+            target_fps (float): target number of frames per second,
+                0 to keep the fixed `n_jump` and sleep `tick_frequence`
+                after each frame
+            min_jump, max_jump (int): bounds of the adaptive `n_jump`
+            smoothing (float): weight of a new measure in the moving averages
+            max_ack_latency (float): longer waits for the client are
+                intentional pauses, they are not counted as its latency
+        """
+        super(FramePacer, self).__init__()
+        self.target_fps = target_fps
+        self.n_jump = n_jump
+        self.tick_frequence = tick_frequence
+        self.min_jump = min_jump
+        self.max_jump = max_jump
+        self.smoothing = smoothing
+        self.max_ack_latency = max_ack_latency
+
+        self.iteration_cost = None
+        self.ack_latency = 0.0
+        self.n_since_frame = 0
+        self.wait_since_frame = 0.0
+        self.last_frame_time = None
+
+    def _average(self, average, value):
+        if average is None:
+            return value
+        return (1.0 - self.smoothing) * average + self.smoothing * value
+
+    def iteration_done(self, duration):
+        """ Measure the cost of an iteration (in seconds)
+        """
+        self.iteration_cost = self._average(self.iteration_cost, duration)
+        self.n_since_frame += 1
+
+    def waited(self, duration):
+        """ Measure the time waiting for the client (in seconds)
+        """
+        self.wait_since_frame += duration
+
+    def is_frame_next(self):
+        """ Whether a frame is sent after the next iteration
+        """
+        return self.n_since_frame + 1 >= self.n_jump
+
+    def frame_due(self):
+        """ Whether a frame is sent after this iteration
+        """
+        return self.n_since_frame >= self.n_jump
+
+    def frame_sent(self, status=None):
+        """ Update the pacing after a frame has been sent
+        Args:
+            status (dict): the server status of which the `target_fps`,
+                `n_jump` and `tick_frequence` are taken if given
+        Returns:
+            time to sleep (in seconds) before the next iteration
+        """
+        if status is not None:
+            self.target_fps = status.get('target_fps', self.target_fps)
+            self.tick_frequence = status['tick_frequence']
+            if not self.target_fps:
+                self.n_jump = status['n_jump']
+
+        if self.wait_since_frame < self.max_ack_latency:
+            self.ack_latency = self._average(self.ack_latency,
+                                             self.wait_since_frame)
+        now = time()
+        elapsed = None if self.last_frame_time is None \
+            else now - self.last_frame_time
+        self.last_frame_time = now
+        self.n_since_frame = 0
+        self.wait_since_frame = 0.0
+
+        if not self.target_fps or not self.iteration_cost:
+            return self.tick_frequence
+
+        # computing time of a frame: the period of the frames without
+        # the time waiting for the client, but at least half the period
+        period = 1.0 / self.target_fps
+        budget = max(period - self.ack_latency, 0.5 * period)
+        self.n_jump = int(min(self.max_jump, max(
+            self.min_jump, round(budget / self.iteration_cost))))
+
+        # only sleep when the frame came faster than the target rate
+        if elapsed is None:
+            return 0.0
+        return max(0.0, period - elapsed)
@@ -0,0 +1,181 @@
+# parallel_kl.py
+# Exact KL divergence and its gradient computed by a pool of worker processes.
+# P and the embedding live in shared memory, each worker computes a block of
+# rows of the N x N matrices and only returns the O(N) partial results:
+# the unnormalized attractive and repulsive forces of its rows and its part
+# of the normalization term Z, which are reduced in the main process.
+
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+from scipy.sparse import issparse
+from scipy.spatial.distance import squareform
+
+import kl_kernels
+
+# the shared arrays seen by a worker, set by `_init_worker`
+_worker_data = {}
+
+
+def _init_worker(P_buffer, Y_buffer, n_samples, dtype):
+    """ Attach the shared buffers in the worker process (no copy)
+    """
+    _worker_data['P'] = np.frombuffer(P_buffer, dtype=dtype) \
+        .reshape(n_samples, n_samples)
+    _worker_data['Y'] = np.frombuffer(Y_buffer, dtype=dtype) \
+        .reshape(n_samples, 2)
+
+
+def _kl_rows(task):
+    """ Partial results of the rows [start, stop)
+    Returns:
+        start (int): first row of the block
+        attr (ndarray): \sum_j p_{ij} w_{ij} (y_i - y_j) for each row
+        rep (ndarray): \sum_j w_{ij}^2 (y_i - y_j) for each row
+        plogd (ndarray): \sum_j p_{ij} log(1 + ||y_i - y_j||^2 / dof)
+        sum_W (float): \sum_{j} w_{ij} over the rows of the block
+    """
+    start, stop, degrees_of_freedom = task
+    P = _worker_data['P'][start:stop]
+    Y = _worker_data['Y']
+    n_samples = Y.shape[0]
+    exponent = (degrees_of_freedom + 1.0) / 2.0
+
+    # 1 + ||y_i - y_j||^2 / dof with one matrix product, see `ExactKL`
+    sqnorm = np.einsum('ij,ij->i', Y, Y)
+    left = np.empty((stop - start, 4), dtype=Y.dtype)
+    left[:, :2] = Y[start:stop] * (-2.0 / degrees_of_freedom)
+    left[:, 2] = 1.0 + sqnorm[start:stop] / degrees_of_freedom
+    left[:, 3] = 1.0 / degrees_of_freedom
+    right = np.empty((n_samples, 4), dtype=Y.dtype)
+    right[:, :2] = Y
+    right[:, 2] = 1.0
+    right[:, 3] = sqnorm
+    W = np.dot(left, right.T)
+
+    tmp = np.log(W)
+    plogd = np.einsum('ij,ij->i', P, tmp)
+    if degrees_of_freedom == 1:
+        np.reciprocal(W, out=W)
+    else:
+        W **= -exponent
+    rows = np.arange(stop - start)
+    W[rows, rows + start] = 0.0
+    sum_W = W.sum()
+
+    # \sum_j a_{ij} (y_i - y_j) = (\sum_j a_{ij}) y_i - \sum_j a_{ij} y_j
+    Y_ones = np.ones((n_samples, 3), dtype=Y.dtype)
+    Y_ones[:, :2] = Y
+    np.multiply(P, W, out=tmp)
+    attr = np.dot(tmp, Y_ones)
+    attr = attr[:, 2:] * Y[start:stop] - attr[:, :2]
+    np.multiply(W, W, out=tmp)
+    rep = np.dot(tmp, Y_ones)
+    rep = rep[:, 2:] * Y[start:stop] - rep[:, :2]
+    return start, attr, rep, plogd, sum_W
+
+
+class ParallelExactKL(object):
+    """ Exact KL divergence and its gradient, split in blocks of rows
+        over a pool of `n_jobs` worker processes.
+        It is called as `kl_kernels.ExactKL` and must be closed at the end
+        of the session to stop the workers.
+        The speedup is measured with `benchmarks.benchmark_parallel_exact`:
+        on one cpu, an iteration at 5k points takes 0.22s, 0.22s and 0.25s
+        with 1, 2 and 4 workers against 0.21s for `ExactKL`, the workers
+        only pay off with as many free cpus.
+    """
+
+    def __init__(self, P, n_jobs, n_blocks_per_job=2, context=None):
+        """ Copy P into shared memory and start the workers
+        Args:
+            P (ndarray or sparse matrix): joint probabilities in condensed,
+                square or sparse form
+            n_jobs (int): number of worker processes
+            n_blocks_per_job (int): number of row blocks given to each worker
+                in each iteration, to balance the load
+            context: multiprocessing context to start the processes
+        """
+        super(ParallelExactKL, self).__init__()
+
+        if issparse(P):
+            P = P.toarray()
+        elif P.ndim == 1:
+            P = squareform(P)
+        n_samples = P.shape[0]
+        dtype = np.dtype(P.dtype)
+
+        typecode = {'float64': 'd', 'float32': 'f'}[dtype.name]
+        P_buffer = RawArray(typecode, n_samples * n_samples)
+        Y_buffer = RawArray(typecode, n_samples * 2)
+        self.P = np.frombuffer(P_buffer, dtype=dtype) \
+            .reshape(n_samples, n_samples)
+        self.P[:] = P
+        self.Y = np.frombuffer(Y_buffer, dtype=dtype).reshape(n_samples, 2)
+
+        # the constant part of the divergence of each point
+        self.plogp = np.einsum(
+            'ij,ij->i', self.P,
+            np.log(np.maximum(self.P, kl_kernels.MACHINE_EPSILON)))
+        self.sum_P = self.P.sum(axis=1)
+
+        bounds = np.linspace(0, n_samples, n_jobs * n_blocks_per_job + 1)
+        bounds = np.unique(bounds.astype(int))
+        self.blocks = list(zip(bounds[:-1], bounds[1:]))
+        if context is None:
+            context = multiprocessing
+        self.pool = context.Pool(
+            processes=n_jobs, initializer=_init_worker,
+            initargs=(P_buffer, Y_buffer, n_samples, dtype.name))
+
+    def __call__(self, params, P, degrees_of_freedom, n_samples, n_components,
+                 skip_num_points=0, constraints=None):
+        """ Same signature as `kl_kernels.ExactKL`,
+            `P` is ignored in favor of the shared one.
+        """
+        X_embedded = params.reshape(n_samples, n_components)
+        # centered to keep the precision of the distances, see `ExactKL`
+        np.subtract(X_embedded, X_embedded.mean(axis=0), out=self.Y)
+        exponent = (degrees_of_freedom + 1.0) / 2.0
+
+        tasks = [(start, stop, degrees_of_freedom)
+                 for start, stop in self.blocks]
+        attr = np.empty_like(X_embedded)
+        rep = np.empty_like(X_embedded)
+        plogd = np.empty(n_samples, dtype=X_embedded.dtype)
+        sum_W = 0.0
+        for start, b_attr, b_rep, b_plogd, b_sum_W in \
+                self.pool.imap_unordered(_kl_rows, tasks):
+            stop = start + b_plogd.shape[0]
+            attr[start:stop] = b_attr
+            rep[start:stop] = b_rep
+            plogd[start:stop] = b_plogd
+            sum_W += b_sum_W
+
+        # Objective: C (Kullback-Leibler divergence of P and Q)
+        divergences = exponent * plogd
+        divergences += self.plogp
+        divergences += self.sum_P * np.log(sum_W)
+        kl_divergence = np.sum(divergences)
+
+        # Gradient: dC/dY
+        # grad_i = c \sum_j (p_{ij} - w_{ij} / Z) w_{ij} (y_i - y_j)
+        grad = attr - rep / sum_W
+        grad[:skip_num_points] = 0.0
+        c = 2.0 * (degrees_of_freedom + 1.0) / degrees_of_freedom
+        grad *= c
+
+        # gradient of penalty only for the involved points
+        penalty = constraints(X_embedded, grad) \
+            if constraints is not None else 0.0
+        kl_divergence += penalty
+
+        grad = grad.ravel()
+        return kl_divergence, penalty, grad, divergences
+
+    def close(self):
+        """ Stop the worker processes
+        """
+        self.pool.terminate()
+        self.pool.join()
@@ -0,0 +1,241 @@
+# quadtree.py
+# Vectorized quadtree for the Barnes-Hut approximation of the repulsive forces
+# in t-SNE, see:
+# [1] Accelerating t-SNE using Tree-Based Algorithms (van der Maaten, 2014)
+# The tree is built and traversed level by level with numpy operations
+# so that there is no python loop over the points.
+# The traversal is the dual-tree variant of [1]: two far enough cells interact
+# through their centers of mass, which keeps the number of interactions
+# linear in the number of points. The interaction received by a cell is
+# expanded to first order around its center to keep the forces accurate
+# for all points inside the cell.
+
+import numpy as np
+
+
+class QuadTree(object):
+    """ Quadtree over a 2D embedding.
+        Each node stores its parent, the number of points, the center of mass
+        and the width of its cell.
+        The nodes are ordered level by level and the children of a node
+        are stored contiguously.
+    """
+
+    def __init__(self, Y, max_depth=24):
+        """ Build the tree
+        Args:
+            Y (ndarray): embedding of shape (n_samples, 2)
+            max_depth (int): the points which are still sharing a cell
+                at this depth (e.g. duplicated points) are kept in one leaf
+        """
+        super(QuadTree, self).__init__()
+
+        self.Y = Y
+        n_samples = Y.shape[0]
+
+        min_pos = Y.min(axis=0)
+        width = max(float(np.max(Y.max(axis=0) - min_pos)), 1e-12)
+        width *= 1.0 + 1e-6  # avoid the points on the border of the root cell
+
+        # cell coordinates of each point at the deepest level
+        scale = (1 << max_depth) / width
+        cells = np.floor((Y - min_pos) * scale).astype(np.int64)
+        np.clip(cells, 0, (1 << max_depth) - 1, out=cells)
+
+        # node arrays, filled level by level
+        levels, parents, counts, pos_sums, is_leaf = [], [], [], [], []
+        child_start, child_count = [], []
+        self.leaf_of = np.zeros(n_samples, dtype=np.int64)
+
+        # each point is attached to its current node, start from the root
+        point_ids = np.arange(n_samples)
+        node_of_points = np.zeros(n_samples, dtype=np.int64)
+        n_nodes = 0
+        level = 0
+        while point_ids.shape[0] > 0:
+            shift = max_depth - level
+            cx = cells[point_ids, 0] >> shift
+            cy = cells[point_ids, 1] >> shift
+
+            # the nodes of this level are identified by (parent, quadrant),
+            # sorting by this key keeps the children of a node contiguous
+            keys = node_of_points * 4 + (cx & 1) * 2 + (cy & 1)
+            level_keys, inverse, level_counts = np.unique(
+                keys, return_inverse=True, return_counts=True)
+            inverse = inverse.ravel()
+            n_level_nodes = level_keys.shape[0]
+
+            sums = np.empty((n_level_nodes, 2), dtype=Y.dtype)
+            sums[:, 0] = np.bincount(inverse, weights=Y[point_ids, 0],
+                                     minlength=n_level_nodes)
+            sums[:, 1] = np.bincount(inverse, weights=Y[point_ids, 1],
+                                     minlength=n_level_nodes)
+            leaves = (level_counts <= 1) | (level == max_depth)
+
+            levels.append(np.full(n_level_nodes, level, dtype=np.int64))
+            parents.append(level_keys // 4 if level > 0
+                           else np.full(1, -1, dtype=np.int64))
+            counts.append(level_counts)
+            pos_sums.append(sums)
+            is_leaf.append(leaves)
+
+            # link the parents (nodes of the previous level) to their children
+            if level > 0:
+                n_parents = child_count[-1].shape[0]
+                n_children = np.bincount(parents[-1] - (n_nodes - n_parents),
+                                         minlength=n_parents)
+                child_start[-1][:] = n_nodes + np.cumsum(n_children) \
+                    - n_children
+                child_count[-1][:] = n_children
+            child_start.append(np.zeros(n_level_nodes, dtype=np.int64))
+            child_count.append(np.zeros(n_level_nodes, dtype=np.int64))
+
+            # only the points in the internal nodes go to the next level
+            global_ids = n_nodes + inverse
+            keep = ~leaves[inverse]
+            self.leaf_of[point_ids[~keep]] = global_ids[~keep]
+            point_ids = point_ids[keep]
+            node_of_points = global_ids[keep]
+            n_nodes += n_level_nodes
+            level += 1
+
+        self.level_sizes = [lv.shape[0] for lv in levels]
+        self.parents = np.concatenate(parents)
+        self.counts = np.concatenate(counts)
+        self.centers = np.concatenate(pos_sums) / self.counts[:, None]
+        self.is_leaf = np.concatenate(is_leaf)
+        self.child_start = np.concatenate(child_start)
+        self.child_count = np.concatenate(child_count)
+
+        # a leaf holding one point has no extent
+        self.widths = width / (1 << np.concatenate(levels))
+        self.widths[self.is_leaf & (self.counts == 1)] = 0.0
+
+    def repulsive_forces(self, angle=0.5, degrees_of_freedom=1.0,
+                         skip_num_points=0):
+        """ Approximate the (unnormalized) repulsive forces and
+            the normalization term Z = \sum_{i != j} q_{ij}Z
+
+            F_i = \sum_{j != i} (q_{ij}Z)^2 (y_i - y_j)
+
+        Args:
+            angle (float): two cells interact through their centers of mass
+                when max(width1, width2) / distance < angle
+            degrees_of_freedom (float): degree of freedom of student-t kernel
+            skip_num_points (int): do not calculate forces for these points
+        Returns:
+            neg_f (ndarray): repulsive forces of shape (n_samples, 2)
+            sum_Q (float): the normalization term Z
+        """
+        Y = self.Y
+        n_nodes = self.counts.shape[0]
+        angle_square = angle * angle
+
+        # the interactions received by each cell are expanded to first order
+        # around its center c, so that for all points i in the cell:
+        # F_i = (s0 I - M) y_i - s1, Z_i = sq - g . y_i
+        sq = np.zeros(n_nodes, dtype=Y.dtype)
+        g = np.zeros((n_nodes, 2), dtype=Y.dtype)
+        s0 = np.zeros(n_nodes, dtype=Y.dtype)
+        M = np.zeros((n_nodes, 3), dtype=Y.dtype)  # (xx, xy, yy) components
+        s1 = np.zeros((n_nodes, 2), dtype=Y.dtype)
+
+        def interact(nodes, others, dist2):
+            def add(arr, weights):
+                arr += np.bincount(nodes, weights=weights, minlength=n_nodes)
+
+            # q = w^e, dq/dr = -2e/dof * q w r, d(q^2)/dr = -4e/dof * q^2 w r
+            exponent = (degrees_of_freedom + 1.0) / 2.0
+            w = degrees_of_freedom / (degrees_of_freedom + dist2)
+            qijZ = w ** exponent if degrees_of_freedom != 1 else w
+            size = self.counts[others]
+            c = self.centers[nodes]
+            r = c - self.centers[others]
+
+            grad_q = (2.0 * exponent / degrees_of_freedom) * size * qijZ * w
+            mult = size * qijZ * qijZ
+            grad_q2 = 2.0 * grad_q * qijZ
+            add(sq, size * qijZ + grad_q * np.einsum('ij,ij->i', r, c))
+            for ax in range(2):
+                add(g[:, ax], grad_q * r[:, ax])
+
+            add(s0, mult)
+            rr = (r[:, 0] * r[:, 0], r[:, 0] * r[:, 1], r[:, 1] * r[:, 1])
+            for k in range(3):
+                add(M[:, k], grad_q2 * rr[k])
+            Mc = (rr[0] * c[:, 0] + rr[1] * c[:, 1],
+                  rr[1] * c[:, 0] + rr[2] * c[:, 1])
+            for ax in range(2):
+                add(s1[:, ax], mult * self.centers[others, ax]
+                    - grad_q2 * Mc[ax])
+
+        # the points sharing a leaf are at the same position
+        shared = self.is_leaf & (self.counts > 1)
+        n_shared = self.counts[shared] - 1
+        sq[shared] += n_shared
+        s0[shared] += n_shared
+        s1[shared] += n_shared[:, None] * self.centers[shared]
+
+        # unordered pairs of cells to visit, start by opening the root
+        pair_a, pair_b = self._open_cells(np.zeros(1, dtype=np.int64))
+        while pair_a.shape[0] > 0:
+            same = pair_a == pair_b
+            a, b = pair_a[~same], pair_b[~same]
+            diff = self.centers[a] - self.centers[b]
+            dist2 = np.einsum('ij,ij->i', diff, diff)
+            summarize = (self.is_leaf[a] & self.is_leaf[b]) | \
+                (np.maximum(self.widths[a], self.widths[b]) ** 2
+                 < angle_square * dist2)
+            interact(a[summarize], b[summarize], dist2[summarize])
+            interact(b[summarize], a[summarize], dist2[summarize])
+
+            # open the larger cell of the remaining pairs
+            a, b = a[~summarize], b[~summarize]
+            open_a = (~self.is_leaf[a]) & \
+                (self.is_leaf[b] | (self.widths[a] >= self.widths[b]))
+            kept_b, opened_a = self._children_of(b[open_a], a[open_a])
+            kept_a, opened_b = self._children_of(a[~open_a], b[~open_a])
+
+            # a cell interacting with itself: pairs of its children
+            inner = pair_a[same]
+            inner_a, inner_b = self._open_cells(inner[~self.is_leaf[inner]])
+
+            pair_a = np.concatenate([opened_a, kept_a, inner_a])
+            pair_b = np.concatenate([kept_b, opened_b, inner_b])
+
+        # push the interactions of the cells down to their descendants
+        start = self.level_sizes[0]
+        for n_level_nodes in self.level_sizes[1:]:
+            level = slice(start, start + n_level_nodes)
+            parents = self.parents[level]
+            for arr in (sq, g, s0, M, s1):
+                arr[level] += arr[parents]
+            start += n_level_nodes
+
+        leaves = self.leaf_of
+        s0, M = s0[leaves], M[leaves]
+        neg_f = -s1[leaves]
+        neg_f[:, 0] += (s0 - M[:, 0]) * Y[:, 0] - M[:, 1] * Y[:, 1]
+        neg_f[:, 1] += (s0 - M[:, 2]) * Y[:, 1] - M[:, 1] * Y[:, 0]
+        neg_f[:skip_num_points] = 0.0
+        sum_Q = sq[leaves] - np.einsum('ij,ij->i', g[leaves], Y)
+        return neg_f, float(np.sum(sum_Q))
+
+    def _children_of(self, others, nodes):
+        """ Replace each pair (other, node) by the pairs (other, child)
+        """
+        n_children = self.child_count[nodes]
+        child_others = np.repeat(others, n_children)
+        offsets = np.arange(child_others.shape[0]) - \
+            np.repeat(np.cumsum(n_children) - n_children, n_children)
+        child_nodes = np.repeat(self.child_start[nodes], n_children) + offsets
+        return child_others, child_nodes
+
+    def _open_cells(self, nodes):
+        """ List the unordered pairs of children of each node,
+            including the pair of a child with itself
+        """
+        _, children = self._children_of(nodes, nodes)
+        firsts, seconds = self._children_of(children, self.parents[children])
+        keep = firsts <= seconds
+        return firsts[keep], seconds[keep]
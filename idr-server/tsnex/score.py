@@ -1,11 +1,42 @@
 import numpy as np
 from sklearn import svm, metrics
-from sklearn.metrics.pairwise import pairwise_distances
 from sklearn.cluster import KMeans
 import utils
+from spatial_index import SpatialIndex
 
 
-def PIVE_measure(old_p, new_p, dist_X, k=10):
+def knn_table(dist_X, k=10):
+    """ k nearest neighbors of each point from the pairwise distances
+        (without the point itself), found by partial sorts.
+        The table of a dataset does not change, it is calculated once
+        and given to `PIVE_measure`.
+    Returns:
+        ndarray of shape (n, k) of the ids of the neighbors
+    """
+    n = dist_X.shape[0]
+    k = min(k, n - 1)
+    candidates = np.argpartition(dist_X, k, axis=1)[:, :k + 1]
+
+    # remove each point from its neighbors, or the farthest candidate
+    # if it is not found (tie with duplicated points)
+    rows = np.arange(n)[:, None]
+    order = np.argsort(dist_X[rows, candidates], axis=1)
+    candidates = candidates[rows, order]
+    keep = candidates != rows
+    keep[keep.sum(axis=1) > k, -1] = False
+    return candidates[keep].reshape(n, k)
+
+
+def count_common(neighbors_a, neighbors_b):
+    """ Number of common ids in each row of two tables of neighbors
+        (there is no duplicated id in a row of a table)
+    """
+    merged = np.sort(np.hstack([neighbors_a, neighbors_b]), axis=1)
+    return np.count_nonzero(merged[:, 1:] == merged[:, :-1], axis=1)
+
+
+def PIVE_measure(old_p, new_p, dist_X=None, k=10, index_new=None,
+                 knn_X=None):
     """ Calculate the measurement in PIVE framework [1]
 
     stability_{t} = 1/(nk) * \sum^{n}_{i} { |
@@ -21,38 +52,35 @@ def PIVE_measure(old_p, new_p, dist_X, k=10):
 
     [1]PIVE: Per-Iteration Visualization Environment for Real-Time Interactions
         with Dimension Reduction and Clustering.
-    """
-    n = dist_X.shape[0]
 
-    dist_old = pairwise_distances(old_p.reshape(-1, 2), squared=True)
-    dist_new = pairwise_distances(new_p.reshape(-1, 2), squared=True)
-
-    k_ind_old = np.argsort(dist_old, axis=1)[:, 1:k + 1]
-    k_ind_new = np.argsort(dist_new, axis=1)[:, 1:k + 1]
-    k_ind_X = np.argsort(dist_X, axis=1)[:, 1:k + 1]
-
-    stability = 0
-    for i in range(n):
-        set_old = set(k_ind_old[i])
-        set_new = set(k_ind_new[i])
-        new_but_not_old = set_new - set_old
-        stability += len(new_but_not_old)
-    stability /= (n * k)
-
-    convergence = 0
-    for i in range(n):
-        set_embedded = set(k_ind_new[i])
-        set_X = set(k_ind_X[i])
-        intersection = set_embedded & set_X
-        convergence += len(intersection)
-    convergence /= (n * k)
-
-    return stability, convergence
-
-
-def classify(X):
+    The neighbors in the embeddings are found with a KD-tree,
+    `index_new` is the spatial index of `new_p` if it is already built.
+    The neighbors in high dim are given by `knn_X` (see `knn_table`),
+    or they are found in `dist_X` (at most n - 1 neighbors).
+    A ValueError is raised if `knn_X` has less than `k` neighbors.
+    """
+    if knn_X is None:
+        knn_X = knn_table(dist_X, k)
+        k = knn_X.shape[1]
+    elif knn_X.shape[1] < k:
+        raise ValueError("The table has {} neighbors, k={} are measured"
+                         .format(knn_X.shape[1], k))
+    k_ind_X = knn_X[:, :k]
+    n = k_ind_X.shape[0]
+
+    if index_new is None:
+        index_new = SpatialIndex(new_p.reshape(-1, 2))
+    _, k_ind_old = SpatialIndex(old_p.reshape(-1, 2)).knn(k=k)
+    _, k_ind_new = index_new.knn(k=k)
+
+    stability = np.sum(k - count_common(k_ind_new, k_ind_old)) / (n * k)
+    convergence = np.sum(count_common(k_ind_new, k_ind_X)) / (n * k)
+    return float(stability), float(convergence)
+
+
+def classify(X, session_id=utils.DEFAULT_SESSION):
     n = len(X)
-    y = utils.get_y()
+    y = utils.get_y(session_id)
     classifier = svm.SVC(gamma=0.001)
     classifier.fit(X[:n // 2], y[:n // 2])
     y_true = y[n // 2:]
@@ -62,8 +90,9 @@ def classify(X):
     return float(score)
 
 
-def clutering(X):
-    labels = utils.get_y()
+def clutering(X, session_id=utils.DEFAULT_SESSION, labels=None):
+    if labels is None:
+        labels = utils.get_y(session_id)
     n_clusters = len(np.unique(labels))
     kmeans = KMeans(init='k-means++', n_clusters=n_clusters, n_init=10)
     kmeans.fit(X)
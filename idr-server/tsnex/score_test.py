@@ -0,0 +1,40 @@
+# test the PIVE measures with the table of neighbors in high dim
+
+import numpy as np
+import pytest
+from sklearn.metrics.pairwise import pairwise_distances
+
+import score
+
+
+def make_problem(n_points=60):
+    random_state = np.random.RandomState(0)
+    X = random_state.randn(n_points, 5)
+    dist_X = pairwise_distances(X, squared=True)
+    old_p = random_state.randn(n_points, 2).ravel()
+    new_p = old_p + 0.1 * random_state.randn(2 * n_points)
+    return dist_X, old_p, new_p
+
+
+def test_pive_measure_of_a_wider_table():
+    dist_X, old_p, new_p = make_problem()
+    expected = score.PIVE_measure(old_p, new_p, dist_X=dist_X, k=5)
+
+    # the table is sliced to the k nearest neighbors
+    knn_X = score.knn_table(dist_X, k=20)
+    assert score.PIVE_measure(old_p, new_p, k=5, knn_X=knn_X) == expected
+    assert score.PIVE_measure(old_p, new_p, k=20, knn_X=knn_X) != expected
+
+
+def test_pive_measure_of_a_narrower_table():
+    dist_X, old_p, new_p = make_problem()
+    knn_X = score.knn_table(dist_X, k=5)
+    with pytest.raises(ValueError):
+        score.PIVE_measure(old_p, new_p, k=10, knn_X=knn_X)
+
+
+def test_pive_measure_of_a_small_dataset():
+    dist_X, old_p, new_p = make_problem(n_points=6)
+    stability, convergence = score.PIVE_measure(old_p, new_p, dist_X=dist_X,
+                                                k=10)
+    assert 0.0 <= stability <= 1.0 and 0.0 <= convergence <= 1.0
@@ -0,0 +1,79 @@
+# spatial_index.py
+# Spatial index (KD-tree) over the live 2D embedding, shared by all the
+# neighbor searches in the embedding: neighbors of the fixed points,
+# gradient sharing, PIVE measurement and the neighbors sent to the client.
+# The embedding changes in each iteration, the tree is only rebuilt
+# (in O(N log N)) when it is queried after a change, then a query of
+# k neighbors is in O(k log N).
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class SpatialIndex(object):
+    """ KD-tree over an embedding which is rebuilt lazily:
+        index = SpatialIndex(Y)
+        Y += update
+        index.invalidate()
+        distances, neighbors = index.knn([0, 1], k=10)
+    """
+
+    def __init__(self, Y, leafsize=16):
+        """ Index the points of `Y` (of shape (n_samples, 2)),
+            `Y` is kept by reference to follow the embedding.
+        """
+        super(SpatialIndex, self).__init__()
+        self.Y = Y
+        self.leafsize = leafsize
+        self.tree = None
+
+    def invalidate(self):
+        """ Mark the tree as outdated after the points have been moved
+        """
+        self.tree = None
+
+    def get_tree(self):
+        if self.tree is None:
+            self.tree = cKDTree(self.Y, leafsize=self.leafsize)
+        return self.tree
+
+    def knn(self, ids=None, k=10):
+        """ k nearest neighbors of the indexed points, without themselves
+        Args:
+            ids (list): ids of the query points, all points if None
+            k (int): number of neighbors
+        Returns:
+            distances (ndarray): euclidean distances of shape (len(ids), k)
+            neighbors (ndarray): ids of the neighbors of shape (len(ids), k)
+                sorted by distances
+        """
+        ids = np.arange(self.Y.shape[0]) if ids is None \
+            else np.asarray(ids, dtype=int)
+        k = min(k, self.Y.shape[0] - 1)
+        distances, neighbors = self.get_tree().query(self.Y[ids], k=k + 1)
+        distances = distances.reshape(ids.shape[0], k + 1)
+        neighbors = neighbors.reshape(ids.shape[0], k + 1)
+
+        # remove each query point from its neighbors, or the farthest one
+        # if it is not found (tie with duplicated points)
+        keep = neighbors != ids[:, None]
+        keep[keep.sum(axis=1) > k, -1] = False
+        return distances[keep].reshape(-1, k), neighbors[keep].reshape(-1, k)
+
+    def query(self, points, k=10):
+        """ k nearest indexed points of any positions
+        Returns:
+            distances, neighbors (ndarray): of shape (len(points), k)
+        """
+        points = np.asarray(points).reshape(-1, 2)
+        k = min(k, self.Y.shape[0])
+        distances, neighbors = self.get_tree().query(points, k=k)
+        return distances.reshape(-1, k), neighbors.reshape(-1, k)
+
+    def radius(self, points, r):
+        """ Ids of the indexed points in the radius `r` of each position
+        Returns:
+            list of lists of ids
+        """
+        points = np.asarray(points).reshape(-1, 2)
+        return self.get_tree().query_ball_point(points, r)
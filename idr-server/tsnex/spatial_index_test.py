@@ -0,0 +1,82 @@
+# test the spatial index of the embedding against brute force
+
+import numpy as np
+import pytest
+from sklearn.metrics.pairwise import euclidean_distances
+
+import spatial_index
+from spatial_index import SpatialIndex
+
+
+@pytest.fixture
+def n_builds(monkeypatch):
+    """ Count the builds of the KD-trees
+    """
+    builds = []
+    cKDTree = spatial_index.cKDTree
+    monkeypatch.setattr(spatial_index, 'cKDTree',
+                        lambda *args, **kwargs: builds.append(1) or
+                        cKDTree(*args, **kwargs))
+    return builds
+
+
+def make_embedding(n_samples=300):
+    return np.random.RandomState(0).randn(n_samples, 2) * 10
+
+
+def test_knn_matches_brute_force():
+    Y = make_embedding()
+    distances, neighbors = SpatialIndex(Y).knn(k=7)
+    brute = euclidean_distances(Y)
+    np.fill_diagonal(brute, np.inf)
+    expected = np.argsort(brute, axis=1)[:, :7]
+    np.testing.assert_array_equal(neighbors, expected)
+    np.testing.assert_allclose(
+        distances, np.take_along_axis(brute, expected, axis=1))
+
+    # the neighbors of some points, without themselves
+    ids = [5, 0, 299]
+    distances, neighbors = SpatialIndex(Y).knn(ids, k=7)
+    np.testing.assert_array_equal(neighbors, expected[ids])
+
+
+def test_knn_of_duplicated_points():
+    Y = np.array([[0.0, 0.0], [0.0, 0.0], [1.0, 0.0], [3.0, 0.0]])
+    distances, neighbors = SpatialIndex(Y).knn(k=2)
+    assert distances.shape == neighbors.shape == (4, 2)
+    assert not np.any(neighbors == np.arange(4)[:, None])
+    np.testing.assert_allclose(distances[:2], [[0.0, 1.0], [0.0, 1.0]])
+
+
+def test_query_and_radius_match_brute_force():
+    Y = make_embedding()
+    index = SpatialIndex(Y)
+    points = np.random.RandomState(1).randn(20, 2) * 10
+    brute = euclidean_distances(points, Y)
+
+    distances, neighbors = index.query(points, k=5)
+    expected = np.argsort(brute, axis=1)[:, :5]
+    np.testing.assert_array_equal(neighbors, expected)
+    np.testing.assert_allclose(
+        distances, np.take_along_axis(brute, expected, axis=1))
+
+    for point_ids, row in zip(index.radius(points, 3.0), brute):
+        assert sorted(point_ids) == np.flatnonzero(row <= 3.0).tolist()
+
+
+def test_rebuilt_only_after_invalidate(n_builds):
+    Y = make_embedding()
+    index = SpatialIndex(Y)
+    index.knn(k=5)
+    index.query([[0.0, 0.0]])
+    index.radius([[0.0, 0.0]], 1.0)
+    assert len(n_builds) == 1
+
+    # the index follows the embedding moved in place
+    Y[:] = Y[::-1] + 100.0
+    index.invalidate()
+    _, neighbors = index.query([Y[0]], k=1)
+    assert neighbors[0, 0] == 0
+    assert len(n_builds) == 2
+    index.knn(k=5)
+    assert len(n_builds) == 2
@@ -2,445 +2,377 @@
 # interactive tsne:
 # https://www.oreilly.com/learning/an-illustrated-introduction-to-the-t-sne-algorithm
 
+import os
+import json
+import shutil
+import threading
+import multiprocessing
+import queue
 import numpy as np
-from numpy import linalg
-import sklearn
-from sklearn.manifold import TSNE
-from sklearn.manifold.t_sne import trustworthiness
-from sklearn.metrics.pairwise import pairwise_distances
-from sklearn.neighbors import NearestNeighbors
-from scipy.spatial.distance import pdist, cdist
-from scipy.spatial.distance import squareform
 import networkx as nx
 from time import time, sleep
 import utils
-import score
+import p_cache
+from engine import InteractiveTSNE
+from convergence import ConvergenceMonitor
+from pacing import FramePacer
+from metrics_worker import MetricsWorker
+
+# folder of the checkpoints of the sessions, with a sub-folder for each
+# session, can be changed by an environment variable.
+# It is not in redis, of which the keys are deleted when a dataset is loaded
+CHECKPOINT_DIR = os.environ.get(
+    'TSNEX_CHECKPOINTS',
+    os.path.join(os.path.expanduser('~'), '.cache', 'tsnex_checkpoints'))
+
+
+# max number of sessions computing their embedding at the same time in this
+# host, the other sessions wait for a free worker
+MAX_WORKERS = int(os.environ.get('TSNEX_MAX_WORKERS', os.cpu_count() or 1))
+workers = threading.BoundedSemaphore(MAX_WORKERS)
+
+# the embedding of each session runs in its own worker process, so the
+# numpy loop does not hold the GIL of the web server.
+# The workers are spawned (not forked from the gevent server), the data
+# and the status are in redis and the client interactions are sent through
+# a queue created by `new_interaction_queue`.
+# With the in-memory backend of `utils`, the embedding runs in a thread.
+mp_context = multiprocessing.get_context('spawn')
+
+# data of the session(s) running in this process, by session id
+sessions = {}
+
+
+def is_stopped(session_id):
+    """ Whether the session is stopped (or its data has been cleaned)
+    """
+    status_str = utils.get_from_db('status', session_id)
+    return status_str is None or json.loads(status_str)['stop']
+
 
-MACHINE_EPSILON = np.finfo(np.double).eps
+def checkpoint_file(session_id, X, method):
+    """ Path of the checkpoint of a session for a dataset and a method
+    """
+    return os.path.join(CHECKPOINT_DIR, session_id, '{}_{}.npz'.format(
+        p_cache.dataset_hash(X), method))
 
 
-shared_data = {
-    'queue': None,
-    'fixed_ids': [],
-    'fixed_pos': [],
-    'errors': [],
-    'grad_norms': [],
-    'z_info': None
-}
+def delete_checkpoints(session_id):
+    """ Delete the checkpoints of a session, the embedding of its datasets
+        starts again from scratch
+    """
+    shutil.rmtree(os.path.join(CHECKPOINT_DIR, session_id),
+                  ignore_errors=True)
+
+
+def new_interaction_queue():
+    """ Queue of the client interactions which can be sent to a worker
+    """
+    if not utils.get_backend().multiprocess:
+        return queue.Queue()
+    return mp_context.Queue()
 
 
-def boostrap_do_embedding(X, shared_queue=None):
+def boostrap_do_embedding(shared_queue=None,
+                          session_id=utils.DEFAULT_SESSION):
     """
     Boostrap to start doing embedding:
-    Initialize the tsne object, setup params
+    Wait for a free worker, then run the embedding of the session in a worker
+    process until the client stops the server.
+    This function only waits, it can run in a thread of the web server.
     """
-    print("[TSNEX] Thread to do embedding is starting ... ")
-
-    shared_data['queue'] = shared_queue
-    shared_data['fixed_ids'] = []
-    shared_data['fixed_pos'] = []
-    shared_data['errors'] = []
-    shared_data['grad_norms'] = []
-    shared_data['z_info'] = np.zeros(X.shape[0])
-
-    sklearn.manifold.t_sne._gradient_descent = my_gradient_descent
-    tsne = TSNE(
-        n_components=2,
-        random_state=0,
-        init='random',
-        method='exact',  # use this method to hook into kl_divergence
+    print("[TSNEX] Embedding of session {} is waiting for a worker ... "
+          .format(session_id))
+    while not workers.acquire(timeout=1.0):
+        if is_stopped(session_id):
+            return
+    try:
+        if not utils.get_backend().multiprocess:
+            do_embedding(shared_queue, session_id)
+            return
+        worker = mp_context.Process(
+            name='tsnex_worker_{}'.format(session_id),
+            target=do_embedding,
+            args=(shared_queue, session_id))
+        worker.start()
+        worker.join()
+    finally:
+        workers.release()
+
+
+def do_embedding(shared_queue, session_id=utils.DEFAULT_SESSION):
+    """ Run the embedding of a session in the current (worker) process,
+        the dataset is read from redis
+    """
+    print("[TSNEX] Worker to do embedding is starting ... ")
+    X = utils.get_X(session_id)
+
+    session = sessions[session_id] = {
+        'queue': shared_queue,
+        'engine': None,
+        'errors': [],
+        'grad_norms': []
+    }
+
+    status = utils.get_server_status(['method', 'angle', 'n_jobs',
+                                      'precision', 'resume'], session_id)
+    engine = InteractiveTSNE(
+        X,
+        method=status['method'],
         perplexity=30.0,
         early_exaggeration=12.0,
+        n_iter_exaggeration=150,
         learning_rate=100.0,
-        n_iter_without_progress=500,
-        verbose=2
+        angle=status['angle'],
+        n_jobs=status['n_jobs'],
+        precision=status['precision'],
+        random_state=0,
+        context=mp_context
     )
-    tsne._EXPLORATION_N_ITER = 150
-
-    X_projected = tsne.fit_transform(X)
-    return X_projected
-
-
-# Folk this internal function in
-# /opt/anaconda3/lib/python3.6/site-packages/sklearn/manifold/t_sne.py
-def my_gradient_descent(objective, p0, it, n_iter,
-                        n_iter_check=1, n_iter_without_progress=300,
-                        momentum=0.8, learning_rate=200.0, min_gain=0.01,
-                        min_grad_norm=1e-7, verbose=0, args=None, kwargs=None):
-    if args is None:
-        args = []
-    if kwargs is None:
-        kwargs = {}
-
-    p = p0.copy().ravel()
-    update = np.zeros_like(p)
-    gains = np.ones_like(p)
-    error = np.finfo(np.float).max
-    best_error = np.finfo(np.float).max
-    best_iter = i = it
-    tic = time()
-
-    X_original = utils.get_X()
-    dist_X_original = pairwise_distances(X_original, squared=True)
-    # weights = pdist(X_original)
-    # dist_X_original = squareform(weights)
-    # weights = weights / np.sum(weights)
-    weights = np.ones_like(dist_X_original)
-    np.fill_diagonal(weights, 0.0)
-
-    shared_queue = shared_data['queue']
-    must_share = utils.get_server_status(['accumulate'])
-    must_share = must_share['accumulate']
-
-    fixed_ids = shared_data['fixed_ids'] if must_share else []
-    fixed_pos = shared_data['fixed_pos'] if must_share else []
-    errors = shared_data['errors'] if must_share else []
-    grad_norms = shared_data['grad_norms'] if must_share else []
-    z_info = shared_data['z_info']
-    if not must_share:
-        z_info = np.zeros(z_info.shape[0])
+    session['engine'] = engine
+
+    # continue the last run of this session and dataset from its checkpoint
+    checkpoint = checkpoint_file(session_id, X, engine.method)
+    os.makedirs(os.path.dirname(checkpoint), exist_ok=True)
+    if status['resume'] and os.path.exists(checkpoint):
+        extra = engine.load_checkpoint(checkpoint)
+        session['errors'] = extra['errors'].tolist()
+        session['grad_norms'] = extra['grad_norms'].tolist()
+        print("[TSNEX] Resume from iteration {}".format(engine.n_iter))
+        if engine.fixed_ids:
+            fixed_points = {str(fixed_id): pos for fixed_id, pos
+                            in zip(engine.fixed_ids, engine.fixed_pos)}
+            utils.set_to_db('fixed_points', json.dumps(fixed_points),
+                            session_id)
+
+    try:
+        run_embedding(engine, shared_queue, session_id, checkpoint)
+    finally:
+        # stop the worker processes of the parallel kernel
+        engine.close()
+        sessions.pop(session_id, None)
+    return engine.snapshot()['embedding']
+
+
+def run_embedding(engine, shared_queue, session_id=utils.DEFAULT_SESSION,
+                  checkpoint=None, n_iter_check=50,
+                  n_iter_without_progress=300, min_improvement=1e-4,
+                  min_grad_norm=1e-7, verbose=2):
+    """ Interactive loop: step the engine, apply the points moved by the client
+        and publish the intermediate results.
+        The iterations are counted from the start of each stage
+        (early exaggeration and main stage) as `pause_at` is in the main stage.
+        The state of the engine is saved in the file `checkpoint`
+        every `checkpoint_every` iterations of the server status.
+        When the main stage has converged, the loop sleeps until the client
+        moves some points or changes the parameters.
+        The loop has its own cache of the server status (it blocks on it)
+        which is updated by the notifications of its changes,
+        it never polls redis.
+    """
+    status_cache = utils.StatusCache(session_id)
+    status = status_cache.status
+    must_share = status['accumulate']
+    errors = sessions[session_id]['errors']
+    grad_norms = sessions[session_id]['grad_norms']
+
+    # the measurements are done by a pool of processes which do not block
+    # the optimization, the results are sent in the next frames
+    metrics = MetricsWorker(engine.X, utils.get_y(session_id),
+                            context=mp_context)
+    measures_from = 0
+    old_p = np.empty_like(engine.p)
 
     # some temporary measurements to plot at client side
-    hubs = []
-    authors = []
-    pageranks = []
     embedding_scores = []
     classification_scores = []
     clustering_scores = []
     penalties = []
 
-    in_early_exaggeration = n_iter < 500
-    n_neighbors = int(0.05 * X_original.shape[0])
-    knnModel2d = NearestNeighbors(n_neighbors)
+    monitor = ConvergenceMonitor(n_iter_without_progress, min_improvement,
+                                 min_grad_norm)
+    pacer = FramePacer(status['target_fps'], status['n_jump'],
+                       status['tick_frequence'])
+    tic = time()
+
+    # iteration of the last published frame: before `pause_at`, a progress
+    # frame is published every `n_iter_check` iterations (counted from the
+    # last one, the paced frames rarely fall on a multiple of it)
+    last_published = engine.n_iter
 
     print("\nGradien Descent:")
-    i = 0
-    while True:
-        i += 1
-        if in_early_exaggeration and i > n_iter:
-            break  # early_exaggeration
-
-        status = utils.get_server_status()
-        if status['stop'] is True:
-            return p, error, i
-
-        # wait for the `ready` flag to become `True` in order to continue
-        # note that, this flag can be changed at any time
-        # so for consitently checking this flag, get it directly from redis.
-        while utils.get_ready_status() is False:
-            sleep(status['tick_frequence'])
-
-        if not shared_queue.empty():
-            shared_item = shared_queue.get()
-            fixed_ids = shared_item['fixed_ids']
-            fixed_pos = shared_item['fixed_pos']
-
-        if fixed_ids and fixed_pos:
-            # keep the old embedding for calculate neighbors of moved points
-            X2d = p.copy().reshape(-1, 2)
-            n_neighbors = int(0.05 * X2d.shape[0])
-            distances = cdist(X2d[fixed_ids], X2d, 'sqeuclidean')
-            knn = np.argsort(distances, axis=1)[:, 1:n_neighbors+1]
-            kwargs['fixed_ids'] = fixed_ids
-            kwargs['neighbor_ids'] = knn
-            kwargs['reg_param'] = 1e5 # 1e-3 for L2-penalty
-
-            # update position of the newly moved points
-            p.reshape(-1, 2)[fixed_ids] = fixed_pos
-
-        # calculate gradient and KL divergence
-        error, penalty, grad, divergences = my_kl_divergence3(p, *args, **kwargs)
-        z_info += divergences
-
-        # calculate the magnitude of gradient of each point
-        grad_per_point = linalg.norm(grad.reshape(-1, 2), axis=1)
-        grad_norm = np.sum(grad_per_point)
-
-        # tsne update gradient by momentum
-        inc = update * grad < 0.0
-        dec = np.invert(inc)
-        gains[inc] += 0.2
-        gains[dec] *= 0.8
-        np.clip(gains, min_gain, np.inf, out=gains)
-        grad *= gains
-        update = momentum * update - learning_rate * grad
-        old_p = p.copy()
-        p += update
-
-        # manual fix the pos of moved point
-        if fixed_ids and fixed_pos:
-            p.reshape(-1, 2)[fixed_ids] = fixed_pos
-
-        if (i % status['n_jump'] == 0):
-            if status['measure'] is True:
-                trustwth = trustworthiness(dist_X_original, p.reshape(-1, 2),
-                                           n_neighbors=10, precomputed=True)
-                stability, convergence = score.PIVE_measure(
-                    old_p, p, dist_X_original)
-                embedding_scores.append((trustwth, stability, convergence))
-
-                # classification_scores.append(score.classify(X_embedded))
-                clustering_scores.append(score.clutering(p.reshape(-1, 2)))
-
-            errors.append(error)
-            penalties.append(penalty)
-            grad_norms.append(float(grad_norm))
-
-            # auto mode or interactive mode
-            if (status['pause_at'] == 0) \
-                or (i % n_iter_check == 0) \
-                or (not in_early_exaggeration and i > status['pause_at']):
-                
-                # distances2d, neighbors2d = knnModel2d.fit(p.reshape(-1,2)).kneighbors()
-                client_data = {
-                    'embedding': p.copy().tostring().decode('latin-1'),
-                    'z_info': z_info.tolist(),
-                    'distances': [], # distances2d.tolist(),
-                    'neighbors': [], # list(map(lambda s: list(map(str, s)), neighbors2d)),
-                    # these two fields cause: gevent.hub.LoopExit: ('This operation would block forever'
-                    'seriesData': [
-                        {'name': 'errors, penalty', 'series': [errors, penalties]},
-                        {'name': 'gradients norms', 'series': [grad_norms]},
-                        # {'name': 'classification accuracy',
-                        #     'series': [classification_scores]},
-                        {'name': 'vmeasure, silhoutte',
-                            'series': [list(t) for t in zip(*clustering_scores)]},
-                        {'name': 'trustworthinesses,statbility,convergence',
-                            'series': [list(t) for t in zip(*embedding_scores)]},
-                    ]
-                }
-                utils.publish_data(client_data)
-                sleep(status['tick_frequence'])
-
-        # wait for client's strategy                
-        if (not in_early_exaggeration) and i == status['pause_at']:
-            print("[PAUSING]Waiting for client's strategy ... ")
-            utils.pause_server()
-
-        if (i + 1) % n_iter_check == 0:
-            toc = time()
-            duration = toc - tic
-            tic = toc
-
-            if verbose >= 2:
-                print("[t-SNE] Iteration %d: error = %.7f,"
-                      " gradient norm = %.7f"
-                      " (%s iterations in %0.3fs)"
-                      % (i + 1, error, grad_norm, n_iter_check, duration))
-
-            if error < best_error:
-                best_error = error
-                best_iter = i
-            elif i - best_iter > n_iter_without_progress:
+    try:
+        in_early_exaggeration = engine.in_early_exaggeration
+        while True:
+            i = engine.n_iter + 1
+            if not engine.in_early_exaggeration:
+                i -= engine.n_iter_exaggeration
+            if in_early_exaggeration and not engine.in_early_exaggeration:
+                # start of the main stage
+                in_early_exaggeration = False
+                monitor.reset()
+                if not must_share:
+                    del errors[:], grad_norms[:], penalties[:]
+                    del embedding_scores[:], clustering_scores[:]
+                    engine.z_info.fill(0.0)
+                    measures_from = engine.n_iter
+
+            # wait for the `ready` flag to become `True` in order to continue
+            # note that, this flag can be changed at any time
+            # so the changes are applied before each iteration.
+            status_cache.poll()
+            if status['ready'] is False:
+                wait_start = time()
+                while status['ready'] is False and status['stop'] is False:
+                    status_cache.wait()
+                pacer.waited(time() - wait_start)
+
+            if status['stop'] is True:
+                if checkpoint and status['checkpoint_every']:
+                    engine.save_checkpoint(checkpoint, errors=errors,
+                                           grad_norms=grad_norms)
+                break
+
+            # the neighbors of the moved points are updated in each iteration
+            try:
+                apply_interaction(engine, shared_queue.get_nowait())
+            except queue.Empty:
+                engine.apply_fixed_points()
+
+            # keep the old embedding only when it is measured
+            must_measure = pacer.is_frame_next() and status['measure']
+            if must_measure:
+                np.copyto(old_p, engine.p)
+
+            step_start = time()
+            error = engine.step()
+            pacer.iteration_done(time() - step_start)
+            p = engine.p
+            if not in_early_exaggeration:
+                monitor.update(error, engine.grad_norm)
+
+            if checkpoint and status['checkpoint_every'] \
+                    and engine.n_iter % status['checkpoint_every'] == 0:
+                engine.save_checkpoint(checkpoint, errors=errors,
+                                       grad_norms=grad_norms)
+
+            if pacer.frame_due():
+                if must_measure:
+                    metrics.submit(engine.n_iter, old_p, p)
+                for n_iter, embedding_score, clustering_score \
+                        in metrics.collect():
+                    # skip the measures of the early exaggeration if not shared
+                    if n_iter > measures_from:
+                        embedding_scores.append(embedding_score)
+                        clustering_scores.append(clustering_score)
+                    # classification_scores.append(score.classify(X_embedded))
+
+                errors.append(error)
+                penalties.append(engine.penalty)
+                grad_norms.append(engine.grad_norm)
+                frame_pause = pacer.frame_sent(status)
+
+                # auto mode or interactive mode
+                if (status['pause_at'] == 0) \
+                    or (engine.n_iter - last_published >= n_iter_check) \
+                    or (not in_early_exaggeration and i > status['pause_at']):
+
+                    distances2d, neighbors2d = [], []
+                    if status['send_neighbors']:
+                        distances2d, neighbors2d = engine.index.knn(
+                            k=status['n_neighbors'])
+                        distances2d = distances2d.tolist()
+                        neighbors2d = [list(map(str, s)) for s in neighbors2d]
+                    client_data = {
+                        'embedding': p.reshape(-1, 2),
+                        'z_info': engine.z_info,
+                        'distances': distances2d,
+                        'neighbors': neighbors2d,
+                        # these two fields cause: gevent.hub.LoopExit: ('This operation would block forever'
+                        'seriesData': [
+                            {'name': 'errors, penalty', 'series': [errors, penalties]},
+                            {'name': 'gradients norms', 'series': [grad_norms]},
+                            # {'name': 'classification accuracy',
+                            #     'series': [classification_scores]},
+                            {'name': 'vmeasure, silhoutte',
+                                'series': [list(t) for t in zip(*clustering_scores)]},
+                            {'name': 'trustworthinesses,statbility,convergence',
+                                'series': [list(t) for t in zip(*embedding_scores)]},
+                        ]
+                    }
+                    utils.publish_data(client_data, session_id)
+                    last_published = engine.n_iter
+                    sleep(frame_pause)
+
+            # wait for client's strategy
+            if (not in_early_exaggeration) and i == status['pause_at']:
+                print("[PAUSING]Waiting for client's strategy ... ")
+                utils.pause_server(session_id)
+
+            if (i + 1) % n_iter_check == 0:
+                toc = time()
+                duration = toc - tic
+                tic = toc
+
                 if verbose >= 2:
-                    print("[t-SNE] Iteration %d: did not make any progress "
-                          "during the last %d episodes. Finished."
-                          % (i + 1, n_iter_without_progress))
-                # break
-            if grad_norm <= min_grad_norm:
+                    print("[t-SNE] Iteration %d: error = %.7f,"
+                          " gradient norm = %.7f"
+                          " (%s iterations in %0.3fs)"
+                          % (i + 1, error, engine.grad_norm, n_iter_check,
+                             duration))
+
+            # converged: sleep until the client moves some points or
+            # changes the params (the ready/client_iter handshake of the
+            # frames does not count), then continue the optimization
+            if monitor.converged and status['idle_when_converged']:
                 if verbose >= 2:
-                    print("[t-SNE] Iteration %d: gradient norm %f. Finished."
-                          % (i + 1, grad_norm))
-                # break
-
-    return p, error, i
-
-
-def share_grad(grad2d, dist_y, fixed_ids, k=10):
-    nn = np.argsort(dist_y, axis=1)
-    for fixed_id in fixed_ids:
+                    print("[t-SNE] Iteration %d: %s. Idle."
+                          % (i + 1, monitor.reason))
+                wait_for_interaction(engine, shared_queue, status_cache)
+                monitor.reset()
+                tic = time()
+    finally:
+        metrics.close()
+        status_cache.close()
+
+
+def apply_interaction(engine, shared_item):
+    """ Apply an item of the interaction queue: the moved points
+        (`/tsnex/moved_points`) and the pairwise constraints (`/tsnex/links`)
+        come in separate items
+    """
+    engine.apply_fixed_points(shared_item.get('fixed_ids'),
+                              shared_item.get('fixed_pos'))
+    engine.set_links(shared_item.get('mustlinks'),
+                     shared_item.get('cannotlinks'))
+
+
+def wait_for_interaction(engine, shared_queue, status_cache, timeout=0.1):
+    """ Sleep until the client moves some points (the item is applied)
+        or changes the params (the ready/client_iter handshake of the
+        frames does not count).
+        The queue is read with a timeout instead of checking `empty()`:
+        an item put in a multiprocessing queue is flushed by a thread,
+        so the queue can look empty right after the put.
+    """
+    while True:
+        try:
+            apply_interaction(engine, shared_queue.get(timeout=timeout))
+            return
+        except queue.Empty:
+            pass
+        if set(status_cache.poll()) - {'ready', 'client_iter'}:
+            return
+
+
+def share_grad(grad2d, index, fixed_ids, k=10):
+    """ Share the gradient of each fixed point to its k nearest neighbors
+        which are not fixed, `index` is the spatial index of the embedding
+    """
+    _, nn = index.knn(fixed_ids, k + len(fixed_ids))
+    for fixed_id, neighbors in zip(fixed_ids, nn):
         grad_for_share = grad2d[fixed_id] / k
         if grad_for_share[0] and grad_for_share[1]:
-            ki = 0
-            for target_i in nn[fixed_id]:
-                if target_i not in fixed_ids:
-                    grad2d[target_i] += grad_for_share
-                    ki += 1
-                    if ki == k:
-                        break
+            targets = neighbors[~np.isin(neighbors, fixed_ids)][:k]
+            grad2d[targets] += grad_for_share
             grad2d[fixed_id] = 0.0
-
-
-def my_kl_divergence(params, P, degrees_of_freedom, n_samples, n_components,
-                     skip_num_points=0, weights=None):
-
-    # for idx in range(len(fixed_ids)):
-    #     src_id = fixed_ids[idx]
-    #     targets = knn[idx]
-
-    #     for idx2 in range(len(targets)):
-    #         target_id = targets[idx2]
-
-    #         if target_id != src_id:
-    #             dist = float(distances[idx][idx2])
-    #             weights[src_id][target_id] = weights[target_id][src_id] = \
-    #                 float(status['use_weight'])
-    use_weights_on_Q = True
-    X_embedded = params.reshape(n_samples, n_components)
-
-    # Q is a heavy-tailed distribution: Student's t-distribution
-    dist = pdist(X_embedded, "sqeuclidean")
-    if weights is None:
-        weights = np.ones_like(dist)
-    else:
-        weights = squareform(weights)
-
-    if use_weights_on_Q:
-        """ q_{ij} = \frac
-                {(1 + w_{ij} * \norm^2{y_i - y_j})^{-1}}
-                {\sum_{k,l}(1 + w_{kl} * \norm^2{y_k - y_l})^{-1}}
-        """
-        dist *= weights
-
-    dist /= degrees_of_freedom
-    dist += 1.
-    dist **= (degrees_of_freedom + 1.0) / -2.0
-    Q = np.maximum(dist / (2.0 * np.sum(dist)), MACHINE_EPSILON)
-
-    # Optimization trick below: np.dot(x, y) is faster than
-    # np.sum(x * y) because it calls BLAS
-
-    # Objective: C (Kullback-Leibler divergence of P and Q)
-    # kl_divergence_original = 2.0 * np.dot(P, np.log(np.maximum(P, MACHINE_EPSILON) / Q))
-    divergences = P * np.log(np.maximum(P, MACHINE_EPSILON) / Q)
-    if not use_weights_on_Q:
-        # use simple weight: KL(P||Q) = \sum_i \sum_j w_{ij} * p_{ij} * log (p_{ij}/q_{ij})
-        divergences *= weights
-    kl_divergence = 2.0 * np.sum(divergences)
-    divergences = squareform(divergences)
-    divergences = np.sum(divergences, axis=1)
-
-    # Gradient: dC/dY
-    grad = np.ndarray((n_samples, n_components), dtype=params.dtype)
-
-    if use_weights_on_Q:
-        PQd = squareform((P - Q) * dist * weights)
-    else:
-        PQd = squareform((P - Q) * dist)
-
-    for i in range(skip_num_points, n_samples):
-        grad[i] = np.dot(np.ravel(PQd[i], order='K'),
-                         X_embedded[i] - X_embedded)
-
-    grad = grad.ravel()
-    c = 2.0 * (degrees_of_freedom + 1.0) / degrees_of_freedom
-    grad *= c
-
-    return kl_divergence, grad, divergences
-
-
-def my_kl_divergence2(params, P, degrees_of_freedom, n_samples, n_components,
-                      skip_num_points=0,
-                      reg_param=0, fixed_ids=None, neighbor_ids=None):
-
-    X_embedded = params.reshape(n_samples, n_components)
-
-    # Q is a heavy-tailed distribution: Student's t-distribution
-    dist = pdist(X_embedded, "sqeuclidean")
-    dist /= degrees_of_freedom
-    dist += 1.
-    dist **= (degrees_of_freedom + 1.0) / -2.0
-    Q = np.maximum(dist / (2.0 * np.sum(dist)), MACHINE_EPSILON)
-
-    # Optimization trick below: np.dot(x, y) is faster than
-    # np.sum(x * y) because it calls BLAS
-
-    # Objective: C (Kullback-Leibler divergence of P and Q)
-    # kl_divergence = 2.0 * np.dot(P, np.log(np.maximum(P, MACHINE_EPSILON) / Q))
-    divergences = P * np.log(np.maximum(P, MACHINE_EPSILON) / Q)
-    kl_divergence = 2.0 * np.sum(divergences)
-    divergences = squareform(divergences)
-    divergences = np.sum(divergences, axis=1)
-
-    # add penalty term for moved points
-    penalty = 0.0
-    if fixed_ids is not None and neighbor_ids is not None:
-        for idx, fixed_id in enumerate(fixed_ids):
-            nbs = neighbor_ids[idx]
-            penalty += np.sum((X_embedded[fixed_id] - X_embedded[nbs])**2)
-        # penalty / = reg_param # for gaussian
-        penalty *= reg_param / (len(fixed_ids) * len(neighbor_ids[0])) # for L2-penalty
-    kl_divergence += penalty
-
-    # Gradient: dC/dY
-    grad = np.ndarray((n_samples, n_components), dtype=params.dtype)
-    PQd = squareform((P - Q) * dist)
-    for i in range(skip_num_points, n_samples):
-        grad[i] = np.dot(np.ravel(PQd[i], order='K'),
-                         X_embedded[i] - X_embedded)
-    c = 2.0 * (degrees_of_freedom + 1.0) / degrees_of_freedom
-    grad *= c
-
-    # gradient of penalty only for the involved points
-    if fixed_ids is not None and neighbor_ids is not None:
-        for idx, fixed_id in enumerate(fixed_ids):
-            nbs = neighbor_ids[idx]
-            # const = 0.5 / reg_param # for gaussian
-            const = (-2 * reg_param / len(nbs)) # for L2-penalty
-            grad[nbs] += const * (X_embedded[fixed_id] - X_embedded[nbs])
-        grad[fixed_ids] = 0.0
-
-    grad = grad.ravel()
-    return kl_divergence, penalty, grad, divergences
-
-
-def my_kl_divergence3(params, P, degrees_of_freedom, n_samples, n_components,
-                      skip_num_points=0,
-                      reg_param=0, fixed_ids=None, neighbor_ids=None):
-
-    X_embedded = params.reshape(n_samples, n_components)
-
-    # Q is a heavy-tailed distribution: Student's t-distribution
-    dist = pdist(X_embedded, "sqeuclidean")
-    dist /= degrees_of_freedom
-    dist += 1.
-    dist **= (degrees_of_freedom + 1.0) / -2.0
-    Q = np.maximum(dist / (2.0 * np.sum(dist)), MACHINE_EPSILON)
-
-    # Optimization trick below: np.dot(x, y) is faster than
-    # np.sum(x * y) because it calls BLAS
-
-    # Objective: C (Kullback-Leibler divergence of P and Q)
-    # kl_divergence = 2.0 * np.dot(P, np.log(np.maximum(P, MACHINE_EPSILON) / Q))
-    divergences = P * np.log(np.maximum(P, MACHINE_EPSILON) / Q)
-    kl_divergence = 2.0 * np.sum(divergences)
-    divergences = squareform(divergences)
-    divergences = np.sum(divergences, axis=1)
-
-    # add penalty term for moved points
-    sigma_square = 1e5
-    neg_log_likelihood = 0.0
-    if fixed_ids is not None and neighbor_ids is not None:
-        for idx, fixed_id in enumerate(fixed_ids):
-            nbs = neighbor_ids[idx]
-            diff = X_embedded[nbs] - X_embedded[fixed_id]
-            diff_norm = np.sum(diff**2, axis=1)
-            diff_norm /= sigma_square
-            diff_norm += 1.0
-            neg_log_likelihood += np.sum(np.log(diff_norm))
-    kl_divergence += neg_log_likelihood
-
-    # Gradient: dC/dY
-    grad = np.ndarray((n_samples, n_components), dtype=params.dtype)
-    PQd = squareform((P - Q) * dist)
-    for i in range(skip_num_points, n_samples):
-        grad[i] = np.dot(np.ravel(PQd[i], order='K'),
-                         X_embedded[i] - X_embedded)
-    c = 2.0 * (degrees_of_freedom + 1.0) / degrees_of_freedom
-    grad *= c
-
-    # gradient of penalty only for the involved points
-    if fixed_ids is not None and neighbor_ids is not None:
-        for idx, fixed_id in enumerate(fixed_ids):
-            nbs = neighbor_ids[idx]
-            const = 2 / sigma_square
-            diff = X_embedded[nbs] - X_embedded[fixed_id]
-            diff_norm = np.sum(diff**2, axis=1)
-            diff_norm /= sigma_square
-            diff_norm += 1.0
-            diff_norm **= -1
-            grad[nbs] += const * diff * diff_norm.reshape(-1,1)
-        grad[fixed_ids] = 0.0
-
-    grad = grad.ravel()
-    return kl_divergence, neg_log_likelihood, grad, divergences
@@ -3,40 +3,61 @@
 
 import threading
 
-from flask import Flask
+from flask import Flask, request
 from flask_sockets import Sockets
 import json
 import time
-import queue
-import numpy as np
 
 import tsnex
 import utils
 import datasets
+import frame_protocol
+import level_of_detail
 
 # flask-socket application
 app = Flask(__name__)
 sockets = Sockets(app)
 
-# Shared states between threads
-shared_states = {
-    # interactive data from client will be put in a queue
-    # this queue will be shared will a thread running tsne code
-    # so that tsne can take into account of client interation.
-    'interaction_data': queue.Queue(),
+# Shared states between threads of each session, by session id.
+# The client chooses its session with the `session_id` query param
+# of the socket URIs, e.g. ws://127.0.0.1:5000/tsnex/do_embedding?session_id=s1
+shared_states = {}
 
-    # thread to run tsne
-    'thread_tsnex': None,
 
-    # thread to send intermediate data to client
-    'thread_pubsub': None
-}
+def get_session_id():
+    """ Session id of the current socket request
+    """
+    return request.args.get('session_id', utils.DEFAULT_SESSION)
+
+
+def get_shared_states(session_id):
+    """ Shared states of a session, created in its first request
+    """
+    if session_id not in shared_states:
+        shared_states[session_id] = {
+            # interactive data from client will be put in a queue
+            # this queue will be shared will the worker process running
+            # tsne code so that tsne can take into account of client interation.
+            'interaction_data': tsnex.new_interaction_queue(),
+
+            # thread waiting for the worker process which runs tsne
+            'thread_tsnex': None,
+
+            # thread to send intermediate data to client
+            'thread_pubsub': None,
+
+            # [x_min, x_max, y_min, y_max] of the view of the client
+            # in the level of detail mode, None if it is zoomed out
+            'viewport': None
+        }
+    return shared_states[session_id]
 
 
 @sockets.route('/tsnex/load_dataset')
 def do_load_dataset(ws):
     """ Socket endpoint to receive command to load a dataset
     """
+    session_id = get_session_id()
     while not ws.closed:
         datasetName = ws.receive()
         if datasetName:
@@ -53,11 +74,12 @@ def do_load_dataset(ws):
                 'type_y': y.dtype.name
             }
 
-            utils.clean_data()  # In dev mode: flush all data in redis
-            utils.set_dataset_metadata(metadata)
-            utils.set_ndarray(name='X_original', arr=X)
-            utils.set_ndarray(name='y_original', arr=y)
-            utils.set_to_db(key='labels', str_value=json.dumps(labels))
+            utils.clean_data(session_id)  # flush all data of the session
+            utils.set_dataset_metadata(metadata, session_id)
+            utils.set_ndarray(name='X_original', arr=X, session_id=session_id)
+            utils.set_ndarray(name='y_original', arr=y, session_id=session_id)
+            utils.set_to_db(key='labels', str_value=json.dumps(labels),
+                            session_id=session_id)
             n_neighbors = 100 #int(0.05 * X.shape[0])
             info = datasets.pre_calculate(X, k=n_neighbors)
             ws.send(json.dumps(info))
@@ -65,101 +87,144 @@ def do_load_dataset(ws):
 
 @sockets.route('/tsnex/do_embedding')
 def do_embedding(ws):
-    """ Socket endpoint to hold all dataframes of the intermediate results
+    """ Socket endpoint to hold all dataframes of the intermediate results,
+        encoded in the version of `frame_protocol` given by the client.
+        With the `lod` query param (number of representative points),
+        the frames of large embeddings are sent at a level of detail.
+        With `resume=1`, the embedding continues from the checkpoint
+        of the last run of the session on the same dataset.
     """
+    session_id = get_session_id()
+    protocol = frame_protocol.get_protocol(request.args.get('protocol'))
+    lod = request.args.get('lod', 0, type=int)
+    resume = request.args.get('resume', 0, type=int) > 0
     while not ws.closed:
         message = ws.receive()
         if message:
             client_iteration = int(message)
             if client_iteration == 0:
-                do_boostrap(ws)
+                do_boostrap(ws, session_id, protocol, lod, resume)
 
 
-def do_boostrap(ws):
+def do_boostrap(ws, session_id=utils.DEFAULT_SESSION,
+                protocol=frame_protocol.PROTOCOL_JSON, lod=0, resume=False):
     """ Util function to do boostrap for setting up the two threads:
-        + A thread do embedding and publish the intermediate result to redis
+        + A thread starts a worker process which does embedding
+            and publishes the intermediate result to redis
         + A second thread subscribes a channel on redis
             to read the intermediate result and send it to client
+        The embedding thread waits for a free worker
+        if there are too many running sessions.
     """
     # if client does not specify the hyper-params, use the default one
-    print("[BOOSTRAP] Setup Thread for TSNEX and PUB/SUB")
+    print("[BOOSTRAP] Setup Thread for TSNEX and PUB/SUB of session {}"
+          .format(session_id))
+    states = get_shared_states(session_id)
 
-    utils.set_server_status()
-    X = utils.get_X()
+    utils.set_server_status(session_id)
+    if resume:
+        utils.update_server_status({'resume': True}, session_id)
 
-    # start a thread to do embedding
+    # start a thread to run the embedding worker
     # note to inject a queue containing the interaction_data
     t1 = threading.Thread(
         name='tsnex_gradient_descent',
         target=tsnex.boostrap_do_embedding,
-        args=(X, shared_states['interaction_data'], ))
+        args=(states['interaction_data'], session_id))
     t1.start()
-    shared_states['thread_tsnex'] = t1
+    states['thread_tsnex'] = t1
 
     # start a thread to listen to the intermediate result
     t2 = threading.Thread(
         name='pubsub_from_redis',
         target=run_send_to_client,
-        args=(ws,))  # specific that `args` is a tuple
+        args=(ws, session_id, protocol, lod))
     t2.start()
-    shared_states['thread_pubsub'] = t2
+    states['thread_pubsub'] = t2
 
 
-def run_send_to_client(ws):
+def run_send_to_client(ws, session_id=utils.DEFAULT_SESSION,
+                       protocol=frame_protocol.PROTOCOL_JSON, lod=0):
     """ Main loop of the thread that read the subscribed data
         and turn it into a json object and send back to client.
-        The returned message is a dataframe in `/tsnex/do_embedding` route
+        The returned message is a dataframe in `/tsnex/do_embedding` route.
+        The thread sleeps until a new dataframe is published
+        or the server is stopped.
+        The labels of the points do not change, they are read once
+        (and sent once in the binary protocol).
+        If `lod` > 0, each frame contains the density of the embedding,
+        `lod` representative points and the points in the viewport.
     """
     print("[PUBSUB] Thread to read subscribed data is starting ... ")
-    while True:
-        fixed_data = utils.get_from_db(key='fixed_points')
-        fixed_ids = []
-        if fixed_data:
-            fixed_points = json.loads(fixed_data)
-            fixed_ids = [int(id) for id in fixed_points.keys()]
-
-        subscribedData = utils.get_subscribed_data()
-        if subscribedData is not None:
-            if not ws.closed:
-                # pause server and wait until client receives new data
-                # if user does not pause client, a `continous` command
-                # will be sent automatically to continue server
-                utils.pause_server()
-
-                # prepare the `embedding` in subscribedData
-                # do not need to touch the other fields
-                X_embedded = subscribedData['embedding']
-                zInfo = subscribedData['z_info']
-                idx = np.argsort(zInfo)[::-1]
-                y = utils.get_y()
-                labels = json.loads(utils.get_from_db(key='labels'))
-                raw_points = [{
-                    'id': str(i),
-                    'x': float(X_embedded[i][0]),
-                    'y': float(X_embedded[i][1]),
-                    'z': float(zInfo[i]),
-                    'text': labels[i],
-                    'label': str(y[i]),
-                    'fixed': i in fixed_ids
-                } for i in idx]
-                subscribedData['embedding'] = raw_points
-                ws.send(json.dumps(subscribedData))
-
-        status = utils.get_server_status(['tick_frequence', 'stop'])
-        if status['stop']:
-            break
-        else:
-            time.sleep(status['tick_frequence'])
+    data_pubsub = utils.subscribe_data(session_id)
+    stop = utils.get_server_status(['stop'], session_id)['stop']
+    y = utils.get_y(session_id)
+    labels = json.loads(utils.get_from_db(key='labels', session_id=session_id))
+    if protocol != frame_protocol.PROTOCOL_JSON and not ws.closed:
+        ws.send(frame_protocol.encode_metadata(y, labels, protocol))
+    delta_encoder = frame_protocol.DeltaFrameEncoder()
+
+    frame_id = 0
+    while not stop:
+        subscribedData, status_changes = \
+            utils.get_subscribed_data(data_pubsub)
+        if status_changes is not None:
+            stop = status_changes.get('stop', False)
+        elif not ws.closed:
+            fixed_data = utils.get_from_db(key='fixed_points',
+                                           session_id=session_id)
+            fixed_ids = []
+            if fixed_data:
+                fixed_points = json.loads(fixed_data)
+                fixed_ids = [int(id) for id in fixed_points.keys()]
+
+            # pause server and wait until client receives new data
+            # if user does not pause client, a `continous` command
+            # will be sent automatically to continue server
+            utils.pause_server(session_id)
+
+            if lod > 0:
+                subscribedData = level_of_detail.reduce_frame(
+                    subscribedData, fixed_ids, n_representatives=lod,
+                    viewport=get_shared_states(session_id)['viewport'])
+
+            if protocol == frame_protocol.PROTOCOL_DELTA:
+                ws.send(delta_encoder.encode(
+                    subscribedData, fixed_ids, frame_id), binary=True)
+            elif protocol == frame_protocol.PROTOCOL_BINARY:
+                ws.send(frame_protocol.encode_frame(
+                    subscribedData, fixed_ids, frame_id), binary=True)
+            else:
+                ws.send(frame_protocol.encode_frame_json(
+                    subscribedData, y, labels, fixed_ids))
+            frame_id += 1
+    data_pubsub.close()
 
 
 @sockets.route('/tsnex/continue_server')
 def continue_server(ws):
     """ Socket endpoint to receive command to continue server after being paused.
     """
+    session_id = get_session_id()
     while not ws.closed:
         message = ws.receive()
         if message:
-            utils.continue_server()
+            utils.continue_server(session_id)
+
+
+@sockets.route('/tsnex/viewport')
+def client_viewport(ws):
+    """ Socket endpoint to receive the viewport of the client in the
+        level of detail mode: `[x_min, x_max, y_min, y_max]` when it zooms in
+        or `null` when it zooms out.
+    """
+    session_id = get_session_id()
+    while not ws.closed:
+        message = ws.receive()
+        if message:
+            viewport = json.loads(message)
+            get_shared_states(session_id)['viewport'] = \
+                [float(v) for v in viewport] if viewport else None
 
 
 @sockets.route('/tsnex/moved_points')
@@ -168,10 +233,12 @@ def client_moved_points(ws):
         If there exsits the old moved points from the previous interaction,
         we should merge them together.
     """
+    session_id = get_session_id()
     while not ws.closed:
         message = ws.receive()
         if message:
-            fixed_data = utils.get_from_db(key='fixed_points')
+            fixed_data = utils.get_from_db(key='fixed_points',
+                                           session_id=session_id)
             fixed_points = json.loads(fixed_data) if fixed_data else {}
             new_moved_points = json.loads(message)
             print("New moving points: ", new_moved_points)
@@ -180,43 +247,71 @@ def client_moved_points(ws):
                 pos = [float(p['x']), float(p['y'])]
                 fixed_points[pid] = pos
 
-            shared_states['interaction_data'].put({
+            get_shared_states(session_id)['interaction_data'].put({
                 'fixed_ids': [int(k) for k in fixed_points.keys()],
                 'fixed_pos': list(fixed_points.values())
             })
 
-            utils.set_to_db('fixed_points', json.dumps(fixed_points))
-            utils.continue_server()
+            utils.set_to_db('fixed_points', json.dumps(fixed_points),
+                            session_id)
+            utils.continue_server(session_id)
+
+
+@sockets.route('/tsnex/links')
+def client_links(ws):
+    """ Socket endpoint to receive the pairwise constraints of the client:
+        `{"mustlinks": [[id1, id2], ...], "cannotlinks": [[id1, id2], ...]}`
+        Each list replaces the current links of its kind,
+        a missing list keeps them.
+    """
+    session_id = get_session_id()
+    while not ws.closed:
+        message = ws.receive()
+        if message:
+            links = json.loads(message)
+            print("New links: ", links)
+            get_shared_states(session_id)['interaction_data'].put({
+                key: [[int(i), int(j)] for i, j in links[key]]
+                for key in ('mustlinks', 'cannotlinks')
+                if links.get(key) is not None
+            })
+            utils.continue_server(session_id)
 
 
 @sockets.route('/tsnex/reset')
 def reset_data(ws):
     """ Socket endpoint to reset the data on server.
     """
+    session_id = get_session_id()
     while not ws.closed:
         message = ws.receive()
         if message and message == "ConfirmReset":
-            do_reset()
+            do_reset(session_id)
 
 
-def do_reset():
+def do_reset(session_id=utils.DEFAULT_SESSION):
+    """ Stop the threads of a session and clean its data,
+        the other sessions are not touched
+    """
     print("[Reset]Receive Reset command from client. Do reset!")
 
     # set a flag to denote it's time to break all running thread
-    utils.update_server_status({'stop': True})
+    utils.update_server_status({'stop': True}, session_id)
 
     # let the tsnex thread to jump out of waiting status
-    utils.continue_server()
+    utils.continue_server(session_id)
 
     # stop all threads
     print("[Reset]Stopping the running threads ... ")
-    if (shared_states['thread_tsnex']):
-        shared_states['thread_tsnex'].join(timeout=0.5)
-    if (shared_states['thread_pubsub']):
-        shared_states['thread_pubsub'].join(timeout=0.5)
+    states = shared_states.pop(session_id, None)
+    if states and states['thread_tsnex']:
+        states['thread_tsnex'].join(timeout=0.5)
+    if states and states['thread_pubsub']:
+        states['thread_pubsub'].join(timeout=0.5)
     time.sleep(1)
     print("[Reset]Threads stopped")
-    utils.clean_data()
+    utils.clean_data(session_id)
+    tsnex.delete_checkpoints(session_id)
     print("[Reset]Done!")
 
 
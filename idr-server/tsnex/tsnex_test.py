@@ -0,0 +1,225 @@
+# test the checkpoints of the embedding of a session (in-memory backend)
+
+import os
+import json
+import threading
+import numpy as np
+import pytest
+from sklearn.datasets import make_blobs
+
+import p_cache
+import utils
+import tsnex
+from engine import InteractiveTSNE, AUTO_EXACT_MAX_SAMPLES, method_for
+
+
+@pytest.fixture
+def session(tmpdir, monkeypatch):
+    """ Session of a small dataset in the in-memory backend,
+        with the caches and the checkpoints in a temporary folder
+    """
+    monkeypatch.setenv('TSNEX_BACKEND', 'memory')
+    monkeypatch.setattr(utils, 'backend', None)
+    monkeypatch.setattr(p_cache, 'CACHE_DIR', str(tmpdir.join('p_cache')))
+    monkeypatch.setattr(tsnex, 'CHECKPOINT_DIR',
+                        str(tmpdir.join('checkpoints')))
+
+    session_id = 'test'
+    X, y = make_blobs(n_samples=100, centers=3, random_state=0)
+    utils.set_dataset_metadata({
+        'shape_X': X.shape, 'type_X': X.dtype.name,
+        'shape_y': y.shape, 'type_y': y.dtype.name
+    }, session_id)
+    utils.set_ndarray(name='X_original', arr=X, session_id=session_id)
+    utils.set_ndarray(name='y_original', arr=y, session_id=session_id)
+    utils.set_server_status(session_id)
+    yield session_id, X
+    utils.clean_data(session_id)
+
+
+def save_checkpoint(X, file_name, n_iter):
+    engine = InteractiveTSNE(X)
+    engine.step(n_iter)
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    engine.save_checkpoint(file_name, errors=[engine.error],
+                           grad_norms=[engine.grad_norm])
+    return engine
+
+
+def run_until_stopped(session_id, **status):
+    """ Run the embedding which saves its checkpoint and stops
+        in its first iteration
+    """
+    utils.update_server_status(dict(status, stop=True, measure=False),
+                               session_id)
+    return tsnex.do_embedding(tsnex.new_interaction_queue(), session_id)
+
+
+def test_checkpoint_round_trip(session):
+    _, X = session
+    file_name = tsnex.checkpoint_file('test', X, 'exact')
+    engine = save_checkpoint(X, file_name, 20)
+    engine.set_links(mustlinks=[[0, 1]])
+    engine.save_checkpoint(file_name)
+
+    restored = InteractiveTSNE(X)
+    restored.load_checkpoint(file_name)
+    assert restored.n_iter == 20
+    np.testing.assert_array_equal(restored.p, engine.p)
+    np.testing.assert_array_equal(restored.gains, engine.gains)
+    np.testing.assert_array_equal(restored.constraints.mustlinks, [[0, 1]])
+
+    # both continue the same way
+    np.testing.assert_allclose(restored.step(), engine.step())
+    np.testing.assert_allclose(restored.p, engine.p)
+
+
+def test_resume_only_when_asked(session):
+    session_id, X = session
+    assert utils.initial_server_status['resume'] is False
+    file_name = tsnex.checkpoint_file(session_id, X, 'exact')
+    engine = save_checkpoint(X, file_name, 20)
+
+    # the checkpoint is overwritten by the new run
+    embedding = run_until_stopped(session_id)
+    assert not np.allclose(embedding, engine.p.reshape(-1, 2))
+    with np.load(file_name) as state:
+        assert int(state['n_iter']) == 0
+
+    engine = save_checkpoint(X, file_name, 20)
+    embedding = run_until_stopped(session_id, resume=True)
+    np.testing.assert_array_equal(embedding, engine.p.reshape(-1, 2))
+    with np.load(file_name) as state:
+        assert int(state['n_iter']) == 20
+
+
+def test_resume_restores_fixed_points(session):
+    session_id, X = session
+    file_name = tsnex.checkpoint_file(session_id, X, 'exact')
+    engine = InteractiveTSNE(X)
+    engine.apply_fixed_points([3], [[1.0, 2.0]])
+    os.makedirs(os.path.dirname(file_name))
+    engine.save_checkpoint(file_name, errors=[], grad_norms=[])
+
+    run_until_stopped(session_id, resume=True)
+    fixed_points = json.loads(utils.get_from_db('fixed_points', session_id))
+    assert fixed_points == {'3': [1.0, 2.0]}
+
+
+def test_auto_method_by_size(session):
+    session_id, X = session
+    assert utils.initial_server_status['method'] == 'auto'
+    assert method_for('auto', AUTO_EXACT_MAX_SAMPLES) == 'exact'
+    assert method_for('auto', 50000) == 'fft'
+    assert method_for('barnes_hut', 50000) == 'barnes_hut'
+
+    # the checkpoint is named after the kernel in use
+    run_until_stopped(session_id)
+    assert os.path.exists(tsnex.checkpoint_file(session_id, X, 'exact'))
+
+
+def test_reset_deletes_the_checkpoints(session):
+    session_id, X = session
+    file_name = tsnex.checkpoint_file(session_id, X, 'exact')
+    other_file_name = tsnex.checkpoint_file('other', X, 'exact')
+    save_checkpoint(X, file_name, 1)
+    save_checkpoint(X, other_file_name, 1)
+
+    tsnex.delete_checkpoints(session_id)
+    assert not os.path.exists(file_name)
+    assert os.path.exists(other_file_name)
+
+
+class EmbeddingThread(threading.Thread):
+    """ Embedding of a session in a thread, of which the published frames
+        are read with `next_frame`
+    """
+
+    def __init__(self, session_id):
+        super(EmbeddingThread, self).__init__()
+        self.session_id = session_id
+        self.data_pubsub = utils.subscribe_data(session_id)
+
+    def run(self):
+        try:
+            tsnex.do_embedding(tsnex.new_interaction_queue(), self.session_id)
+        finally:
+            # unblock the subscriber if the embedding failed
+            utils.notify_status_change({'stop': True}, self.session_id)
+
+    def next_frame(self):
+        data, status_changes = utils.get_subscribed_data(self.data_pubsub)
+        assert status_changes is None
+        return data
+
+    def stop(self):
+        utils.update_server_status({'stop': True}, self.session_id)
+        self.join()
+
+
+@pytest.mark.parametrize('method', ['exact', 'neg_sampling'])
+def test_float32_frames_are_published(session, method):
+    session_id, X = session
+    utils.update_server_status({
+        'method': method, 'precision': 'float32', 'measure': False,
+        'target_fps': 0, 'n_jump': 1, 'tick_frequence': 0.0
+    }, session_id)
+    embedding = EmbeddingThread(session_id)
+    embedding.start()
+    try:
+        data = embedding.next_frame()
+    finally:
+        embedding.stop()
+
+    assert data['embedding'].dtype == np.float32
+    assert data['embedding'].shape == X.shape
+    errors, penalties = data['seriesData'][0]['series']
+    assert all(type(error) is float for error in errors)
+
+
+def test_progress_frames_before_pause_at(session):
+    session_id, _ = session
+    # the frames are not on the multiples of `n_iter_check` (50)
+    utils.update_server_status({
+        'pause_at': 1000, 'accumulate': True, 'measure': False,
+        'target_fps': 0, 'n_jump': 7, 'tick_frequence': 0.0
+    }, session_id)
+    embedding = EmbeddingThread(session_id)
+    embedding.start()
+    try:
+        frames = [embedding.next_frame() for _ in range(3)]
+    finally:
+        embedding.stop()
+
+    # a progress frame every 8 frames (56 iterations)
+    n_errors = [len(data['seriesData'][0]['series'][0]) for data in frames]
+    assert n_errors == [8, 16, 24]
+
+
+def test_idle_loop_wakes_up_on_interaction(session):
+    session_id, X = session
+    engine = InteractiveTSNE(X)
+    engine.step(5)
+    status_cache = utils.StatusCache(session_id)
+    shared_queue = tsnex.mp_context.Queue()
+
+    def interact():
+        # the frames handshake does not wake the loop up,
+        # the put is not followed by a status change
+        utils.pause_server(session_id)
+        utils.continue_server(session_id)
+        shared_queue.put({'fixed_ids': [0], 'fixed_pos': [[5.0, 5.0]]})
+
+    client = threading.Timer(0.3, interact)
+    client.start()
+    tsnex.wait_for_interaction(engine, shared_queue, status_cache)
+    client.join()
+    assert engine.fixed_ids == [0]
+    np.testing.assert_array_equal(engine.p.reshape(-1, 2)[0], [5.0, 5.0])
+
+    # a change of the params wakes the loop up too
+    threading.Timer(0.3, utils.update_server_status,
+                    ({'n_jump': 5}, session_id)).start()
+    tsnex.wait_for_interaction(engine, shared_queue, status_cache)
+    assert status_cache.status['n_jump'] == 5
+    status_cache.close()
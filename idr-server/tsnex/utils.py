@@ -1,18 +1,28 @@
+import os
 import sys
-import queue
+import threading
+import copy
 import json
+import struct
 import numpy as np
-import redis
+import backends
 
 
 # status object to store some server infos
 initial_server_status = {
     # time in second to sleep while waiting the data being sent to client
+    # (only used when `target_fps` is 0)
     'tick_frequence': 0.2,
 
     # number of iterations that we skip sending data to client
+    # (only used when `target_fps` is 0, else it is tuned by `pacing`)
     'n_jump': 10,
 
+    # target number of frames per second sent to client, the number of
+    # iterations between two frames is tuned to the cost of an iteration
+    # and the latency of the client. 0 to use `n_jump` and `tick_frequence`
+    'target_fps': 10.0,
+
     # the current iteration in client, server_iter = client_iter * n_jump
     'client_iter': 0,
 
@@ -22,6 +32,10 @@ initial_server_status = {
     # number of nearest neighbors for each selected point
     'n_neighbors': 10,
 
+    # send the `n_neighbors` nearest neighbors in 2D of each point
+    # in each frame (found with the spatial index of the embedding)
+    'send_neighbors': False,
+
     # accumulate the info of early_exaggeration state
     'accumulate': False,
 
@@ -47,65 +61,191 @@ initial_server_status = {
     # util reaching the predefined milestone
     # set to zero: normal interaction mode
     'pause_at': 0,
+
+    # kernel to calculate the gradient: 'exact', 'barnes_hut' or 'fft'
+    # (repulsive forces interpolated on a grid, for the largest datasets),
+    # or 'neg_sampling' to replace the gradient descent by epochs of
+    # sampled edges and negative samples (LargeVis/UMAP-like optimizer),
+    # or 'auto': 'exact' up to 2k points and 'fft' beyond
+    # (see `engine.method_for`).
+    # Except the 'exact' one, the kernels use a sparse P
+    # over the nearest neighbors, linear in memory.
+    # They are in numpy on one core: an iteration of 'fft' takes ~0.03s
+    # at 10k points and ~0.2s at 50k points, twice faster than 'barnes_hut',
+    # so the frames of 50k points are ~5 per second at most.
+    # An epoch of 'neg_sampling' takes ~0.04s, its embedding is better in
+    # the first minute but it converges to a higher KL divergence
+    # (see `benchmarks.py`)
+    'method': 'auto',
+
+    # trade-off between speed and accuracy of barnes_hut method
+    'angle': 0.5,
+
+    # number of worker processes to calculate the exact gradient,
+    # each of them computes a block of rows of P and Q in shared memory
+    'n_jobs': 1,
+
+    # floating point type of the computation: 'float64' or 'float32'.
+    # In float32, X, P, the distances, the embedding and the optimizer state
+    # take half of the memory (and memory bandwidth)
+    'precision': 'float64',
+
+    # save the state of the optimizer every `checkpoint_every` iterations
+    # (0 to disable). The embedding continues from the last checkpoint
+    # of the dataset only if the client asks for it with the `resume`
+    # query param of `/tsnex/do_embedding`, the reset deletes the checkpoints
+    'checkpoint_every': 50,
+    'resume': False,
+
+    # stop computing when the optimization has converged and
+    # wait for the next interaction or change of parameters
+    'idle_when_converged': True,
 }
 
+# backend to store the dataset and the intermediate results, see `backends`:
+# redis (default) is shared by the web server and the embedding worker
+# processes, on the same host set `TSNEX_REDIS_SOCKET` to the unix socket
+# of redis to avoid the TCP stack between the processes.
+# With `TSNEX_BACKEND=memory`, all is kept in the web server without redis.
+backend = None
+backend_lock = threading.Lock()
 
-# redis database to store the dataset and the intermediate results
-redis_db = redis.StrictRedis(host='localhost', port=6379, db=0)
 
-# prefix key to store data in redis
+def get_backend():
+    """ The backend of this process, created on its first use
+    """
+    global backend
+    with backend_lock:
+        if backend is None:
+            if os.environ.get('TSNEX_BACKEND', 'redis') == 'memory':
+                backend = backends.InMemoryBackend()
+            else:
+                backend = backends.RedisBackend(
+                    unix_socket_path=os.environ.get('TSNEX_REDIS_SOCKET'))
+        return backend
+
+# prefix key to store data in redis,
+# the keys of each session are prefixed by `KEY_PREFIX + session_id + '_'`
 KEY_PREFIX = 'tsnex_demo01_'
 
+# session of the clients which do not give their session id
+DEFAULT_SESSION = 'default'
+
 
-def set_to_db(key, str_value):
+def session_key(key, session_id=DEFAULT_SESSION):
+    """ Full name of a key (or a channel) of a session in redis
+    """
+    return '{}{}_{}'.format(KEY_PREFIX, session_id, key)
+
+
+def set_to_db(key, str_value, session_id=DEFAULT_SESSION):
     """ Set binary string value into redis by key
     """
-    redis_db.set(KEY_PREFIX + key, str_value)
+    get_backend().set(session_key(key, session_id), str_value)
 
 
-def get_from_db(key):
+def get_from_db(key, session_id=DEFAULT_SESSION):
     """ Get binary string value from redis by key
     """
-    return redis_db.get(KEY_PREFIX + key)
+    return get_backend().get(session_key(key, session_id))
 
 
-def clean_data():
-    """ Util function to flush all keys of the current db
+def clean_data(session_id=DEFAULT_SESSION):
+    """ Util function to delete all keys of a session,
+        the other sessions are not touched
     """
-    redis_db.flushdb()
+    get_backend().delete_matching(session_key('*', session_id))
+    drop_status_cache(session_id)
 
 
 # channel name for store intermediate data in redis
 DATA_CHANNEL = 'tsnex_X_embedding'
 
-# publish/subscribe object in redis
-pubsub = redis_db.pubsub()
-pubsub.subscribe(DATA_CHANNEL)
+
+def subscribe_data(session_id=DEFAULT_SESSION):
+    """ Subscribe to the intermediate results and the status changes
+        of a session, which are read by `get_subscribed_data`
+    """
+    return get_backend().subscribe(session_key(DATA_CHANNEL, session_id),
+                                   session_key(STATUS_CHANNEL, session_id))
 
 
-def set_server_status():
+def set_server_status(session_id=DEFAULT_SESSION):
     """ Set status object to redis.
     """
-    set_to_db(key='status', str_value=json.dumps(initial_server_status))
+    set_to_db(key='status', str_value=json.dumps(initial_server_status),
+              session_id=session_id)
+    get_status_cache(session_id).apply(initial_server_status)
+    notify_status_change(initial_server_status, session_id)
 
 
-def update_server_status(userStatusObj):
+def update_server_status(userStatusObj, session_id=DEFAULT_SESSION):
     """ Update the existed server status object in redis.
         It merges the user-defined status object and the old one.
         http://treyhunner.com/2016/02/how-to-merge-dictionaries-in-python/
     """
-    oldStatusStr = get_from_db(key='status')
+    oldStatusStr = get_from_db(key='status', session_id=session_id)
     if oldStatusStr:
         oldStatusObj = json.loads(oldStatusStr)
         mergeObj = {**oldStatusObj, **userStatusObj}
-        set_to_db(key='status', str_value=json.dumps(mergeObj))
+        set_to_db(key='status', str_value=json.dumps(mergeObj),
+                  session_id=session_id)
+        get_status_cache(session_id).apply(userStatusObj)
+        notify_status_change(userStatusObj, session_id)
+
+
+# channel to notify the changed fields of the server status with their values,
+# so that the subscribers keep their copy of the status without reading redis
+STATUS_CHANNEL = 'tsnex_status_changes'
+
+
+def notify_status_change(changes, session_id=DEFAULT_SESSION):
+    """ Publish the changed fields of the server status
+    """
+    get_backend().publish(session_key(STATUS_CHANNEL, session_id),
+                     json.dumps(changes))
+
+
+def subscribe_status_changes(session_id=DEFAULT_SESSION):
+    """ Subscribe to the changes of the server status.
+        Subscribe before reading the current status to not miss a change,
+        then get the next changes with `wait_for_status_change`
+        or `poll_status_changes`.
+    """
+    return get_backend().subscribe(session_key(STATUS_CHANNEL, session_id))
+
+
+def wait_for_status_change(status_pubsub):
+    """ Block (without using the CPU) until the server status is changed
+        Returns:
+            dict of the changed fields and their new values
+    """
+    for msg in status_pubsub.listen():
+        if msg['type'] == 'message':
+            return json.loads(msg['data'])
+    # the subscription is closed: no change will come
+    return {'stop': True}
+
+
+def poll_status_changes(status_pubsub):
+    """ Get all the pending changes of the server status without blocking
+        Returns:
+            dict of the changed fields and their new values, empty if no change
+    """
+    changes = {}
+    msg = status_pubsub.get_message()
+    while msg is not None:
+        if msg['type'] == 'message':
+            changes.update(json.loads(msg['data']))
+        msg = status_pubsub.get_message()
+    return changes
 
 
-def get_dict_from_db(key, fields=[]):
+def get_dict_from_db(key, fields=[], session_id=DEFAULT_SESSION):
     """ Get a python dict object from redis.
         Return the required fields or all dict if the fields are not specified.
     """
-    dataStr = get_from_db(key=key)
+    dataStr = get_from_db(key=key, session_id=session_id)
     dataObj = json.loads(dataStr)
     if not fields:
         return dataObj
@@ -113,39 +253,115 @@ def get_dict_from_db(key, fields=[]):
         return {field: dataObj[field] for field in fields}
 
 
-def get_server_status(fields=[]):
-    """ Get server status object from redis.
+class StatusCache(object):
+    """ Process-local copy of the server status of a session.
+        The status is read once from redis, then only the notified changes
+        are applied: reading the status does not touch redis.
+    """
+
+    def __init__(self, session_id=DEFAULT_SESSION):
+        super(StatusCache, self).__init__()
+        self.session_id = session_id
+        self.lock = threading.Lock()
+        # subscribe before reading the status to not miss a change
+        self.status_pubsub = subscribe_status_changes(session_id)
+        self.status = get_dict_from_db(key='status', session_id=session_id)
+
+    def apply(self, changes):
+        """ Apply the changes of the status made by this process
+        """
+        with self.lock:
+            self.status.update(changes)
+
+    def poll(self):
+        """ Apply the pending changes of the status without blocking
+            Returns:
+                dict of the changed fields and their new values
+        """
+        with self.lock:
+            changes = poll_status_changes(self.status_pubsub)
+            self.status.update(changes)
+            return changes
+
+    def get(self, fields=[]):
+        """ Get the up-to-date status, or its required fields
+        """
+        self.poll()
+        with self.lock:
+            if not fields:
+                return dict(self.status)
+            return {field: self.status[field] for field in fields}
+
+    def wait(self):
+        """ Block until the status is changed by any process
+            (only used by the thread which owns this cache)
+            Returns:
+                dict of the changed fields and their new values
+        """
+        changes = wait_for_status_change(self.status_pubsub)
+        self.apply(changes)
+        return changes
+
+    def close(self):
+        self.status_pubsub.close()
+
+
+# status caches of the sessions used in this process
+status_caches = {}
+status_caches_lock = threading.Lock()
+
+
+def get_status_cache(session_id=DEFAULT_SESSION):
+    """ Shared status cache of a session in this process
+    """
+    with status_caches_lock:
+        if session_id not in status_caches:
+            status_caches[session_id] = StatusCache(session_id)
+        return status_caches[session_id]
+
+
+def drop_status_cache(session_id=DEFAULT_SESSION):
+    """ Forget the cached status of a session when its data is cleaned
     """
-    return get_dict_from_db(key='status', fields=fields)
+    with status_caches_lock:
+        status_cache = status_caches.pop(session_id, None)
+    if status_cache is not None:
+        status_cache.close()
 
 
-def get_ready_status():
+def get_server_status(fields=[], session_id=DEFAULT_SESSION):
+    """ Get server status object from the local cache of the status.
+    """
+    return get_status_cache(session_id).get(fields)
+
+
+def get_ready_status(session_id=DEFAULT_SESSION):
     """ Get a `ready` flag in a server status object.
         This flag controls wherether the computational loop will continue or not
     """
-    statusObj = get_server_status(fields=['ready'])
+    statusObj = get_server_status(fields=['ready'], session_id=session_id)
     return statusObj['ready']
 
 
-def pause_server():
+def pause_server(session_id=DEFAULT_SESSION):
     """ After sending one dataframe containing the intermediate result to client,
         the server is paused in order to wait for the next command from client.
         The client can pause for a while to interact with the result,
         or it will send automatically an ACK to make the server to continue.
     """
-    status = get_server_status(fields=['client_iter'])
+    status = get_server_status(fields=['client_iter'], session_id=session_id)
     next_client_iter = status['client_iter'] + 1
     update_server_status({
         'client_iter': next_client_iter,
         'ready': False
-    })
+    }, session_id)
 
 
-def continue_server():
+def continue_server(session_id=DEFAULT_SESSION):
     """ Util function to set a `ready` flag of server status object to True
         in order to make the computational loop continue running
     """
-    update_server_status({'ready': True})
+    update_server_status({'ready': True}, session_id)
 
 
 # Skeleton dataset meta data.
@@ -161,72 +377,160 @@ skeleton_dataset_metadata = {
 }
 
 
-def set_dataset_metadata(metadata):
+def set_dataset_metadata(metadata, session_id=DEFAULT_SESSION):
     """ Set dataset meta object to redis
     """
-    set_to_db(key='metadata', str_value=json.dumps(metadata))
+    set_to_db(key='metadata', str_value=json.dumps(metadata),
+              session_id=session_id)
 
 
-def get_dataset_metadata(fields=[]):
+def get_dataset_metadata(fields=[], session_id=DEFAULT_SESSION):
     """ Get meta data from redis and return the required fields
     """
-    return get_dict_from_db(key='metadata', fields=fields)
+    return get_dict_from_db(key='metadata', fields=fields,
+                            session_id=session_id)
 
 
-def publish_data(data):
-    """ Push intermediate result into a redis channel
-    """
-    redis_db.publish(DATA_CHANNEL, json.dumps(data))
+# binary envelope of the published intermediate results:
+#   DATA_HEADER: magic b'TSXD', length of the json header (uint32)
+#   json header: {'fields': the json fields of the result,
+#                 'arrays': [[name, dtype, shape, offset], ...]}
+#   the raw buffers of the ndarray fields, each one aligned on 8 bytes
+# so that the ndarrays are not encoded as text and are decoded without copy.
+DATA_MAGIC = b'TSXD'
+DATA_HEADER = struct.Struct('<4sI')
+DATA_ALIGNMENT = 8
 
 
-def get_subscribed_data():
-    """ Get subscribled from published channel in redis
+def pack_data(data):
+    """ Binary envelope of an intermediate result (dict)
     """
-    msg = pubsub.get_message()
-    if not msg or msg['type'] != 'message':
-        return None
-
-    data_obj = json.loads(msg['data'])
-    embedding_str = data_obj['embedding'].encode('latin-1')
-    data_obj['embedding'] = \
-        np.fromstring(embedding_str, dtype=np.float32).reshape(-1, 2)
-    return data_obj
+    fields = {}
+    arrays = []
+    buffers = []
+    offset = 0
+    for name, value in data.items():
+        if isinstance(value, np.ndarray):
+            value = np.ascontiguousarray(value)
+            arrays.append([name, value.dtype.str, value.shape, offset])
+            padding = -value.nbytes % DATA_ALIGNMENT
+            buffers.append(value.tobytes() + b'\0' * padding)
+            offset += value.nbytes + padding
+        else:
+            fields[name] = value
+
+    header = json.dumps({'fields': fields, 'arrays': arrays}).encode('utf-8')
+    header += b' ' * (-(DATA_HEADER.size + len(header)) % DATA_ALIGNMENT)
+    return b''.join([DATA_HEADER.pack(DATA_MAGIC, len(header)), header] +
+                    buffers)
+
+
+def unpack_data(message):
+    """ Decode the envelope of `pack_data`,
+        the ndarrays are read-only views of `message`
+    """
+    magic, header_size = DATA_HEADER.unpack_from(message)
+    if magic != DATA_MAGIC:
+        raise ValueError("Not an intermediate result")
+    start = DATA_HEADER.size + header_size
+    header = json.loads(message[DATA_HEADER.size:start].decode('utf-8'))
+
+    data = header['fields']
+    for name, dtype, shape, offset in header['arrays']:
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        data[name] = np.frombuffer(message, dtype=dtype, count=count,
+                                   offset=start + offset).reshape(shape)
+    return data
+
+
+def snapshot_data(data):
+    """ Copy of an intermediate result which is not changed by the embedding
+        loop: the ndarrays are read-only copies, the other fields are deep
+        copies (the loop appends to the series)
+    """
+    snapshot = {}
+    for name, value in data.items():
+        if isinstance(value, np.ndarray):
+            value = np.array(value)
+            value.flags.writeable = False
+        else:
+            value = copy.deepcopy(value)
+        snapshot[name] = value
+    return snapshot
+
+
+def publish_data(data, session_id=DEFAULT_SESSION):
+    """ Push intermediate result into the redis channel of a session.
+        The ndarray fields (e.g. `embedding`, `z_info`) are sent as raw
+        buffers in the envelope of `pack_data`.
+        In a backend of this process, the frame is a `snapshot_data` of
+        the result, without the encoding (~6x faster).
+    """
+    backend = get_backend()
+    message = pack_data(data) if backend.multiprocess \
+        else snapshot_data(data)
+    backend.publish_frame(session_key(DATA_CHANNEL, session_id), message)
+
+
+def get_subscribed_data(data_pubsub):
+    """ Block until the next message of the channels subscribed by
+        `subscribe_data`: an intermediate result or a change of the status
+    Returns:
+        data (dict): the intermediate result, None if the status is changed
+        status_changes (dict): the changed fields of the status, or None
+    """
+    for msg in data_pubsub.listen():
+        if msg['type'] != 'message':
+            continue
+        channel = msg['channel']
+        if isinstance(channel, bytes):
+            channel = channel.decode('utf-8')
+        if channel.endswith(STATUS_CHANNEL):
+            return None, json.loads(msg['data'])
+        data = msg['data']
+        if isinstance(data, dict):  # a snapshot in a backend of this process
+            return data, None
+        return unpack_data(data), None
+    # the subscription is closed: the reader stops
+    return None, {'stop': True}
 
 
 # Utils function to get/set numpy ndarray
 
-def set_ndarray(name, arr):
-    """ Set numpy ndarray to key name in redis
+def set_ndarray(name, arr, session_id=DEFAULT_SESSION):
+    """ Set numpy ndarray to key name in the backend
     """
-    set_to_db(key=name, str_value=arr.ravel().tostring())
+    get_backend().set_array(session_key(name, session_id), arr)
 
 
-def get_ndarray(name, arr_shape, arr_type):
-    """ Get numpy ndarray from redis by key and reshape
+def get_ndarray(name, arr_shape, arr_type, session_id=DEFAULT_SESSION):
+    """ Get numpy ndarray (read-only) from the backend by key and reshape
     """
-    arr_str = get_from_db(key=name)
-    return np.fromstring(arr_str, dtype=np.dtype(arr_type)) \
-        .reshape(arr_shape)
+    return get_backend().get_array(session_key(name, session_id),
+                                   arr_shape, arr_type)
 
 
 # Utils function for get dataset
 
-def get_X():
+def get_X(session_id=DEFAULT_SESSION):
     """ Util function to get original X
     """
-    metadata = get_dataset_metadata(['shape_X', 'type_X'])
+    metadata = get_dataset_metadata(['shape_X', 'type_X'], session_id)
     return get_ndarray(name='X_original',
                        arr_shape=metadata['shape_X'],
-                       arr_type=metadata['type_X'])
+                       arr_type=metadata['type_X'],
+                       session_id=session_id)
 
 
-def get_y():
+def get_y(session_id=DEFAULT_SESSION):
     """ Util function to get original y
     """
-    metadata = get_dataset_metadata(['shape_y', 'type_y'])
+    metadata = get_dataset_metadata(['shape_y', 'type_y'], session_id)
     return get_ndarray(name='y_original',
                        arr_shape=metadata['shape_y'],
-                       arr_type=metadata['type_y'])
+                       arr_type=metadata['type_y'],
+                       session_id=session_id)
 
 
 def print_progress(i, n):
@@ -0,0 +1,89 @@
+# test the envelope of the intermediate results published to the clients
+
+import threading
+import numpy as np
+import pytest
+
+import backends
+import utils
+
+
+@pytest.mark.parametrize('n_points', [0, 1, 3, 10])
+def test_pack_data_round_trip(n_points):
+    random_state = np.random.RandomState(n_points)
+    data = {
+        'embedding': random_state.randn(n_points, 2).astype(np.float32),
+        'z_info': random_state.rand(n_points),
+        'ids': np.arange(n_points, dtype=np.int32)[::-1],  # not contiguous
+        'seriesData': [{'name': 'errors', 'series': [[1.5, 1.2]]}],
+        'n_iter': 42
+    }
+    message = utils.pack_data(data)
+    decoded = utils.unpack_data(message)
+
+    assert sorted(decoded) == sorted(data)
+    for name in ('embedding', 'z_info', 'ids'):
+        assert decoded[name].dtype == data[name].dtype
+        np.testing.assert_array_equal(decoded[name], data[name])
+        # the arrays are aligned read-only views of the message
+        assert not decoded[name].flags.writeable
+        assert decoded[name].ctypes.data % utils.DATA_ALIGNMENT == 0 or \
+            decoded[name].size == 0
+    assert decoded['seriesData'] == data['seriesData']
+    assert decoded['n_iter'] == 42
+
+
+def test_unpack_data_of_another_message():
+    with pytest.raises(ValueError):
+        utils.unpack_data(b'{"stop": true}' + b' ' * 16)
+
+
+@pytest.fixture
+def memory_backend(monkeypatch):
+    monkeypatch.setattr(utils, 'backend', backends.InMemoryBackend())
+    monkeypatch.setattr(utils, 'status_caches', {})
+
+
+def test_publish_data(memory_backend):
+    utils.set_server_status('s1')
+    subscription = utils.subscribe_data('s1')
+    embedding = np.arange(6.0).reshape(3, 2)
+    utils.publish_data({'embedding': embedding, 'n_iter': 1}, 's1')
+    utils.update_server_status({'stop': True}, 's1')
+
+    data, status_changes = utils.get_subscribed_data(subscription)
+    np.testing.assert_array_equal(data['embedding'], embedding)
+    assert data['n_iter'] == 1 and status_changes is None
+    data, status_changes = utils.get_subscribed_data(subscription)
+    assert data is None and status_changes['stop']
+    subscription.close()
+
+
+def test_status_cache_applies_the_changes(memory_backend):
+    utils.set_server_status('s1')
+    utils.set_server_status('s2')
+    cache = utils.StatusCache('s1')
+    assert cache.status == utils.get_dict_from_db('status', session_id='s1')
+    assert cache.poll() == {}
+
+    # only the changed fields of the session are returned
+    utils.update_server_status({'n_jump': 5, 'ready': False}, 's1')
+    utils.update_server_status({'n_jump': 7}, 's2')
+    utils.continue_server('s1')
+    assert cache.poll() == {'n_jump': 5, 'ready': True}
+    assert cache.poll() == {}
+    assert cache.get(['n_jump', 'ready']) == {'n_jump': 5, 'ready': True}
+    assert cache.get() == utils.get_server_status(session_id='s1') == \
+        utils.get_dict_from_db('status', session_id='s1')
+    cache.close()
+
+
+def test_status_cache_waits_for_a_change(memory_backend):
+    utils.set_server_status('s1')
+    cache = utils.StatusCache('s1')
+    threading.Timer(0.2, utils.update_server_status,
+                    ({'pause_at': 10}, 's1')).start()
+    assert cache.wait() == {'pause_at': 10}
+    assert cache.status['pause_at'] == 10
+    assert cache.get() == utils.get_server_status(session_id='s1')
+    cache.close()
@@ -1,8 +1,9 @@
+import os
+import sys
 import numpy as np
 import pickle
+from functools import partial
 
-from sklearn.neighbors import NearestNeighbors
-from sklearn.manifold.t_sne import _joint_probabilities_nn
 from scipy.spatial.distance import pdist
 from scipy.spatial.distance import squareform
 
@@ -11,43 +12,24 @@ from constraint_utils import *
 
 from metrics import DRMetric
 
+# P is calculated as in the server and its cache on disk is shared
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'idr-server', 'tsnex'))
+import p_cache
+import joint_probabilities
+
 
 MACHINE_EPSILON = np.finfo(np.double).eps
 
 
 def compute_P(X, perplexity):
     """ utils function to calculate P matrix in high dim
-        /opt/anaconda3/lib/python3.6/site-packages/sklearn/manifold/t_sne.py
-        TODO: try to cache
+        over the 3 * perplexity nearest neighbors, as the server does
+        (`joint_probabilities_nn`). P is cached on disk by dataset and perplexity
     """
-
-    n_samples = X.shape[0]
-
-    # Compute the number of nearest neighbors to find.
-    # LvdM uses 3 * perplexity as the number of neighbors.
-    # In the event that we have very small # of points
-    # set the neighbors to n - 1.
-    k = min(n_samples - 1, int(3. * perplexity + 1))
-
-    # Find the nearest neighbors for every point
-    knn = NearestNeighbors(algorithm='auto', n_neighbors=k)
-    knn.fit(X)
-    distances_nn, neighbors_nn = knn.kneighbors(None, n_neighbors=k)
-
-    # Free the memory used by the ball_tree
-    del knn
-
-    # knn return the euclidean distance but we need it squared
-    # to be consistent with the 'exact' method. Note that the
-    # the method was derived using the euclidean method as in the
-    # input space. Not sure of the implication of using a different
-    # metric.
-    distances_nn **= 2
-
-    # compute the joint probability distribution for the input space
-    P = _joint_probabilities_nn(
-        distances_nn, neighbors_nn, perplexity, verbose=0)
-    # return P.todense()
+    k = joint_probabilities.n_neighbors_of(X.shape[0], perplexity)
+    P = p_cache.get_P(X, perplexity, k, partial(
+        joint_probabilities.joint_probabilities_nn, X, perplexity))
     return np.maximum(P.todense(), MACHINE_EPSILON)
 
 